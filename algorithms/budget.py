@@ -0,0 +1,66 @@
+import time
+
+# Минимальный интервал между записями в трассу длины маршрута (секунды)
+TRACE_INTERVAL = 0.05
+
+
+class SearchBudget:
+    """
+    Бюджет решения: ограничение по времени, целевой разрыв с нижней оценкой
+    и трасса «время → длина маршрута»
+
+    Аргументы:
+        time_limit: ограничение по времени в секундах (None — без ограничения)
+        target_length: длина маршрута (км), при достижении которой поиск
+            можно остановить (None — не задана)
+    """
+
+    def __init__(self, time_limit=None, target_length=None):
+        self.started = time.perf_counter()
+        self.deadline = None if time_limit is None else self.started + time_limit
+        self.target_length = target_length
+        self.trace = []
+        self.timed_out = False
+        self._last_record = None
+
+    def elapsed(self):
+        """Время с начала решения, секунды"""
+        return time.perf_counter() - self.started
+
+    def remaining(self):
+        """Оставшееся время, секунды (None — без ограничения)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.perf_counter())
+
+    def expired(self):
+        """Истекло ли отведённое время"""
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.timed_out = True
+        return self.timed_out
+
+    def reached(self, length):
+        """Достигнута ли целевая длина маршрута"""
+        return self.target_length is not None and length <= self.target_length
+
+    def record(self, length, force=False):
+        """
+        Запись точки трассы (не чаще TRACE_INTERVAL, если не force)
+        """
+        now = self.elapsed()
+        if force or self._last_record is None or now - self._last_record >= TRACE_INTERVAL:
+            self.trace.append((round(now, 4), round(float(length), 4)))
+            self._last_record = now
+
+    def limited(self, time_limit):
+        """
+        Бюджет части поиска: не дольше time_limit секунд и не позже общего
+        срока; трасса и отсчёт времени — общие с этим бюджетом
+        """
+        child = SearchBudget(time_limit, self.target_length)
+        if self.deadline is not None:
+            child.deadline = min(child.deadline, self.deadline)
+        child.started = self.started
+        child.trace = self.trace
+        child._last_record = self._last_record
+        return child
@@ -0,0 +1,190 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from algorithms.distance import haversine_matrix
+
+logger = logging.getLogger(__name__)
+
+# Отношение «по дорогам / по прямой», пока не накоплено своих данных
+DEFAULT_ROAD_FACTOR = 1.3
+
+# Пары дальше этого расстояния по прямой (км) не запрашиваются у сервиса,
+# а оцениваются как расстояние по прямой × выученный коэффициент
+DEFAULT_MAX_ROAD_KM = 50.0
+
+# Размер блока (источники × назначения) в одном запросе к сервису
+DEFAULT_BLOCK_SIZE = 10
+
+# Пары ближе этого расстояния (км) не участвуют в оценке коэффициента:
+# на коротких отрезках отношение слишком шумное
+_FACTOR_MIN_KM = 0.5
+
+# Знаков после запятой в координатах ключа пары (~0,1 м)
+_KEY_PRECISION = 6
+
+
+class HaversineProvider:
+    """Стоимость перехода — расстояние по прямой (Haversine), км"""
+
+    name = 'haversine'
+
+    def matrix(self, latitudes, longitudes):
+        """Матрица стоимостей (N, N)"""
+        return haversine_matrix(latitudes, longitudes)
+
+
+class RoadMatrixProvider:
+    """
+    Стоимость перехода — расстояние по дорогам, км (матрица может быть
+    несимметричной: cost[i][j] — путь из i в j)
+
+    Известные пары берутся из постоянного кэша, недостающие запрашиваются
+    у сервиса блоками параллельно. Для пар дальше max_road_km и пар, которые
+    получить не удалось, берётся расстояние по прямой, умноженное на
+    коэффициент, выученный по известным парам.
+
+    Аргументы:
+        fetch_block: функция (источники, назначения) -> массив км (NaN — нет данных);
+            точки передаются списками пар [широта, долгота]
+        pair_cache: кэш пар с методами get_many(keys) и set_many(items) (например,
+            utils.response_cache.PersistentCache) или None
+        mode: режим передвижения (входит в ключ кэша)
+        max_road_km: наибольшее расстояние по прямой для запроса пары
+        block_size: размер блока в одном запросе
+        workers: число параллельных запросов
+    """
+
+    name = 'road'
+
+    def __init__(self, fetch_block, pair_cache=None, mode='driving', max_road_km=DEFAULT_MAX_ROAD_KM,
+                 block_size=DEFAULT_BLOCK_SIZE, workers=4):
+        self.fetch_block = fetch_block
+        self.pair_cache = pair_cache
+        self.mode = mode
+        self.max_road_km = max_road_km
+        self.block_size = block_size
+        self.workers = workers
+        self.stats = {}
+
+    def _point_keys(self, latitudes, longitudes):
+        return [
+            f'{lat:.{_KEY_PRECISION}f},{lon:.{_KEY_PRECISION}f}'
+            for lat, lon in zip(latitudes, longitudes)
+        ]
+
+    def _pair_key(self, origin, destination):
+        return f'{self.mode}:{origin}:{destination}'
+
+    def _factor_key(self):
+        return f'{self.mode}:factor'
+
+    def matrix(self, latitudes, longitudes):
+        """Матрица стоимостей (N, N), км"""
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        n = len(latitudes)
+
+        straight = haversine_matrix(latitudes, longitudes)
+        cost = np.full((n, n), np.nan)
+        np.fill_diagonal(cost, 0.0)
+
+        wanted = straight <= self.max_road_km
+        np.fill_diagonal(wanted, False)
+        rows, cols = np.nonzero(wanted)
+
+        points = self._point_keys(latitudes, longitudes)
+        keys = [self._pair_key(points[i], points[j]) for i, j in zip(rows.tolist(), cols.tolist())]
+
+        # Известные пары — из кэша
+        cached = {}
+        if self.pair_cache is not None and keys:
+            cached = self.pair_cache.get_many(keys + [self._factor_key()])
+        for key, i, j in zip(keys, rows.tolist(), cols.tolist()):
+            if key in cached:
+                cost[i, j] = cached[key]
+
+        fetched = self._fetch_missing(latitudes, longitudes, cost, wanted)
+
+        if self.pair_cache is not None and fetched:
+            self.pair_cache.set_many({
+                self._pair_key(points[i], points[j]): value for (i, j), value in fetched.items()
+            })
+
+        factor = self._learn_factor(cost, straight, cached.get(self._factor_key()))
+        missing = np.isnan(cost)
+        cost[missing] = straight[missing] * factor
+
+        self.stats = {
+            'pairs': n * (n - 1),
+            'cached': len(cached) - (self._factor_key() in cached),
+            'fetched': len(fetched),
+            'approximated': int(missing.sum()),
+            'factor': factor,
+        }
+        logger.info(f"Матрица по дорогам {n}×{n}: {self.stats}")
+        return cost
+
+    def _fetch_missing(self, latitudes, longitudes, cost, wanted):
+        """
+        Запрос недостающих пар блоками block_size × block_size параллельно
+
+        Возвращает:
+            словарь {(i, j): км} для полученных пар
+        """
+        missing = wanted & np.isnan(cost)
+        if not missing.any():
+            return {}
+
+        size = self.block_size
+        n = len(latitudes)
+        blocks = []
+        for row_start in range(0, n, size):
+            row_block = missing[row_start:row_start + size]
+            if not row_block.any():
+                continue
+            origins = np.arange(row_start, min(row_start + size, n))
+            # Назначения — только столбцы, где в этих строках есть пропуски
+            columns = np.flatnonzero(row_block.any(axis=0))
+            for col_start in range(0, len(columns), size):
+                blocks.append((origins, columns[col_start:col_start + size]))
+
+        def fetch(block):
+            origins, destinations = block
+            try:
+                return self.fetch_block(
+                    np.column_stack((latitudes[origins], longitudes[origins])).tolist(),
+                    np.column_stack((latitudes[destinations], longitudes[destinations])).tolist()
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось получить блок матрицы по дорогам: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(fetch, blocks))
+
+        fetched = {}
+        for (origins, destinations), values in zip(blocks, results):
+            if values is None:
+                continue
+            values = np.asarray(values, dtype=np.float64)
+            for a, i in enumerate(origins.tolist()):
+                for b, j in enumerate(destinations.tolist()):
+                    if i != j and missing[i, j] and not np.isnan(values[a, b]):
+                        cost[i, j] = fetched[(i, j)] = float(values[a, b])
+        return fetched
+
+    def _learn_factor(self, cost, straight, previous):
+        """
+        Медиана отношения «по дорогам / по прямой» по известным парам;
+        сохраняется в кэш и служит начальным значением в следующий раз
+        """
+        known = ~np.isnan(cost) & (straight > _FACTOR_MIN_KM)
+        if not known.any():
+            return previous if previous is not None else DEFAULT_ROAD_FACTOR
+
+        factor = float(np.median(cost[known] / straight[known]))
+        if self.pair_cache is not None:
+            self.pair_cache.set_many({self._factor_key(): factor})
+        return factor
@@ -0,0 +1,256 @@
+import numpy as np
+
+from algorithms.budget import SearchBudget
+from algorithms.distance import haversine_matrix, haversine_one_to_many, path_length
+from algorithms.insertion import REPAIR_WINDOW, repair_window
+from algorithms.local_search import improve_tour
+
+# Число точек в кластере: кластер решается отдельно, поэтому матрица
+# расстояний кластера (CLUSTER_SIZE², float64) должна быть небольшой
+CLUSTER_SIZE = 500
+
+# Разрядность кривой Гильберта по каждой оси (сетка 2¹⁶ × 2¹⁶)
+HILBERT_BITS = 16
+
+# Стоимость выхода из последней точки кластера: с ней точка выхода выгодна
+# только в конце пути по кластеру
+_LOCKED_COST = 1e9
+
+
+def hilbert_keys(latitudes, longitudes, bits=HILBERT_BITS):
+    """
+    Номера точек вдоль кривой Гильберта, векторно
+
+    Координаты проецируются на плоскость (долгота умножается на косинус
+    средней широты) и переводятся в сетку 2^bits × 2^bits. Близкие номера —
+    у близких точек, поэтому отрезки отсортированного по номерам списка
+    образуют компактные кластеры.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    side = 1 << bits
+
+    x = (longitudes - longitudes.min()) * np.cos(np.radians(latitudes.mean()))
+    y = latitudes - latitudes.min()
+    span = max(float(x.max()), float(y.max())) or 1.0
+    x = np.minimum((x / span * side).astype(np.int64), side - 1)
+    y = np.minimum((y / span * side).astype(np.int64), side - 1)
+
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = side >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx) ^ ry)
+        # Поворот четверти, чтобы кривая внутри неё шла в нужную сторону
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return keys
+
+
+def partition(latitudes, longitudes, cluster_size=CLUSTER_SIZE):
+    """
+    Разбиение точек на кластеры примерно по cluster_size соседних точек
+    вдоль кривой Гильберта
+
+    Возвращает:
+        список массивов индексов точек кластеров
+    """
+    n = len(latitudes)
+    order = np.argsort(hilbert_keys(latitudes, longitudes), kind='stable')
+    count = max(1, round(n / cluster_size))
+    return np.array_split(order, count)
+
+
+def solve_cluster(task):
+    """
+    Путь по точкам кластера от точки входа до точки выхода: ближайший сосед
+    и, по желанию, 2-opt/Or-opt по матрице с закреплённой точкой выхода.
+    Выполняется в рабочем процессе.
+
+    Аргументы:
+        task: словарь с массивами latitudes, longitudes, индексами entry и
+            exit (exit = entry для кластера из одной точки) и параметрами
+            improve, time_limit
+
+    Возвращает:
+        массив индексов точек кластера в порядке обхода
+    """
+    from algorithms.tsp_solver import nearest_neighbor_order
+
+    latitudes = task['latitudes']
+    longitudes = task['longitudes']
+    entry, exit_ = task['entry'], task['exit']
+    n = len(latitudes)
+    if n == 1:
+        return np.zeros(1, dtype=np.int64)
+
+    # Точка входа — первая, точка выхода — последняя
+    middle = np.array([idx for idx in range(n) if idx != entry and idx != exit_], dtype=np.int64)
+    local = np.concatenate(([entry], middle, [exit_]))
+    lats, lons = latitudes[local], longitudes[local]
+
+    order = np.append(nearest_neighbor_order(lats[:-1], lons[:-1]), n - 1)
+    if task.get('improve') and n >= 4:
+        cost = haversine_matrix(lats, lons)
+        cost[-1, :-1] = _LOCKED_COST
+        budget = SearchBudget(task.get('time_limit'))
+        order = improve_tour(order, lats, lons, budget=budget, cost=cost)
+    return local[order]
+
+
+def _cluster_sequence(latitudes, longitudes, clusters, start):
+    """
+    Порядок обхода кластеров: маршрут по их центрам (ближайший сосед и
+    2-opt/Or-opt) от кластера с начальной точкой
+    """
+    from algorithms.tsp_solver import nearest_neighbor_order
+
+    first = next(idx for idx, members in enumerate(clusters) if start in members)
+    rest = [idx for idx in range(len(clusters)) if idx != first]
+    ids = np.array([first] + rest, dtype=np.int64)
+
+    centers_lat = np.array([latitudes[clusters[idx]].mean() for idx in ids])
+    centers_lon = np.array([longitudes[clusters[idx]].mean() for idx in ids])
+    order = nearest_neighbor_order(centers_lat, centers_lon)
+    order = improve_tour(order, centers_lat, centers_lon)
+    return ids[order]
+
+
+def _boundary_points(latitudes, longitudes, sequence, clusters, start):
+    """
+    Точки входа и выхода кластеров с учётом соседей по последовательности:
+    выход — точка кластера, ближайшая к центру следующего кластера, вход
+    следующего — его точка, ближайшая к этому выходу
+
+    Возвращает:
+        списки (вход, выход) — индексы внутри кластеров в порядке sequence
+    """
+    entries, exits = [], []
+    previous_exit = None
+    for position, cluster_id in enumerate(sequence):
+        members = clusters[cluster_id]
+        lats, lons = latitudes[members], longitudes[members]
+
+        if previous_exit is None:
+            entry = int(np.flatnonzero(members == start)[0])
+        else:
+            entry = int(np.argmin(haversine_one_to_many(
+                latitudes[previous_exit], longitudes[previous_exit], lats, lons
+            )))
+
+        if len(members) == 1:
+            exit_ = entry
+        elif position == len(sequence) - 1:
+            # Конец маршрута свободен: выход — самая дальняя от входа точка
+            # (но не сам вход, даже если все точки кластера совпадают)
+            distances = haversine_one_to_many(lats[entry], lons[entry], lats, lons)
+            distances[entry] = -np.inf
+            exit_ = int(np.argmax(distances))
+        else:
+            following = clusters[sequence[position + 1]]
+            distances = haversine_one_to_many(
+                latitudes[following].mean(), longitudes[following].mean(), lats, lons
+            )
+            distances[entry] = np.inf
+            exit_ = int(np.argmin(distances))
+
+        entries.append(entry)
+        exits.append(exit_)
+        previous_exit = members[exit_]
+    return entries, exits
+
+
+def repair_seams(order, latitudes, longitudes, seams, window=REPAIR_WINDOW, budget=None):
+    """
+    Локальное улучшение маршрута вокруг стыков кластеров (позиции seams)
+    2-opt/Or-opt на участках по window точек в каждую сторону
+    """
+    order = np.asarray(order, dtype=np.int64).copy()
+    for position in seams:
+        if budget is not None and budget.expired():
+            break
+        start = max(0, position - window)
+        # Ещё одна точка после участка: repair_window оставит её на месте,
+        # и участок останется соединён с продолжением маршрута
+        stop = min(len(order), position + window + 2)
+        segment = order[start:stop]
+        first, local = repair_window(latitudes[segment], longitudes[segment], position - start, window)
+        order[start + first:start + first + len(local)] = segment[first:first + len(local)][local]
+    return order
+
+
+def solve_decomposed(latitudes, longitudes, improve=False, budget=None, executor=None, workers=1,
+                     cluster_size=CLUSTER_SIZE):
+    """
+    Маршрут через очень много точек разбиением на кластеры
+
+    Точки делятся на кластеры вдоль кривой Гильберта, кластеры обходятся
+    в порядке маршрута по их центрам. Для каждого кластера заранее выбираются
+    точки входа и выхода, ближайшие к соседним кластерам, после чего кластеры
+    решаются независимо (параллельно, если задан executor) и склеиваются
+    подряд. В конце участки вокруг стыков улучшаются локально, а с improve
+    весь маршрут полируется 2-opt/Or-opt в пределах оставшегося времени.
+
+    Аргументы:
+        latitudes, longitudes: координаты точек в градусах (начало — точка 0)
+        improve: улучшать пути внутри кластеров 2-opt/Or-opt
+        budget: SearchBudget всего решения; оставшееся время делится между
+            кластерами
+        executor: concurrent.futures.Executor для параллельного решения кластеров
+        workers: число процессов executor
+        cluster_size: число точек в кластере
+
+    Возвращает:
+        (массив индексов точек в порядке обхода, длина склеенного маршрута
+        до улучшения стыков в км)
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    budget = budget or SearchBudget()
+
+    clusters = partition(latitudes, longitudes, cluster_size)
+    sequence = _cluster_sequence(latitudes, longitudes, clusters, start=0)
+    entries, exits = _boundary_points(latitudes, longitudes, sequence, clusters, start=0)
+
+    cluster_limit = None
+    remaining = budget.remaining()
+    if remaining is not None:
+        # Кластеры решаются «волнами» по числу процессов; запас — на склейку
+        waves = -(-len(clusters) // workers)
+        cluster_limit = remaining * 0.8 / waves
+
+    tasks = [
+        {
+            'latitudes': latitudes[clusters[cluster_id]],
+            'longitudes': longitudes[clusters[cluster_id]],
+            'entry': entry,
+            'exit': exit_,
+            'improve': improve,
+            'time_limit': cluster_limit,
+        }
+        for cluster_id, entry, exit_ in zip(sequence.tolist(), entries, exits)
+    ]
+    if executor is not None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        paths = list(executor.map(solve_cluster, tasks, chunksize=chunksize))
+    else:
+        paths = [solve_cluster(task) for task in tasks]
+
+    order = np.concatenate([clusters[cluster_id][path] for cluster_id, path in zip(sequence.tolist(), paths)])
+    stitched_length = path_length(latitudes[order], longitudes[order])
+    budget.record(stitched_length, force=True)
+
+    # Стыки — позиции первых точек кластеров (кроме первого)
+    seams = np.cumsum([len(path) for path in paths])[:-1]
+    order = repair_seams(order, latitudes, longitudes, seams.tolist(), budget=budget)
+
+    if improve and not budget.expired():
+        # Итоговая полировка всего маршрута в пределах оставшегося времени:
+        # внутри кластеров он уже локально оптимален, поэтому улучшения
+        # находятся в основном у границ кластеров
+        order = improve_tour(order, latitudes, longitudes, budget=budget)
+    return order, stitched_length
@@ -0,0 +1,135 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0  # Радиус Земли в км
+
+# Ограничение памяти на один блок матрицы расстояний (байт).
+# Число строк в блоке подбирается так, чтобы блок N столбцов укладывался в этот объём.
+BLOCK_MEMORY_LIMIT = 32 * 1024 * 1024
+
+# Допустимое расхождение с поэлементным расчётом через math (км).
+# float64: расхождение на уровне ошибки округления, не больше 1e-9 км.
+# float32: относительная погрешность до 1e-4 для расстояний от 1 км (около 10 м на 100 км).
+FLOAT64_TOLERANCE_KM = 1e-9
+FLOAT32_RELATIVE_TOLERANCE = 1e-4
+
+
+def to_radians(latitudes, longitudes, dtype=np.float64):
+    """
+    Преобразование широт и долгот в массивы радиан заданного типа
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64)).astype(dtype, copy=False)
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64)).astype(dtype, copy=False)
+    return lat, lon
+
+
+def haversine_rad(lat1, lon1, lat2, lon2):
+    """
+    Формула Haversine для массивов в радианах (с поддержкой broadcasting)
+    Возвращает расстояние в километрах
+    """
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Расстояние между точками в градусах (скаляры или массивы одинаковой формы)
+    Возвращает расстояние в километрах
+    """
+    lat1_rad, lon1_rad = to_radians(lat1, lon1)
+    lat2_rad, lon2_rad = to_radians(lat2, lon2)
+    return haversine_rad(lat1_rad, lon1_rad, lat2_rad, lon2_rad)
+
+
+def haversine_one_to_many(lat, lon, latitudes, longitudes, dtype=np.float64):
+    """
+    Расстояния от одной точки до набора точек
+
+    Аргументы:
+        lat, lon: координаты исходной точки в градусах
+        latitudes, longitudes: массивы координат в градусах
+        dtype: np.float64 (точный режим) или np.float32 (экономия памяти)
+
+    Возвращает:
+        массив расстояний в километрах длины len(latitudes)
+    """
+    lat_rad, lon_rad = to_radians(lat, lon, dtype)
+    lats_rad, lons_rad = to_radians(latitudes, longitudes, dtype)
+    return haversine_rad(lat_rad, lon_rad, lats_rad, lons_rad)
+
+
+def block_rows(n, dtype=np.float64, memory_limit=BLOCK_MEMORY_LIMIT):
+    """
+    Число строк блока матрицы N столбцов, укладывающегося в memory_limit байт
+    """
+    row_bytes = max(n, 1) * np.dtype(dtype).itemsize
+    return max(1, memory_limit // row_bytes)
+
+
+def haversine_matrix(latitudes, longitudes, dtype=np.float64, block_size=None):
+    """
+    Полная матрица расстояний N×N
+
+    Матрица заполняется блоками строк, поэтому промежуточные массивы numpy
+    занимают O(block_size × N) памяти, а не O(N²) на каждую операцию.
+
+    Возвращает:
+        матрицу расстояний в километрах типа dtype
+    """
+    lats_rad, lons_rad = to_radians(latitudes, longitudes, dtype)
+    n = len(lats_rad)
+    matrix = np.empty((n, n), dtype=dtype)
+
+    for start, block in iter_haversine_blocks(lats_rad, lons_rad, block_size, dtype, in_radians=True):
+        matrix[start:start + len(block)] = block
+
+    return matrix
+
+
+def iter_haversine_blocks(latitudes, longitudes, block_size=None,
+                          dtype=np.float64, in_radians=False):
+    """
+    Генератор блоков матрицы расстояний: (номер первой строки, блок block_size×N)
+    По умолчанию размер блока выбирается по BLOCK_MEMORY_LIMIT.
+
+    Позволяет обработать матрицу для больших N, не держа её целиком в памяти.
+    """
+    if in_radians:
+        lats_rad = np.asarray(latitudes)
+        lons_rad = np.asarray(longitudes)
+    else:
+        lats_rad, lons_rad = to_radians(latitudes, longitudes, dtype)
+
+    n = len(lats_rad)
+    if block_size is None:
+        block_size = block_rows(n, dtype)
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = haversine_rad(
+            lats_rad[start:stop, None], lons_rad[start:stop, None],
+            lats_rad[None, :], lons_rad[None, :]
+        )
+        yield start, block
+
+
+def haversine_legs(latitudes, longitudes, dtype=np.float64):
+    """
+    Длины последовательных отрезков маршрута (N-1 значений)
+    """
+    lats_rad, lons_rad = to_radians(latitudes, longitudes, dtype)
+    if len(lats_rad) < 2:
+        return np.zeros(0, dtype=dtype)
+    return haversine_rad(lats_rad[:-1], lons_rad[:-1], lats_rad[1:], lons_rad[1:])
+
+
+def path_length(latitudes, longitudes):
+    """
+    Длина маршрута, проходящего точки в заданном порядке (км)
+    """
+    return float(haversine_legs(latitudes, longitudes).sum())
@@ -0,0 +1,181 @@
+import numpy as np
+
+# Как часто (в узлах дерева поиска) метод ветвей и границ проверяет бюджет
+_BUDGET_CHECK_NODES = 64
+
+# Разница стоимостей меньше этой величины не считается улучшением
+_EPSILON = 1e-9
+
+
+def _path_cost(cost, order):
+    order = np.asarray(order, dtype=np.int64)
+    return float(cost[order[:-1], order[1:]].sum())
+
+
+def _popcount(values, bits):
+    counts = np.zeros(len(values), dtype=np.int64)
+    for bit in range(bits):
+        counts += (values >> bit) & 1
+    return counts
+
+
+def held_karp_order(cost, start=0):
+    """
+    Оптимальный незамкнутый маршрут с фиксированным началом динамическим
+    программированием Хелда — Карпа по подмножествам точек
+
+    Состояние — (подмножество посещённых точек, последняя точка); подмножества
+    одного размера обрабатываются сразу, векторно. Время O(2ⁿ·n²), память
+    O(2ⁿ·n) — подходит для маршрутов примерно до 16 точек.
+
+    Аргументы:
+        cost: матрица стоимостей переходов (N, N), возможно несимметричная
+        start: индекс начальной точки
+
+    Возвращает:
+        (массив индексов точек в порядке обхода, стоимость маршрута)
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    n = len(cost)
+    others = np.array([idx for idx in range(n) if idx != start], dtype=np.int64)
+    if n <= 2:
+        order = np.concatenate(([start], others)).astype(np.int64)
+        return order, _path_cost(cost, order)
+
+    # Точки, кроме начальной, нумеруются битами 0..m-1
+    m = n - 1
+    sub = cost[np.ix_(others, others)]
+    bits = np.left_shift(1, np.arange(m, dtype=np.int64))
+
+    # best[mask, j] — стоимость лучшего пути из start через точки mask,
+    # заканчивающегося в точке j; parent[mask, j] — предыдущая точка пути
+    best = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.int8)
+    best[bits, np.arange(m)] = cost[start, others]
+
+    masks = np.arange(1 << m, dtype=np.int64)
+    sizes = _popcount(masks, m)
+    for size in range(2, m + 1):
+        layer = masks[sizes == size]
+        for j in range(m):
+            with_j = layer[(layer & bits[j]) != 0]
+            # best[prev, j] для точки j вне prev — бесконечность, поэтому
+            # предыдущей может стать только точка из prev
+            values = best[with_j ^ bits[j]] + sub[:, j]
+            previous = values.argmin(axis=1)
+            best[with_j, j] = values[np.arange(len(with_j)), previous]
+            parent[with_j, j] = previous
+
+    # Восстановление маршрута с конца
+    mask = (1 << m) - 1
+    last = int(np.argmin(best[mask]))
+    length = float(best[mask, last])
+    path = []
+    while last >= 0:
+        path.append(last)
+        mask, last = mask ^ int(bits[last]), int(parent[mask, last])
+    order = np.concatenate(([start], others[path[::-1]])).astype(np.int64)
+    return order, length
+
+
+def _mst_weight(cost, nodes):
+    """Вес минимального остовного дерева на точках nodes (Прим по подматрице)"""
+    sub = cost[np.ix_(nodes, nodes)]
+    k = len(nodes)
+    in_tree = np.zeros(k, dtype=bool)
+    in_tree[0] = True
+    nearest = sub[0].copy()
+    total = 0.0
+    for _ in range(k - 1):
+        candidate = np.where(in_tree, np.inf, nearest)
+        node = int(np.argmin(candidate))
+        total += candidate[node]
+        in_tree[node] = True
+        np.minimum(nearest, sub[node], out=nearest)
+    return total
+
+
+def branch_and_bound_order(cost, start=0, initial_order=None, budget=None):
+    """
+    Оптимальный незамкнутый маршрут методом ветвей и границ (поиск в глубину)
+
+    Ветвь отсекается, если стоимость пути плюс нижняя оценка продолжения не
+    меньше лучшего найденного маршрута. Оценка продолжения — наибольшая из
+    двух: сумма самых дешёвых входящих рёбер непосещённых точек и (для
+    симметричной матрицы) самое дешёвое ребро из текущей точки плюс вес
+    минимального остовного дерева непосещённых точек — продолжение маршрута
+    без первого ребра является таким деревом.
+
+    Аргументы:
+        cost: матрица стоимостей переходов (N, N), возможно несимметричная
+        start: индекс начальной точки
+        initial_order: начальный маршрут (верхняя оценка), например эвристический
+        budget: SearchBudget; по истечении времени возвращается лучший
+            найденный маршрут без доказательства оптимальности
+
+    Возвращает:
+        (массив индексов точек в порядке обхода, стоимость маршрута,
+        доказана ли оптимальность)
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    n = len(cost)
+    if initial_order is None:
+        initial_order = np.concatenate(([start], [idx for idx in range(n) if idx != start]))
+    best_order = np.asarray(initial_order, dtype=np.int64)
+    if n <= 2:
+        return best_order, _path_cost(cost, best_order), True
+
+    symmetric = np.allclose(cost, cost.T)
+    incoming = cost.copy()
+    np.fill_diagonal(incoming, np.inf)
+    # Порядок перебора: из каждой точки сначала в ближайшие
+    successors = np.argsort(incoming, axis=1, kind='stable')
+
+    state = {'best': _path_cost(cost, best_order), 'order': best_order, 'nodes': 0, 'aborted': False}
+    path = [start]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+
+    def bound(current, remaining):
+        # В каждую непосещённую точку маршрут войдёт из текущей или другой непосещённой
+        sources = np.concatenate(([current], remaining))
+        estimate = float(incoming[np.ix_(sources, remaining)].min(axis=0).sum())
+        if symmetric and len(remaining) > 1:
+            estimate = max(estimate, cost[current, remaining].min() + _mst_weight(cost, remaining))
+        return estimate
+
+    def search(current, length):
+        state['nodes'] += 1
+        if budget is not None and state['nodes'] % _BUDGET_CHECK_NODES == 0 and budget.expired():
+            state['aborted'] = True
+        if state['aborted']:
+            return
+
+        remaining = np.flatnonzero(~visited)
+        if not len(remaining):
+            if length < state['best'] - _EPSILON:
+                state['best'] = length
+                state['order'] = np.array(path, dtype=np.int64)
+                if budget is not None:
+                    budget.record(length)
+            return
+        if length + bound(current, remaining) >= state['best'] - _EPSILON:
+            return
+
+        for nxt in successors[current].tolist():
+            if visited[nxt]:
+                continue
+            step = length + cost[current, nxt]
+            if step >= state['best'] - _EPSILON:
+                # Дальше по списку переходы только дороже
+                break
+            visited[nxt] = True
+            path.append(nxt)
+            search(nxt, step)
+            path.pop()
+            visited[nxt] = False
+            if state['aborted']:
+                return
+
+    search(start, 0.0)
+    return state['order'], state['best'], not state['aborted']
@@ -0,0 +1,174 @@
+import numpy as np
+
+from algorithms.distance import haversine, haversine_legs, haversine_matrix, haversine_one_to_many
+from algorithms.local_search import improve_tour, neighbor_lists
+
+# Локальный ремонт после вставки или удаления: точек по обе стороны от места
+# изменения, которые может переставить 2-opt/Or-opt
+REPAIR_WINDOW = 16
+
+# Число ближайших соседей новой точки, рядом с которыми ищется место вставки
+INSERT_NEIGHBORS = 10
+
+# Стоимость выхода из закреплённой последней точки участка: с ней точка
+# выгодна только в конце участка
+_LOCKED_COST = 1e9
+
+
+def cheapest_insertion(latitudes, longitudes, lat, lon, fixed_end=False):
+    """
+    Лучшее место вставки точки в незамкнутый маршрут с фиксированным началом
+
+    Аргументы:
+        latitudes, longitudes: точки маршрута в порядке обхода
+        lat, lon: новая точка
+        fixed_end: последняя точка закреплена (например, возврат на склад) —
+            вставка только перед ней
+
+    Возвращает:
+        (позиция новой точки в маршруте от 1 до N, прирост длины маршрута
+        в км; с fixed_end — от 1 до N - 1)
+    """
+    to_new = haversine_one_to_many(lat, lon, latitudes, longitudes)
+    legs = haversine_legs(latitudes, longitudes)
+
+    # Позиция i + 1 — между точками i и i + 1, позиция N — в конце маршрута
+    increase = np.append(to_new[:-1] + to_new[1:] - legs, np.inf if fixed_end else to_new[-1])
+    position = int(np.argmin(increase))
+    return position + 1, float(increase[position])
+
+
+def repair_window(latitudes, longitudes, center, window=REPAIR_WINDOW, fixed_end=False):
+    """
+    Локальный ремонт маршрута вокруг позиции center: 2-opt и Or-opt на
+    участке [center - window, center + window]
+
+    Первая точка участка остаётся на месте; последняя — тоже, если после
+    участка маршрут продолжается или конец маршрута закреплён, поэтому
+    остальной маршрут не меняется.
+
+    Аргументы:
+        latitudes, longitudes: точки маршрута в порядке обхода
+        center: позиция изменения
+        window: число точек по обе стороны от center
+        fixed_end: последняя точка маршрута закреплена
+
+    Возвращает:
+        (позиция начала участка, новый порядок участка — индексы от начала участка)
+    """
+    n = len(latitudes)
+    start = max(0, center - window)
+    stop = min(n - 1, center + window)
+    size = stop - start + 1
+    if size < 4:
+        return start, np.arange(size)
+
+    cost = haversine_matrix(latitudes[start:stop + 1], longitudes[start:stop + 1])
+    if stop < n - 1 or fixed_end:
+        cost[-1, :-1] = _LOCKED_COST
+
+    order = improve_tour(np.arange(size), latitudes[start:stop + 1], longitudes[start:stop + 1], cost=cost)
+    return start, order
+
+
+def patch_order(previous, latitudes, longitudes, neighbors=INSERT_NEIGHBORS):
+    """
+    Маршрут по прежнему порядку обхода после изменения набора точек:
+    удалённые точки пропускаются, новые вставляются туда, где прирост длины
+    меньше всего, остальной маршрут не меняется
+
+    Место вставки ищется только на рёбрах у ближайших соседей точки, уже
+    стоящих в маршруте (связный список вместо массива — вставка за O(1)).
+    Точки, у которых таких соседей нет, вставляются после своих соседей,
+    а если и это невозможно — полным перебором мест (cheapest_insertion).
+
+    Аргументы:
+        previous: прежний порядок обхода — индексы точек нового набора,
+            -1 на месте удалённых точек; начинается с точки 0
+        latitudes, longitudes: координаты точек нового набора в градусах
+        neighbors: число ближайших соседей — кандидатов в места вставки
+
+    Возвращает:
+        (порядок обхода всех точек, точки рядом с изменениями — с них
+        начинается локальный поиск improve_tour(focus=...))
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    previous = np.asarray(previous, dtype=np.int64)
+    n = len(latitudes)
+
+    # Соседи удалённых точек по прежнему маршруту
+    kept = previous >= 0
+    positions = np.arange(len(previous))
+    before = np.maximum.accumulate(np.where(kept, positions, -1))
+    after = np.minimum.accumulate(np.where(kept, positions, len(previous))[::-1])[::-1]
+    removed = np.flatnonzero(~kept)
+    around = np.concatenate((before[removed], after[removed]))
+    focus = set(previous[around[(around >= 0) & (around < len(previous))]].tolist())
+
+    order = previous[kept]
+    if not len(order) or order[0] != 0:
+        order = np.concatenate(([0], order[order != 0]))
+    in_tour = np.zeros(n, dtype=bool)
+    in_tour[order] = True
+    missing = np.flatnonzero(~in_tour).tolist()
+    if not missing:
+        return order, np.array(sorted(focus), dtype=np.int64)
+
+    succ = np.full(n, -1, dtype=np.int64)
+    pred = np.full(n, -1, dtype=np.int64)
+    succ[order[:-1]] = order[1:]
+    pred[order[1:]] = order[:-1]
+    candidates = neighbor_lists(latitudes, longitudes, neighbors)
+
+    def link(point, first, second):
+        succ[first] = point
+        pred[point] = first
+        succ[point] = second
+        if second >= 0:
+            pred[second] = point
+        in_tour[point] = True
+        focus.update((point, first, second) if second >= 0 else (point, first))
+
+    while missing:
+        deferred = []
+        for point in missing:
+            near = candidates[point][in_tour[candidates[point]]]
+            if not len(near):
+                deferred.append(point)
+                continue
+            # Рёбра до и после каждого соседа; ребро после конца маршрута — открытое
+            has_pred = pred[near] >= 0
+            first = np.concatenate((near, pred[near][has_pred]))
+            second = np.concatenate((succ[near], near[has_pred]))
+            closed = second >= 0
+            target = np.where(closed, second, first)
+            lat, lon = latitudes[point], longitudes[point]
+            to_first = haversine(lat, lon, latitudes[first], longitudes[first])
+            to_second = np.where(closed, haversine(lat, lon, latitudes[target], longitudes[target]), 0.0)
+            # Для открытого ребра target == first, и длина ребра равна 0
+            edge = haversine(latitudes[first], longitudes[first], latitudes[target], longitudes[target])
+            increase = to_first + to_second - edge
+            best = int(np.argmin(increase))
+            link(point, int(first[best]), int(second[best]))
+
+        if len(deferred) == len(missing):
+            # Ни у одной оставшейся точки нет соседей в маршруте
+            point = deferred.pop(0)
+            current = _walk(succ, int(in_tour.sum()))
+            position, _ = cheapest_insertion(latitudes[current], longitudes[current],
+                                             latitudes[point], longitudes[point])
+            following = int(current[position]) if position < len(current) else -1
+            link(point, int(current[position - 1]), following)
+        missing = deferred
+
+    return _walk(succ, n), np.array(sorted(focus), dtype=np.int64)
+
+
+def _walk(succ, count):
+    """Порядок обхода по связному списку следующих точек, начиная с точки 0"""
+    succ = succ.tolist()
+    order = [0]
+    for _ in range(count - 1):
+        order.append(succ[order[-1]])
+    return np.array(order, dtype=np.int64)
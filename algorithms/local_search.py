@@ -0,0 +1,388 @@
+import math
+from collections import deque
+
+import numpy as np
+
+from algorithms.distance import EARTH_RADIUS_KM, haversine_matrix, to_radians
+from algorithms.spatial_index import SphericalKDTree
+
+# Число ближайших соседей в списках кандидатов
+DEFAULT_NEIGHBORS = 10
+
+# Максимальная длина сегмента, переносимого Or-opt
+OR_OPT_SEGMENT = 3
+
+# Улучшения меньше этой величины (км) не считаются улучшениями
+_EPSILON = 1e-9
+
+# До этого числа точек списки соседей строятся по полной матрице расстояний
+_MATRIX_NEIGHBORS_LIMIT = 2000
+
+# Как часто (в шагах очереди) проверяется бюджет времени
+_BUDGET_CHECK_STEPS = 64
+
+
+def neighbor_lists(latitudes, longitudes, k=DEFAULT_NEIGHBORS, budget=None):
+    """
+    Списки k ближайших соседей для каждой точки, по возрастанию расстояния.
+    Для больших входов возвращает None, если budget истёк во время построения.
+    """
+    n = len(latitudes)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int64)
+
+    if n <= _MATRIX_NEIGHBORS_LIMIT:
+        matrix = haversine_matrix(latitudes, longitudes)
+        np.fill_diagonal(matrix, np.inf)
+        return np.argsort(matrix, axis=1, kind='stable')[:, :k]
+
+    return SphericalKDTree(latitudes, longitudes).knn(k, budget)
+
+
+def matrix_neighbor_lists(cost, k=DEFAULT_NEIGHBORS):
+    """
+    Списки k ближайших соседей по матрице стоимостей; для несимметричной
+    матрицы близость пары — меньшая из стоимостей в двух направлениях
+    """
+    n = len(cost)
+    k = min(k, n - 1)
+    if k <= 0:
+        return np.empty((n, 0), dtype=np.int64)
+
+    closeness = np.minimum(cost, cost.T)
+    np.fill_diagonal(closeness, np.inf)
+    return np.argsort(closeness, axis=1, kind='stable')[:, :k]
+
+
+class _PathDistance:
+    """
+    Быстрый скалярный Haversine для локального поиска по заранее
+    посчитанным радианам и косинусам широт
+    """
+
+    symmetric = True
+
+    def __init__(self, latitudes, longitudes):
+        lats_rad, lons_rad = to_radians(latitudes, longitudes)
+        self.lat = lats_rad.tolist()
+        self.lon = lons_rad.tolist()
+        self.cos_lat = np.cos(lats_rad).tolist()
+
+    def __call__(self, a, b):
+        if a is None or b is None:
+            # Открытый конец маршрута: ребра нет
+            return 0.0
+        h = (math.sin((self.lat[b] - self.lat[a]) / 2) ** 2
+             + self.cos_lat[a] * self.cos_lat[b] * math.sin((self.lon[b] - self.lon[a]) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h if h < 1.0 else 1.0))
+
+    def reversal(self, tour, i, j):
+        """Изменение стоимости участка [i, j] при его развороте (для Haversine — 0)"""
+        return 0.0
+
+
+class _MatrixDistance:
+    """
+    Стоимости рёбер из матрицы, возможно несимметричной: cost[a][b] —
+    стоимость перехода из a в b
+    """
+
+    def __init__(self, cost):
+        self.cost = np.asarray(cost, dtype=np.float64)
+        self.rows = self.cost.tolist()
+        self.symmetric = bool(np.allclose(self.cost, self.cost.T))
+        self._version = None
+        self._skew = None
+
+    def __call__(self, a, b):
+        if a is None or b is None:
+            # Открытый конец маршрута: ребра нет
+            return 0.0
+        return self.rows[a][b]
+
+    def reversal(self, tour, i, j):
+        """
+        Изменение суммарной стоимости рёбер внутри участка [i, j] при его
+        развороте. Префиксные суммы «обратная минус прямая стоимость»
+        пересчитываются после каждого изменения маршрута.
+        """
+        if self.symmetric:
+            return 0.0
+        if self._version != tour.version:
+            order = np.asarray(tour.order)
+            skew = self.cost[order[1:], order[:-1]] - self.cost[order[:-1], order[1:]]
+            self._skew = np.concatenate(([0.0], np.cumsum(skew))).tolist()
+            self._version = tour.version
+        return self._skew[j] - self._skew[i]
+
+
+class _Tour:
+    """
+    Незамкнутый маршрут с фиксированной первой точкой:
+    массив порядка и обратный массив позиций
+    """
+
+    def __init__(self, order):
+        self.order = [int(v) for v in order]
+        self.pos = [0] * len(self.order)
+        for idx, node in enumerate(self.order):
+            self.pos[node] = idx
+        self.last = len(self.order) - 1
+        self.version = 0  # Увеличивается при каждом изменении маршрута
+
+    def succ(self, node):
+        p = self.pos[node]
+        return self.order[p + 1] if p < self.last else None
+
+    def pred(self, node):
+        p = self.pos[node]
+        return self.order[p - 1] if p > 0 else None
+
+    def reverse(self, i, j):
+        """Разворот участка маршрута между позициями i и j включительно"""
+        order = self.order
+        order[i:j + 1] = order[i:j + 1][::-1]
+        self.version += 1
+        pos = self.pos
+        for idx in range(i, j + 1):
+            pos[order[idx]] = idx
+
+    def move_segment(self, i, j, after, reverse):
+        """
+        Перенос участка [i, j] так, чтобы он встал сразу после позиции after
+        (after лежит вне участка), при необходимости в обратном порядке
+        """
+        order = self.order
+        segment = order[i:j + 1]
+        self.version += 1
+        if reverse:
+            segment.reverse()
+
+        if after > j:
+            order[i:after - len(segment) + 1] = order[j + 1:after + 1]
+            order[after - len(segment) + 1:after + 1] = segment
+            start, stop = i, after
+        else:
+            order[after + 1 + len(segment):j + 1] = order[after + 1:i]
+            order[after + 1:after + 1 + len(segment)] = segment
+            start, stop = after + 1, j
+
+        pos = self.pos
+        for idx in range(start, stop + 1):
+            pos[order[idx]] = idx
+
+
+def improve_tour(order, latitudes, longitudes, neighbors=DEFAULT_NEIGHBORS, budget=None, cost=None,
+                 focus=None):
+    """
+    Улучшение незамкнутого маршрута 2-opt и Or-opt с фиксированным началом
+
+    Ходы перебираются только среди k ближайших соседей каждой точки, а биты
+    «не смотреть» (очередь активных точек) исключают повторную проверку
+    точек, вокруг которых маршрут не менялся. Первая точка маршрута остаётся
+    на месте, конец маршрута свободен.
+
+    Поиск можно прервать в любой момент: при исчерпании budget (SearchBudget)
+    возвращается лучший найденный к этому моменту порядок.
+
+    Если задана матрица cost, стоимости рёбер берутся из неё; для
+    несимметричной матрицы учитывается изменение стоимости разворачиваемых
+    участков.
+
+    Если задан focus, поиск начинается только с этих точек (например, вокруг
+    вставленных и удалённых точек почти готового маршрута); удачные ходы
+    активируют затронутые точки как обычно.
+
+    Аргументы:
+        order: начальный порядок обхода (массив индексов точек)
+        latitudes, longitudes: координаты точек в градусах
+        neighbors: размер списков кандидатов
+        budget: SearchBudget — ограничение по времени, целевая длина и трасса
+        cost: матрица стоимостей переходов (N, N) вместо Haversine
+        focus: точки, с которых начинается поиск (по умолчанию — все)
+
+    Возвращает:
+        улучшенный порядок обхода (массив индексов)
+    """
+    n = len(order)
+    if n < 4:
+        return np.asarray(order, dtype=np.int64)
+
+    if cost is not None:
+        candidates = matrix_neighbor_lists(cost, neighbors)
+        dist = _MatrixDistance(cost)
+    else:
+        candidates = neighbor_lists(latitudes, longitudes, neighbors, budget)
+        dist = _PathDistance(latitudes, longitudes)
+    if candidates is None:
+        return np.asarray(order, dtype=np.int64)
+    candidates = candidates.tolist()
+
+    tour = _Tour(order)
+
+    length = sum(dist(tour.order[i], tour.order[i + 1]) for i in range(n - 1))
+    if budget is not None:
+        budget.record(length)
+
+    if focus is None:
+        queue = deque(tour.order)
+        active = [True] * n
+    else:
+        queue = deque(dict.fromkeys(int(node) for node in focus))
+        active = [False] * n
+        for node in queue:
+            active[node] = True
+    steps = 0
+
+    def activate(*nodes):
+        for node in nodes:
+            if node is not None and not active[node]:
+                active[node] = True
+                queue.append(node)
+
+    while queue:
+        steps += 1
+        if budget is not None and steps % _BUDGET_CHECK_STEPS == 0 and budget.expired():
+            break
+
+        node = queue.popleft()
+        active[node] = False
+
+        move = _try_2opt(tour, node, candidates[node], dist)
+        if move is None:
+            move = _try_or_opt(tour, node, candidates, dist)
+        if move is None:
+            continue
+
+        gain, touched = move
+        length -= gain
+        activate(*touched)
+
+        if budget is not None:
+            budget.record(length)
+            if budget.reached(length):
+                break
+
+    if budget is not None:
+        budget.record(length, force=True)
+
+    return np.asarray(tour.order, dtype=np.int64)
+
+
+def _try_2opt(tour, a, candidates, dist):
+    """
+    Первый улучшающий 2-opt ход вокруг точки a.
+    Возвращает (выигрыш, концы изменённых рёбер) или None.
+    """
+    pos = tour.pos
+    symmetric = dist.symmetric
+
+    # Ребро (a, succ a) заменяется на (a, c) и (succ a, succ c)
+    b = tour.succ(a)
+    if b is not None:
+        d_ab = dist(a, b)
+        for c in candidates:
+            d_ac = dist(a, c)
+            if d_ac >= d_ab:
+                break
+            if c == b:
+                continue
+            d = tour.succ(c)
+            i, j = pos[a], pos[c]
+            if i < j:
+                # a→b … c→d  =>  a→c … b→d
+                gain = d_ab + dist(c, d) - d_ac - dist(b, d)
+                first, last = i + 1, j
+            else:
+                # c→d … a→b  =>  c→a … d→b
+                gain = d_ab + dist(c, d) - (d_ac if symmetric else dist(c, a)) - dist(d, b)
+                first, last = j + 1, i
+            if not symmetric:
+                gain -= dist.reversal(tour, first, last)
+            if gain > _EPSILON:
+                tour.reverse(first, last)
+                return gain, (a, b, c, d)
+
+    # Ребро (pred a, a) заменяется на (c, a) и (pred c, pred a)
+    b = tour.pred(a)
+    if b is not None:
+        d_ab = dist(b, a)
+        for c in candidates:
+            d_ac = dist(a, c)
+            if d_ac >= d_ab:
+                break
+            if c == b:
+                continue
+            d = tour.pred(c)
+            if d is None:
+                # c — первая точка маршрута, её нельзя сдвигать
+                continue
+            i, j = pos[a], pos[c]
+            if i < j:
+                # b→a … d→c  =>  b→d … a→c
+                gain = d_ab + dist(d, c) - d_ac - dist(b, d)
+                first, last = i, j - 1
+            else:
+                # d→c … b→a  =>  d→b … c→a
+                gain = d_ab + dist(d, c) - (d_ac if symmetric else dist(c, a)) - dist(d, b)
+                first, last = j, i - 1
+            if not symmetric:
+                gain -= dist.reversal(tour, first, last)
+            if gain > _EPSILON:
+                tour.reverse(first, last)
+                return gain, (a, b, c, d)
+
+    return None
+
+
+def _try_or_opt(tour, a, candidates, dist):
+    """
+    Первый улучшающий перенос участка из 1–3 точек, начинающегося или
+    заканчивающегося в точке a, к одному из её соседей.
+    Возвращает (выигрыш, концы изменённых рёбер) или None.
+    """
+    pos, order = tour.pos, tour.order
+    p = pos[a]
+
+    for length in range(1, OR_OPT_SEGMENT + 1):
+        for i in (p, p - length + 1):
+            j = i + length - 1
+            if i < 1 or j > tour.last:
+                continue
+
+            first, last = order[i], order[j]
+            prev = order[i - 1]
+            nxt = order[j + 1] if j < tour.last else None
+            removal_gain = dist(prev, first) + dist(last, nxt) - dist(prev, nxt)
+            if removal_gain <= _EPSILON:
+                continue
+
+            for end in (first, last):
+                for c in candidates[end]:
+                    # Критерий выигрыша: новое ребро к c уже не короче удаляемых
+                    if dist(c, end) >= removal_gain:
+                        break
+                    q = pos[c]
+                    if i <= q <= j:
+                        continue
+
+                    # Вставка между c и succ c либо между pred c и c;
+                    # end встаёт рядом с c
+                    for left, right in ((c, tour.succ(c)), (tour.pred(c), c)):
+                        if left is None or left == prev or i <= pos[left] <= j:
+                            continue
+                        if right is not None and i <= pos[right] <= j:
+                            continue
+                        if left == c:
+                            x, y = end, (last if end == first else first)
+                        else:
+                            x, y = (last if end == first else first), end
+                        added = dist(left, x) + dist(y, right) - dist(left, right)
+                        if x != first and not dist.symmetric:
+                            added += dist.reversal(tour, i, j)
+                        if removal_gain - added > _EPSILON:
+                            tour.move_segment(i, j, pos[left], reverse=(x != first))
+                            return removal_gain - added, (prev, nxt, left, right, first, last)
+
+    return None
@@ -0,0 +1,81 @@
+import numpy as np
+
+from algorithms.distance import haversine_matrix, haversine_rad, to_radians
+from algorithms.spatial_index import SphericalKDTree
+
+# До этого числа точек нижняя оценка считается по минимальному остовному дереву
+MST_BOUND_LIMIT = 3000
+
+
+def mst_weight(latitudes, longitudes):
+    """
+    Вес минимального остовного дерева (алгоритм Прима, O(n²) по памяти O(n))
+    """
+    lats_rad, lons_rad = to_radians(latitudes, longitudes)
+    n = len(lats_rad)
+    if n < 2:
+        return 0.0
+
+    in_tree = np.zeros(n, dtype=bool)
+    best = np.full(n, np.inf)
+    best[0] = 0.0
+    total = 0.0
+
+    for _ in range(n):
+        candidate = np.where(in_tree, np.inf, best)
+        node = int(np.argmin(candidate))
+        total += candidate[node]
+        in_tree[node] = True
+        np.minimum(best, haversine_rad(lats_rad[node], lons_rad[node], lats_rad, lons_rad), out=best)
+
+    return float(total)
+
+
+def nearest_neighbor_bound(latitudes, longitudes, start=0):
+    """
+    Сумма расстояний до ближайшего соседа по всем точкам, кроме начальной:
+    в незамкнутый маршрут каждая точка, кроме первой, входит по ребру
+    не короче расстояния до её ближайшего соседа
+    """
+    n = len(latitudes)
+    if n < 2:
+        return 0.0
+
+    if n <= MST_BOUND_LIMIT:
+        matrix = haversine_matrix(latitudes, longitudes)
+        np.fill_diagonal(matrix, np.inf)
+        nearest = matrix.min(axis=1)
+    else:
+        neighbors = SphericalKDTree(latitudes, longitudes).knn(1)[:, 0]
+        lats_rad, lons_rad = to_radians(latitudes, longitudes)
+        nearest = haversine_rad(lats_rad, lons_rad, lats_rad[neighbors], lons_rad[neighbors])
+
+    return float(nearest.sum() - nearest[start])
+
+
+def path_lower_bound(latitudes, longitudes, start=0):
+    """
+    Нижняя оценка длины незамкнутого маршрута через все точки (км)
+
+    Любой такой маршрут — остовное дерево, поэтому для небольших входов
+    используется вес MST; для больших — более слабая, но дешёвая оценка
+    по ближайшим соседям.
+    """
+    bound = nearest_neighbor_bound(latitudes, longitudes, start)
+    if len(latitudes) <= MST_BOUND_LIMIT:
+        bound = max(bound, mst_weight(latitudes, longitudes))
+    return bound
+
+
+def matrix_path_lower_bound(cost, start=0):
+    """
+    Нижняя оценка стоимости незамкнутого маршрута по матрице стоимостей
+    (возможно, несимметричной): в каждую точку, кроме начальной, маршрут
+    входит ровно по одному ребру, не дешевле самого дешёвого входящего
+    """
+    cost = np.array(cost, dtype=np.float64)
+    if len(cost) < 2:
+        return 0.0
+    np.fill_diagonal(cost, np.inf)
+    cheapest_incoming = cost.min(axis=0)
+    return float(cheapest_incoming.sum() - cheapest_incoming[start])
@@ -0,0 +1,309 @@
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from algorithms.budget import SearchBudget
+from algorithms.decomposition import hilbert_keys
+from algorithms.distance import haversine_rad, path_length, to_radians
+from algorithms.local_search import improve_tour, neighbor_lists
+from algorithms.spatial_index import SphericalKDTree
+from utils.metrics import metrics
+
+# Построения начального маршрута: ближайший сосед от начальной точки,
+# жадное добавление рёбер, обход вдоль кривой Гильберта, ближайший сосед
+# от случайной точки и ближайший сосед по слегка зашумлённым координатам
+CONSTRUCTIONS = ('nearest', 'greedy', 'space_filling', 'random_start', 'randomized')
+
+# Число запусков портфеля по умолчанию
+PORTFOLIO_RUNS = 8
+
+# Число ближайших соседей — кандидатов в рёбра жадного построения
+GREEDY_NEIGHBORS = 10
+
+# Шум координат случайного ближайшего соседа: доля среднего расстояния между точками
+RANDOMIZED_NOISE = 0.5
+
+
+def anchor_path(order, start, measure):
+    """
+    Маршрут, начинающийся в точке start: order замыкается в цикл, который
+    разрезается у start по более выгодному из двух соседних рёбер
+
+    Аргументы:
+        order: порядок обхода всех точек
+        start: точка, с которой должен начинаться маршрут
+        measure: функция длины маршрута по порядку обхода
+    """
+    order = np.asarray(order, dtype=np.int64)
+    cycle = np.roll(order, -int(np.flatnonzero(order == start)[0]))
+    reverse = np.concatenate((cycle[:1], cycle[:0:-1]))
+    return min((cycle, reverse), key=measure)
+
+
+def greedy_edge_order(latitudes, longitudes, start=None, neighbors=GREEDY_NEIGHBORS):
+    """
+    Жадное построение: рёбра между ближайшими соседями добавляются от
+    коротких к длинным, если не образуют цикл и степень точек не больше 2
+    (у start — не больше 1); получившиеся цепочки соединяются методом
+    ближайшего соседа по их концам
+
+    Возвращает:
+        массив индексов точек в порядке обхода (с start в начале, если задана)
+    """
+    n = len(latitudes)
+    if n < 3:
+        return np.arange(n, dtype=np.int64)
+
+    candidates = neighbor_lists(latitudes, longitudes, neighbors)
+    first = np.repeat(np.arange(n, dtype=np.int64), candidates.shape[1])
+    second = candidates.ravel()
+    pairs = np.unique(np.column_stack((np.minimum(first, second), np.maximum(first, second))), axis=0)
+    lats_rad, lons_rad = to_radians(latitudes, longitudes)
+    a, b = pairs[:, 0], pairs[:, 1]
+    lengths = haversine_rad(lats_rad[a], lons_rad[a], lats_rad[b], lons_rad[b])
+    pairs = pairs[np.argsort(lengths, kind='stable')].tolist()
+
+    limit = [2] * n
+    if start is not None:
+        limit[start] = 1
+    adjacent = [[] for _ in range(n)]
+    root = list(range(n))
+
+    def find(node):
+        while root[node] != node:
+            root[node] = root[root[node]]
+            node = root[node]
+        return node
+
+    for a, b in pairs:
+        if len(adjacent[a]) >= limit[a] or len(adjacent[b]) >= limit[b]:
+            continue
+        root_a, root_b = find(a), find(b)
+        if root_a == root_b:
+            continue
+        root[root_a] = root_b
+        adjacent[a].append(b)
+        adjacent[b].append(a)
+
+    # Цепочки — от одного конца (степень 0 или 1) до другого
+    chains = []
+    seen = np.zeros(n, dtype=bool)
+    for node in range(n):
+        if seen[node] or len(adjacent[node]) > 1:
+            continue
+        chain = [node]
+        seen[node] = True
+        previous, current = -1, node
+        while True:
+            following = [nxt for nxt in adjacent[current] if nxt != previous]
+            if not following:
+                break
+            previous, current = current, following[0]
+            chain.append(current)
+            seen[current] = True
+        chains.append(chain)
+
+    return _join_chains(chains, latitudes, longitudes, start)
+
+
+def _join_chains(chains, latitudes, longitudes, start):
+    """Соединение цепочек ближайшим соседом по их концам (KD-дерево по концам)"""
+    ends = []  # (точка, цепочка, сторона: 0 — начало, 1 — конец)
+    positions = []
+    for idx, chain in enumerate(chains):
+        head = len(ends)
+        ends.append((chain[0], idx, 0))
+        tail = head
+        if len(chain) > 1:
+            tail = len(ends)
+            ends.append((chain[-1], idx, 1))
+        positions.append((head, tail))
+
+    points = np.array([point for point, _, _ in ends], dtype=np.int64)
+    tree = SphericalKDTree(latitudes[points], longitudes[points])
+
+    first = 0
+    if start is not None:
+        first = next(idx for idx, chain in enumerate(chains) if chain[0] == start or chain[-1] == start)
+    chain = chains[first]
+    if chain[0] != start and start is not None:
+        chain = chain[::-1]
+    order = list(chain)
+    head, tail = positions[first]
+    tree.remove(head)
+    tree.remove(tail)
+    current = tail if ends[tail][0] == order[-1] else head
+
+    while tree.alive:
+        found, _ = tree.nearest(current)
+        _, idx, side = ends[found]
+        chain = chains[idx] if side == 0 else chains[idx][::-1]
+        order.extend(chain)
+        head, tail = positions[idx]
+        tree.remove(head)
+        if tail != head:
+            tree.remove(tail)
+        current = tail if side == 0 else head
+
+    return np.array(order, dtype=np.int64)
+
+
+def _build(construction, latitudes, longitudes, rng, start):
+    """Начальный маршрут построением construction"""
+    from algorithms.tsp_solver import nearest_neighbor_order
+
+    n = len(latitudes)
+    if construction == 'nearest':
+        return nearest_neighbor_order(latitudes, longitudes, start=start or 0)
+    if construction == 'greedy':
+        return greedy_edge_order(latitudes, longitudes, start)
+    if construction == 'space_filling':
+        return np.argsort(hilbert_keys(latitudes, longitudes), kind='stable')
+    if construction == 'random_start':
+        return nearest_neighbor_order(latitudes, longitudes, start=int(rng.integers(n)))
+    if construction == 'randomized':
+        spacing = np.sqrt(max(np.ptp(latitudes) * np.ptp(longitudes), 1e-12) / n)
+        noisy_lats = latitudes + rng.normal(0.0, RANDOMIZED_NOISE * spacing, n)
+        noisy_lons = longitudes + rng.normal(0.0, RANDOMIZED_NOISE * spacing, n)
+        first = start if start is not None else int(rng.integers(n))
+        return nearest_neighbor_order(noisy_lats, noisy_lons, start=first)
+    raise ValueError(f'Неизвестное построение: {construction}')
+
+
+def _run(task, latitudes, longitudes, cost):
+    """Один запуск портфеля: построение и локальный поиск 2-opt/Or-opt"""
+    started = time.perf_counter()
+    start = task['start']
+
+    def measure(order):
+        if cost is not None:
+            return float(cost[order[:-1], order[1:]].sum())
+        return path_length(latitudes[order], longitudes[order])
+
+    rng = np.random.default_rng(task['seed'])
+    order = _build(task['construction'], latitudes, longitudes, rng, start)
+    if start is not None and order[0] != start:
+        order = anchor_path(order, start, measure)
+    initial_length = measure(order)
+
+    order = improve_tour(order, latitudes, longitudes, budget=SearchBudget(task['time_limit']), cost=cost)
+    return {
+        'order': order,
+        'construction': task['construction'],
+        'seed': task['seed'],
+        'worker': os.getpid(),
+        'initial_length': initial_length,
+        'length': measure(order),
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def run_construction(task):
+    """
+    Запуск портфеля в рабочем процессе: координаты (и матрица стоимостей)
+    читаются из общей памяти без копирования
+    """
+    # Общей памятью владеет родительский процесс: он освобождает её после
+    # всех запусков, рабочий только отключается
+    memory = shared_memory.SharedMemory(name=task['memory'])
+    n = task['size']
+    data = np.ndarray((2 * n + (n * n if task['has_cost'] else 0),), dtype=np.float64, buffer=memory.buf)
+    cost = data[2 * n:].reshape(n, n) if task['has_cost'] else None
+    try:
+        return _run(task, data[:n], data[n:2 * n], cost)
+    finally:
+        del cost, data
+        memory.close()
+
+
+def portfolio_plan(runs=PORTFOLIO_RUNS, seed=0):
+    """
+    Запуски портфеля: по одному детерминированному построению каждого вида,
+    затем попеременно случайные (со своим зерном)
+
+    Возвращает:
+        список (построение, зерно)
+    """
+    plan = [('nearest', seed), ('greedy', seed), ('space_filling', seed)]
+    random_kinds = ('randomized', 'random_start')
+    while len(plan) < runs:
+        plan.append((random_kinds[len(plan) % 2], seed + len(plan)))
+    return plan[:runs]
+
+
+def solve_portfolio(latitudes, longitudes, runs=PORTFOLIO_RUNS, budget=None, executor=None, workers=1,
+                    cost=None, fixed_start=True, seed=0):
+    """
+    Портфель запусков: несколько разных начальных маршрутов, каждый
+    улучшается 2-opt/Or-opt, лучший маршрут возвращается
+
+    С executor запуски идут параллельно в пуле процессов; координаты
+    (и матрица cost) передаются через общую память, а не копируются в каждую
+    задачу.
+
+    Аргументы:
+        latitudes, longitudes: координаты точек в градусах
+        runs: число запусков
+        budget: SearchBudget всего решения; оставшееся время делится между
+            «волнами» запусков по числу процессов
+        executor, workers: пул процессов и число его процессов
+        cost: матрица стоимостей переходов (N, N) вместо Haversine
+        fixed_start: маршрут начинается с точки 0; иначе начало свободно
+        seed: зерно случайных построений
+
+    Возвращает:
+        (лучший порядок обхода, список статистик запусков без маршрутов:
+        построение, зерно, процесс, длины до и после улучшения, время,
+        признак лучшего)
+    """
+    latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+    longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+    n = len(latitudes)
+    budget = budget or SearchBudget()
+
+    run_limit = None
+    remaining = budget.remaining()
+    if remaining is not None:
+        waves = -(-runs // workers) if executor is not None else runs
+        run_limit = remaining * 0.9 / waves
+
+    tasks = [
+        {
+            'construction': construction,
+            'seed': run_seed,
+            'start': 0 if fixed_start else None,
+            'time_limit': run_limit,
+        }
+        for construction, run_seed in portfolio_plan(runs, seed)
+    ]
+
+    if executor is None:
+        results = [_run(task, latitudes, longitudes, cost) for task in tasks]
+    else:
+        size = 2 * n + (n * n if cost is not None else 0)
+        memory = shared_memory.SharedMemory(create=True, size=size * 8)
+        try:
+            data = np.ndarray((size,), dtype=np.float64, buffer=memory.buf)
+            data[:n] = latitudes
+            data[n:2 * n] = longitudes
+            if cost is not None:
+                data[2 * n:] = np.asarray(cost, dtype=np.float64).ravel()
+            del data
+            for task in tasks:
+                task.update(memory=memory.name, size=n, has_cost=cost is not None)
+            results = list(executor.map(run_construction, tasks))
+        finally:
+            memory.close()
+            memory.unlink()
+
+    best = min(range(len(results)), key=lambda idx: results[idx]['length'])
+    order = results[best]['order']
+    for idx, result in enumerate(results):
+        result['best'] = idx == best
+        del result['order']
+        budget.record(result['length'])
+        metrics.inc('portfolio_runs_total', construction=result['construction'],
+                    result='win' if result['best'] else 'loss')
+    return order, results
@@ -0,0 +1,55 @@
+import numpy as np
+
+from algorithms.distance import EARTH_RADIUS_KM, to_radians
+
+
+def simplify_path(latitudes, longitudes, tolerance_km):
+    """
+    Упрощение ломаной алгоритмом Дугласа — Пекера
+
+    Расстояния считаются в равнопромежуточной проекции относительно средней
+    широты ломаной — для отрисовки на карте этого достаточно. Первая и
+    последняя вершины сохраняются всегда.
+
+    Аргументы:
+        latitudes, longitudes: вершины ломаной в градусах
+        tolerance_km: допустимое отклонение упрощённой линии (км)
+
+    Возвращает:
+        массив индексов сохранённых вершин по возрастанию
+    """
+    n = len(latitudes)
+    if n < 3:
+        return np.arange(n)
+
+    lats_rad, lons_rad = to_radians(latitudes, longitudes)
+    x = EARTH_RADIUS_KM * lons_rad * np.cos(lats_rad.mean())
+    y = EARTH_RADIUS_KM * lats_rad
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Стек отрезков вместо рекурсии: глубина на длинных линиях может быть велика
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        px, py = x[i + 1:j] - x[i], y[i + 1:j] - y[i]
+        segment = dx * dx + dy * dy
+        if segment == 0.0:
+            deviation = np.hypot(px, py)
+        else:
+            t = np.clip((px * dx + py * dy) / segment, 0.0, 1.0)
+            deviation = np.hypot(px - t * dx, py - t * dy)
+
+        k = int(deviation.argmax())
+        if deviation[k] > tolerance_km:
+            mid = i + 1 + k
+            keep[mid] = True
+            stack.append((i, mid))
+            stack.append((mid, j))
+
+    return np.flatnonzero(keep)
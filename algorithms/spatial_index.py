@@ -0,0 +1,328 @@
+import math
+
+import numpy as np
+
+from algorithms.distance import haversine_rad, to_radians
+
+# Запас (в длинах хорды единичной сферы, ~6 мкм на поверхности Земли) при
+# отсечении узлов и отборе кандидатов. Поиск идёт по хордам в 3D, а итоговый
+# выбор — по формуле Haversine среди всех точек, чья хорда совпадает с лучшей
+# с точностью до округления. Это гарантирует тот же выбор при равных
+# расстояниях, что и у полного перебора.
+_CHORD_MARGIN = 1e-12
+
+# Координаты, которыми заменяются удалённые точки: хорда до них больше
+# диаметра сферы, поэтому они никогда не становятся ближайшими
+_REMOVED = 4.0
+
+
+def to_unit_vectors(lats_rad, lons_rad):
+    """
+    Преобразование координат (в радианах) в единичные векторы на сфере
+    """
+    cos_lat = np.cos(lats_rad)
+    return np.column_stack((cos_lat * np.cos(lons_rad), cos_lat * np.sin(lons_rad), np.sin(lats_rad)))
+
+
+class SphericalKDTree:
+    """
+    KD-дерево по 3D-координатам точек на единичной сфере с удалением точек
+
+    Дерево и листья просматриваются по длинам хорд, а окончательный выбор
+    среди равноудалённых кандидатов делается по формуле Haversine (как в
+    полном переборе). Удалённые точки исключаются из поиска; узлы, в которых
+    не осталось точек, пропускаются целиком.
+    """
+
+    def __init__(self, latitudes, longitudes, leaf_size=32):
+        lats_rad, lons_rad = to_radians(latitudes, longitudes)
+        self.size = len(lats_rad)
+        self.leaf_size = leaf_size
+
+        xyz = to_unit_vectors(lats_rad, lons_rad)
+
+        # Описание узлов: границы, потомки, диапазон точек листа, число живых точек
+        self._lo = []
+        self._hi = []
+        self._left = []
+        self._right = []
+        self._parent = []
+        self._start = []
+        self._end = []
+        self._alive_count = []
+
+        perm = np.arange(self.size, dtype=np.int64)
+        self._point_leaf = np.empty(self.size, dtype=np.int64)
+        if self.size:
+            self._build(xyz, perm)
+
+        # Данные листьев хранятся непрерывно в порядке обхода дерева
+        self._perm = perm
+        self._lat_p = np.ascontiguousarray(lats_rad[perm])
+        self._lon_p = np.ascontiguousarray(lons_rad[perm])
+        self._xyz_p = np.ascontiguousarray(xyz[perm])
+        self._alive_p = np.ones(self.size, dtype=bool)
+        self._position = np.empty(self.size, dtype=np.int64)
+        self._position[perm] = np.arange(self.size)
+        self._xyz = xyz
+        self.alive = self.size
+
+    def _add_node(self, parent, start, end, lo, hi):
+        self._lo.append(lo)
+        self._hi.append(hi)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._parent.append(parent)
+        self._start.append(start)
+        self._end.append(end)
+        self._alive_count.append(end - start)
+        return len(self._lo) - 1
+
+    def _build(self, xyz, perm):
+        points = xyz[perm]
+        root = self._add_node(-1, 0, self.size, points.min(axis=0).tolist(), points.max(axis=0).tolist())
+        stack = [root]
+
+        while stack:
+            node = stack.pop()
+            start, end = self._start[node], self._end[node]
+
+            if end - start <= self.leaf_size:
+                self._point_leaf[perm[start:end]] = node
+                continue
+
+            # Делим по оси с наибольшим разбросом, по медиане
+            lo, hi = self._lo[node], self._hi[node]
+            axis = max(range(3), key=lambda k: hi[k] - lo[k])
+            segment = perm[start:end]
+            mid = (end - start) // 2
+            part = np.argpartition(xyz[segment, axis], mid)
+            perm[start:end] = segment[part]
+
+            for child_start, child_end, side in ((start, start + mid, 'left'), (start + mid, end, 'right')):
+                child_points = xyz[perm[child_start:child_end]]
+                child = self._add_node(
+                    node, child_start, child_end,
+                    child_points.min(axis=0).tolist(), child_points.max(axis=0).tolist()
+                )
+                if side == 'left':
+                    self._left[node] = child
+                else:
+                    self._right[node] = child
+                stack.append(child)
+
+    def remove(self, index):
+        """
+        Удаление точки из индекса
+        """
+        position = self._position[index]
+        if not self._alive_p[position]:
+            return
+
+        self._alive_p[position] = False
+        self._xyz_p[position] = _REMOVED
+        self.alive -= 1
+
+        node = int(self._point_leaf[index])
+        while node != -1:
+            self._alive_count[node] -= 1
+            node = self._parent[node]
+
+    def remaining(self):
+        """
+        Индексы ещё не удалённых точек по возрастанию
+        """
+        return np.sort(self._perm[self._alive_p])
+
+    def nearest(self, index):
+        """
+        Ближайшая к точке index живая точка (сама точка должна быть удалена
+        или будет возвращена с нулевым расстоянием)
+
+        Поиск начинается с листа, содержащего точку запроса, и поднимается вверх,
+        пока шар текущего лучшего радиуса не окажется целиком внутри узла.
+        При равных расстояниях выбирается точка с меньшим индексом.
+
+        Возвращает:
+            (индекс точки, расстояние в км) или (None, inf), если точек не осталось
+        """
+        if self.alive == 0:
+            return None, math.inf
+
+        query = self._xyz[index]
+        state = {'chord': math.inf, 'candidates': [], 'query': [float(v) for v in query]}
+
+        node = int(self._point_leaf[index])
+        self._search(node, query, state)
+
+        parent = self._parent[node]
+        while parent != -1:
+            if self._ball_inside(node, state['query'], state['chord']):
+                break
+            sibling = self._right[parent] if self._left[parent] == node else self._left[parent]
+            self._search(sibling, query, state)
+            node, parent = parent, self._parent[parent]
+
+        # Окончательный выбор по Haversine среди кандидатов с минимальной хордой
+        limit = (state['chord'] + _CHORD_MARGIN) ** 2
+        positions = [found[chords <= limit] for found, chords in state['candidates']]
+        positions = positions[0] if len(positions) == 1 else np.concatenate(positions)
+
+        position = self._position[index]
+        if len(positions) == 1:
+            # Единственный кандидат — сравнивать по Haversine не с кем
+            best = int(positions[0])
+            distance = haversine_rad(
+                self._lat_p[position], self._lon_p[position], self._lat_p[best], self._lon_p[best]
+            )
+            return int(self._perm[best]), float(distance)
+
+        distances = haversine_rad(
+            self._lat_p[position], self._lon_p[position],
+            self._lat_p[positions], self._lon_p[positions]
+        )
+        best_distance = distances.min()
+        best_index = int(self._perm[positions[distances == best_distance]].min())
+
+        return best_index, float(best_distance)
+
+    def _ball_inside(self, node, query, chord):
+        """
+        Лежит ли шар радиуса chord вокруг точки запроса целиком внутри узла
+        """
+        radius = chord + _CHORD_MARGIN
+        lo, hi = self._lo[node], self._hi[node]
+        qx, qy, qz = query
+        return (lo[0] <= qx - radius and qx + radius <= hi[0]
+                and lo[1] <= qy - radius and qy + radius <= hi[1]
+                and lo[2] <= qz - radius and qz + radius <= hi[2])
+
+    def _search(self, root, query, state):
+        """
+        Поиск ближайших живых точек в поддереве root с отсечением по границам узлов.
+        Кандидаты (позиции и квадраты хорд) накапливаются в state.
+        """
+        if self._alive_count[root] == 0:
+            return
+
+        qx, qy, qz = state['query']
+        best_chord = state['chord']
+        candidates = state['candidates']
+
+        lo_all, hi_all = self._lo, self._hi
+        left_all, right_all = self._left, self._right
+        alive_count = self._alive_count
+
+        stack = [(root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if bound > best_chord + _CHORD_MARGIN:
+                continue
+
+            left = left_all[node]
+            if left == -1:
+                start, end = self._start[node], self._end[node]
+                diff = self._xyz_p[start:end] - query
+                chords = np.einsum('ij,ij->i', diff, diff)
+
+                local_min = math.sqrt(chords.min())
+                if local_min > best_chord + _CHORD_MARGIN:
+                    continue
+
+                best_chord = min(best_chord, local_min)
+                candidates.append((np.arange(start, end), chords))
+                continue
+
+            # Нижние оценки хорды до параллелепипедов потомков; пустые потомки пропускаются
+            children = []
+            for child in (left, right_all[node]):
+                if alive_count[child] == 0:
+                    continue
+                lo, hi = lo_all[child], hi_all[child]
+                dx = lo[0] - qx if qx < lo[0] else (qx - hi[0] if qx > hi[0] else 0.0)
+                dy = lo[1] - qy if qy < lo[1] else (qy - hi[1] if qy > hi[1] else 0.0)
+                dz = lo[2] - qz if qz < lo[2] else (qz - hi[2] if qz > hi[2] else 0.0)
+                children.append((child, math.sqrt(dx * dx + dy * dy + dz * dz)))
+
+            # Ближний потомок кладётся в стек последним, чтобы обработать его первым
+            if len(children) == 2 and children[0][1] <= children[1][1]:
+                children.reverse()
+            stack.extend(children)
+
+        state['chord'] = best_chord
+
+    def knn(self, k, budget=None):
+        """
+        Списки k ближайших соседей для всех точек индекса (без учёта удалений)
+
+        Обработка идёт по листьям: для точек листа кандидаты берутся из всех
+        листьев, лежащих в пределах радиуса k-го соседа, найденного среди точек
+        ближайшего достаточно крупного предка. Соседи упорядочены по возрастанию
+        расстояния.
+
+        Возвращает:
+            массив индексов формы (N, min(k, N - 1)) или None, если budget
+            (SearchBudget) истёк до окончания построения
+        """
+        k = min(k, self.size - 1)
+        neighbors = np.empty((self.size, max(k, 0)), dtype=np.int64)
+        if k <= 0:
+            return neighbors
+
+        xyz = self._xyz
+        for leaf in range(len(self._lo)):
+            if self._left[leaf] != -1:
+                continue
+            if budget is not None and leaf % 64 == 0 and budget.expired():
+                return None
+
+            members = self._perm[self._start[leaf]:self._end[leaf]]
+            points = xyz[members]
+
+            # Предварительный радиус — по предку, содержащему больше k точек
+            ancestor = leaf
+            while self._end[ancestor] - self._start[ancestor] <= k and self._parent[ancestor] != -1:
+                ancestor = self._parent[ancestor]
+            pool = self._perm[self._start[ancestor]:self._end[ancestor]]
+            chords = _pairwise_chords(points, xyz[pool])
+            radius = math.sqrt(np.partition(chords, k, axis=1)[:, k].max()) + _CHORD_MARGIN
+
+            # Все листья, пересекающие расширенный на радиус параллелепипед листа
+            lo = [v - radius for v in self._lo[leaf]]
+            hi = [v + radius for v in self._hi[leaf]]
+            pool = self._collect(lo, hi)
+
+            chords = _pairwise_chords(points, xyz[pool])
+            chords[pool[None, :] == members[:, None]] = np.inf
+            nearest = np.argpartition(chords, k - 1, axis=1)[:, :k]
+            nearest_chords = np.take_along_axis(chords, nearest, axis=1)
+            ranked = np.take_along_axis(nearest, np.argsort(nearest_chords, axis=1, kind='stable'), axis=1)
+            neighbors[members] = pool[ranked]
+
+        return neighbors
+
+    def _collect(self, lo, hi):
+        """
+        Индексы точек всех листьев, пересекающих параллелепипед [lo, hi]
+        """
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            node_lo, node_hi = self._lo[node], self._hi[node]
+            if any(node_lo[k] > hi[k] or node_hi[k] < lo[k] for k in range(3)):
+                continue
+            if self._left[node] == -1:
+                found.append(self._perm[self._start[node]:self._end[node]])
+            else:
+                stack.append(self._left[node])
+                stack.append(self._right[node])
+        return np.concatenate(found)
+
+
+def _pairwise_chords(points, others):
+    """
+    Квадраты хорд между двумя наборами единичных векторов
+    """
+    diff = points[:, None, :] - others[None, :, :]
+    return np.einsum('ijk,ijk->ij', diff, diff)
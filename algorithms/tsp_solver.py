@@ -1,4 +1,49 @@
-import math
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+import numpy as np
+
+from algorithms.budget import SearchBudget
+from algorithms.cost_matrix import HaversineProvider
+from algorithms.decomposition import solve_decomposed
+from algorithms.distance import (
+    haversine, haversine_matrix, haversine_one_to_many, to_radians, haversine_rad, path_length
+)
+from algorithms.exact import branch_and_bound_order, held_karp_order
+from algorithms.insertion import patch_order
+from algorithms.local_search import improve_tour
+from algorithms.portfolio import solve_portfolio
+from algorithms.lower_bounds import matrix_path_lower_bound, path_lower_bound
+from algorithms.spatial_index import SphericalKDTree
+from utils.metrics import timer
+
+# Начиная с этого числа точек ближайший сосед ищется через KD-дерево,
+# для меньших маршрутов быстрее полный векторизованный перебор
+SPATIAL_INDEX_THRESHOLD = 1000
+
+# Как часто (в шагах построения) проверяется бюджет времени
+_BUDGET_CHECK_STEPS = 256
+
+# Стратегии решения: auto — выбор по размеру задачи, exact — точное решение,
+# heuristic — ближайший сосед и локальный поиск, decomposition — разбиение
+# на кластеры, решаемые независимо (algorithms.decomposition), portfolio —
+# несколько разных построений с локальным поиском, лучшее из них
+# (algorithms.portfolio; только по явному выбору)
+STRATEGIES = ('auto', 'exact', 'heuristic', 'decomposition', 'portfolio')
+
+# До этого числа точек маршрут решается точно динамическим программированием
+# Хелда — Карпа (16 точек — около 40 мс)
+HELD_KARP_LIMIT = 16
+
+# До этого числа точек при улучшении маршрута (improve) результат локального
+# поиска доводится до оптимума методом ветвей и границ
+BRANCH_AND_BOUND_LIMIT = 30
+
+# Наибольшее время на метод ветвей и границ (не больше общего ограничения), секунды
+EXACT_TIME_LIMIT = 2.0
+
+# С этого числа точек маршрут строится разбиением на кластеры
+DECOMPOSITION_THRESHOLD = 100000
 
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -6,73 +51,452 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     Расчет расстояния между двумя точками по формуле Haversine
     Возвращает расстояние в километрах
     """
-    R = 6371.0  # Радиус Земли в км
+    return float(haversine(lat1, lon1, lat2, lon2))
 
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
 
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+def find_nearest_point(current_point, candidates):
+    """
+    Находит ближайшую точку к текущей из списка кандидатов
+    """
+    if not candidates:
+        return None, None
 
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    distances = haversine_one_to_many(
+        current_point['latitude'], current_point['longitude'],
+        [point['latitude'] for point in candidates],
+        [point['longitude'] for point in candidates]
+    )
 
-    return R * c
+    # argmin возвращает первый минимум — как и строгое сравнение в цикле
+    nearest_index = int(np.argmin(distances))
+    return candidates[nearest_index], nearest_index
 
 
-def find_nearest_point(current_point, candidates):
+def nearest_neighbor_order(latitudes, longitudes, start=0, budget=None):
     """
-    Находит ближайшую точку к текущей из списка кандидатов
+    Порядок обхода точек методом ближайшего соседа
+
+    Аргументы:
+        latitudes, longitudes: массивы координат в градусах
+        start: индекс начальной точки
+        budget: SearchBudget; если время истекло до конца построения,
+            оставшиеся точки дописываются в порядке strip_order
+
+    Возвращает:
+        массив индексов точек в порядке обхода
     """
-    min_distance = float('inf')
-    nearest_point = None
-    nearest_index = None
+    n = len(latitudes)
+    if n >= SPATIAL_INDEX_THRESHOLD:
+        return _nearest_neighbor_order_indexed(latitudes, longitudes, start, budget)
 
-    for idx, point in enumerate(candidates):
-        distance = haversine_distance(
-            current_point['latitude'], current_point['longitude'],
-            point['latitude'], point['longitude']
-        )
+    lats_rad, lons_rad = to_radians(latitudes, longitudes)
+
+    order = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        if budget is not None and step % _BUDGET_CHECK_STEPS == 0 and budget.expired():
+            order[step + 1:] = strip_order(latitudes, longitudes, np.flatnonzero(~visited))
+            break
+
+        distances = haversine_rad(lats_rad[current], lons_rad[current], lats_rad, lons_rad)
+        distances[visited] = np.inf
+        # При равных расстояниях выбирается точка с меньшим индексом
+        current = int(np.argmin(distances))
+
+    return order
+
+
+def nearest_neighbor_order_matrix(cost, start=0, budget=None):
+    """
+    Порядок обхода методом ближайшего соседа по матрице стоимостей:
+    из текущей точки переходим в самую дешёвую непосещённую
+    (budget — как у nearest_neighbor_order, оставшиеся точки дописываются
+    по возрастанию индекса)
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    n = len(cost)
+
+    order = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        if budget is not None and step % _BUDGET_CHECK_STEPS == 0 and budget.expired():
+            order[step + 1:] = np.flatnonzero(~visited)
+            break
+
+        row = np.where(visited, np.inf, cost[current])
+        current = int(np.argmin(row))
+
+    return order
+
+
+def matrix_path_length(cost, order):
+    """Стоимость незамкнутого маршрута по матрице стоимостей"""
+    order = np.asarray(order, dtype=np.int64)
+    return float(np.asarray(cost)[order[:-1], order[1:]].sum())
+
+
+def strip_order(latitudes, longitudes, indices):
+    """
+    Быстрый порядок обхода «змейкой»: точки делятся на полосы по широте,
+    внутри полосы упорядочиваются по долготе попеременно в разные стороны.
+    Используется, когда на метод ближайшего соседа не осталось времени.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) < 2:
+        return indices
+
+    lats = np.asarray(latitudes, dtype=np.float64)[indices]
+    lons = np.asarray(longitudes, dtype=np.float64)[indices]
+
+    strips = max(1, int(np.sqrt(len(indices) / 2)))
+    lat_min, lat_span = lats.min(), np.ptp(lats) or 1.0
+    strip = np.minimum(((lats - lat_min) / lat_span * strips).astype(np.int64), strips - 1)
+    lon_key = np.where(strip % 2 == 0, lons, -lons)
+
+    return indices[np.lexsort((lon_key, strip))]
+
+
+def _nearest_neighbor_order_indexed(latitudes, longitudes, start=0, budget=None):
+    """
+    Метод ближайшего соседа с поиском через KD-дерево — O(n log n) в среднем.
+    Порождает тот же порядок, что и полный перебор.
+    """
+    tree = SphericalKDTree(latitudes, longitudes)
+    n = tree.size
+
+    order = np.empty(n, dtype=np.int64)
+    current = start
+    for step in range(n):
+        order[step] = current
+        tree.remove(current)
+        if step == n - 1:
+            break
+        if budget is not None and step % _BUDGET_CHECK_STEPS == 0 and budget.expired():
+            order[step + 1:] = strip_order(latitudes, longitudes, tree.remaining())
+            break
+        current, _ = tree.nearest(current)
+
+    return order
 
-        if distance < min_distance:
-            min_distance = distance
-            nearest_point = point
-            nearest_index = idx
 
-    return nearest_point, nearest_index
+@dataclass
+class TSPSolution:
+    """Результат решения задачи коммивояжёра"""
+    order: np.ndarray  # Индексы исходных точек в порядке обхода
+    initial_length: float  # Длина маршрута после построения, км
+    length: float  # Итоговая длина маршрута, км
+    improved: bool = False  # Применялся ли локальный поиск
+    waypoints: Optional[Any] = None  # Точки в порядке обхода (для solve_tsp_detailed)
+    trace: List = field(default_factory=list)  # Пары (секунды от старта, длина в км)
+    lower_bound: Optional[float] = None  # Нижняя оценка длины (если задан target_gap)
+    timed_out: bool = False  # Решение остановлено по ограничению времени
+    elapsed: float = 0.0  # Время решения, секунды
+    cost_source: str = 'haversine'  # Источник стоимостей: haversine / road
+    # Применённая стратегия: exact / heuristic / decomposition / portfolio /
+    # warm_start (достроен прежний маршрут) / cache (маршрут из кэша решений)
+    strategy: str = 'heuristic'
+    optimal: bool = False  # Доказана ли оптимальность маршрута
+    runs: List = field(default_factory=list)  # Статистика запусков портфеля (стратегия portfolio)
 
+    @property
+    def gap(self):
+        """Относительный разрыв между длиной маршрута и нижней оценкой"""
+        if not self.lower_bound:
+            return None
+        return (self.length - self.lower_bound) / self.lower_bound
 
-def solve_tsp(waypoints):
+    @property
+    def improvement_percent(self):
+        """Сокращение длины маршрута локальным поиском, в процентах"""
+        if not self.initial_length:
+            return 0.0
+        return (self.initial_length - self.length) / self.initial_length * 100
+
+
+def choose_strategy(n, improve=False):
+    """
+    Стратегия решения для маршрута из n точек: точное решение, если оно
+    дёшево (до HELD_KARP_LIMIT точек) или если разрешено потратить время на
+    улучшение (до BRANCH_AND_BOUND_LIMIT точек), разбиение на кластеры для
+    очень больших маршрутов (от DECOMPOSITION_THRESHOLD точек), иначе эвристика
+    """
+    if n >= DECOMPOSITION_THRESHOLD:
+        return 'decomposition'
+    if n <= HELD_KARP_LIMIT or (improve and n <= BRANCH_AND_BOUND_LIMIT):
+        return 'exact'
+    return 'heuristic'
+
+
+def resolve_strategy(strategy, n, improve=False):
     """
-    Решение задачи коммивояжёра методом ближайшего соседа
+    Стратегия, которая действительно применяется к маршруту из n точек:
+    auto выбирается по choose_strategy, а exact для маршрутов больше
+    BRANCH_AND_BOUND_LIMIT точек заменяется на heuristic — точный перебор
+    для них не укладывается во время, а матрица N×N — в память
+    """
+    if strategy == 'auto':
+        return choose_strategy(n, improve)
+    if strategy == 'exact' and n > BRANCH_AND_BOUND_LIMIT:
+        return 'heuristic'
+    return strategy
+
+
+def solve_order(latitudes, longitudes, improve=False, time_limit=None, target_gap=None, cost=None,
+                strategy='auto', executor=None, workers=1, initial_order=None):
+    """
+    Порядок обхода точек: метод ближайшего соседа и, по желанию,
+    улучшение 2-opt/Or-opt; небольшие маршруты решаются точно, очень
+    большие — разбиением на кластеры
+
+    Решатель «anytime»: при заданном time_limit возвращается лучший маршрут,
+    найденный к моменту истечения времени. При заданном target_gap поиск
+    прекращается, как только длина маршрута отличается от нижней оценки
+    не более чем на target_gap (доля, например 0.1 = 10%).
+
+    Если задана матрица cost, маршрут оптимизируется по ней (например, по
+    расстояниям по дорогам), а длины в решении — стоимости по матрице.
+
+    Стратегия exact: до HELD_KARP_LIMIT точек — динамическое программирование
+    Хелда — Карпа, до BRANCH_AND_BOUND_LIMIT — локальный поиск и метод ветвей
+    и границ не дольше EXACT_TIME_LIMIT и общего ограничения времени; если
+    перебор не успел завершиться, оптимальность не доказана. Большие маршруты
+    решаются стратегией heuristic с локальным поиском (см. resolve_strategy).
+
+    Стратегия portfolio: PORTFOLIO_RUNS разных начальных маршрутов, каждый
+    улучшается локальным поиском (параллельно, если задан executor), в
+    решении — лучший маршрут и статистика запусков (runs).
+
+    С initial_order (прежний маршрут почти того же набора точек, например из
+    кэша решений) маршрут не строится заново: удалённые точки пропускаются,
+    новые вставляются по наименьшему приросту длины, и локальный поиск
+    улучшает маршрут только вокруг изменений (стратегия warm_start).
+    Для стратегии exact initial_order не используется.
 
     Аргументы:
-        waypoints: список словарей {'address': str, 'latitude': float, 'longitude': float}
+        latitudes, longitudes: координаты точек в градусах
+        improve: применять ли локальный поиск после построения
+        time_limit: ограничение по времени в секундах
+        target_gap: целевой относительный разрыв с нижней оценкой
+        cost: матрица стоимостей переходов (N, N), возможно несимметричная
+        strategy: auto (выбор по choose_strategy), exact, heuristic,
+            decomposition или portfolio (применяемая стратегия — resolve_strategy)
+        executor, workers: пул процессов (concurrent.futures.Executor) и число
+            его процессов для параллельного решения кластеров (decomposition)
+            и запусков портфеля (portfolio)
+        initial_order: прежний порядок обхода — индексы точек, -1 на месте
+            удалённых; начинается с точки 0
 
     Возвращает:
-        упорядоченный список точек (начиная с первой точки из исходного списка)
+        TSPSolution (без waypoints) с трассой длины маршрута по времени
     """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    budget = SearchBudget(time_limit)
+    if cost is not None:
+        cost = np.asarray(cost, dtype=np.float64)
+
+    if strategy == 'exact' and len(latitudes) > BRANCH_AND_BOUND_LIMIT:
+        # Вместо точного решения — лучшее, что даёт эвристика
+        improve = True
+    strategy = resolve_strategy(strategy, len(latitudes), improve)
+    if initial_order is not None and strategy != 'exact':
+        # Точное решение прежним маршрутом не заменяется
+        strategy = 'warm_start'
+    if strategy == 'decomposition' and cost is not None:
+        # Разбиение на кластеры работает только с расстояниями по прямой
+        strategy = 'heuristic'
+
+    def measure(order):
+        if cost is not None:
+            return matrix_path_length(cost, order)
+        return path_length(latitudes[order], longitudes[order])
+
+    runs = []
+    focus = None
+    if strategy == 'warm_start':
+        with timer('tsp_warm_start'):
+            order, focus = patch_order(initial_order, latitudes, longitudes)
+        if not len(focus):
+            # Набор не изменился (незавершённое прежнее решение): локальный
+            # поиск продолжается по всему маршруту
+            focus = None
+        initial_length = measure(order)
+        budget.record(initial_length, force=True)
+    elif strategy == 'decomposition':
+        # Начальная длина — у склеенного из кластеров маршрута
+        with timer('tsp_decompose'):
+            order, initial_length = solve_decomposed(
+                latitudes, longitudes, improve=improve, budget=budget, executor=executor, workers=workers
+            )
+    elif strategy == 'portfolio':
+        with timer('tsp_portfolio'):
+            order, runs = solve_portfolio(
+                latitudes, longitudes, budget=budget, executor=executor, workers=workers, cost=cost
+            )
+        # Начальная длина — у построения, из которого получен лучший маршрут
+        initial_length = next(run['initial_length'] for run in runs if run['best'])
+    else:
+        with timer('tsp_construct'):
+            if cost is not None:
+                order = nearest_neighbor_order_matrix(cost, budget=budget)
+            else:
+                order = nearest_neighbor_order(latitudes, longitudes, budget=budget)
+        initial_length = measure(order)
+        budget.record(initial_length, force=True)
+
+    lower_bound = None
+    if target_gap is not None and not budget.expired():
+        if cost is not None:
+            lower_bound = matrix_path_lower_bound(cost)
+        else:
+            lower_bound = path_lower_bound(latitudes, longitudes)
+        budget.target_length = lower_bound * (1 + target_gap)
+
+    length = initial_length
+    optimal = False
+    if strategy == 'exact' and not budget.expired() and not budget.reached(length):
+        with timer('tsp_exact'):
+            order, optimal = _exact_order(order, latitudes, longitudes, cost, budget)
+        length = measure(order)
+        budget.record(length, force=True)
+    elif strategy in ('decomposition', 'portfolio'):
+        length = measure(order)
+    elif strategy == 'warm_start':
+        # Остальной маршрут уже улучшен, поэтому ремонт вокруг изменений
+        # выполняется и без improve
+        if not budget.expired() and not budget.reached(length):
+            with timer('tsp_improve'):
+                order = improve_tour(order, latitudes, longitudes, budget=budget, cost=cost, focus=focus)
+            length = measure(order)
+    else:
+        strategy = 'heuristic'
+        if improve and not budget.expired() and not budget.reached(length):
+            with timer('tsp_improve'):
+                order = improve_tour(order, latitudes, longitudes, budget=budget, cost=cost)
+            length = measure(order)
+
+    return TSPSolution(
+        order=order,
+        initial_length=initial_length,
+        length=length,
+        improved=improve or strategy == 'portfolio',
+        trace=budget.trace,
+        lower_bound=lower_bound,
+        timed_out=budget.timed_out,
+        elapsed=budget.elapsed(),
+        strategy=strategy,
+        optimal=optimal,
+        runs=runs
+    )
+
+
+def _exact_order(order, latitudes, longitudes, cost, budget):
+    """
+    Точное решение (стратегия exact), начиная с маршрута order
+
+    Возвращает:
+        (порядок обхода, доказана ли оптимальность)
+    """
+    matrix = cost if cost is not None else haversine_matrix(latitudes, longitudes)
+    if len(order) <= HELD_KARP_LIMIT:
+        order, _ = held_karp_order(matrix)
+        return order, True
+
+    # Хорошая начальная верхняя оценка сильно сокращает перебор
+    order = improve_tour(order, latitudes, longitudes, budget=budget, cost=cost)
+    order, _, proven = branch_and_bound_order(
+        matrix, initial_order=order, budget=budget.limited(EXACT_TIME_LIMIT)
+    )
+    # Отметка об истечении общего ограничения времени
+    budget.expired()
+    return order, proven
+
+
+def solve_tsp_detailed(waypoints, improve=False, time_limit=None, target_gap=None, cost_provider=None,
+                       strategy='auto', executor=None, workers=1, initial_order=None):
+    """
+    То же, что solve_tsp, но возвращает TSPSolution с длинами маршрута
+    до и после улучшения и трассой решения; initial_order — прежний маршрут
+    для стратегии warm_start (см. solve_order)
+    """
+    # Колоночный буфер точек: координаты берутся без копирования, а точки
+    # в порядке обхода — перестановкой буфера (WaypointBuffer.take)
+    columnar = hasattr(waypoints, 'coordinates')
+
     if len(waypoints) <= 1:
-        return waypoints
+        return TSPSolution(
+            order=np.arange(len(waypoints)), initial_length=0.0, length=0.0,
+            improved=improve, waypoints=waypoints if columnar else list(waypoints),
+            strategy='exact', optimal=True
+        )
+
+    if columnar:
+        latitudes, longitudes = waypoints.coordinates()
+    else:
+        latitudes = [wp['latitude'] for wp in waypoints]
+        longitudes = [wp['longitude'] for wp in waypoints]
+
+    cost = None
+    if cost_provider is not None and not isinstance(cost_provider, HaversineProvider):
+        with timer('cost_matrix'):
+            cost = cost_provider.matrix(latitudes, longitudes)
 
-    # Начинаем с первой точки
-    ordered = [waypoints[0]]
-    remaining = waypoints[1:].copy()
+    solution = solve_order(
+        latitudes,
+        longitudes,
+        improve=improve,
+        time_limit=time_limit,
+        target_gap=target_gap,
+        cost=cost,
+        strategy=strategy,
+        executor=executor,
+        workers=workers,
+        initial_order=initial_order
+    )
+    if columnar:
+        solution.waypoints = waypoints.take(solution.order)
+    else:
+        solution.waypoints = [waypoints[idx] for idx in solution.order]
+    if cost_provider is not None:
+        solution.cost_source = cost_provider.name
+    return solution
 
-    current = waypoints[0]
 
-    # Пока есть непосещенные точки
-    while remaining:
-        # Находим ближайшую точку
-        nearest, idx = find_nearest_point(current, remaining)
+def solve_tsp(waypoints, improve=False, time_limit=None, target_gap=None, cost_provider=None,
+              strategy='auto'):
+    """
+    Решение задачи коммивояжёра: небольшие маршруты — точно, остальные —
+    методом ближайшего соседа
 
-        # Добавляем в маршрут
-        ordered.append(nearest)
-        current = nearest
+    Аргументы:
+        waypoints: список словарей {'address': str, 'latitude': float, 'longitude': float}
+            или WaypointBuffer (тогда и результат — WaypointBuffer)
+        improve: улучшить маршрут локальным поиском 2-opt/Or-opt
+        time_limit: ограничение по времени в секундах (возвращается лучший найденный маршрут)
+        target_gap: остановить поиск при разрыве с нижней оценкой не больше этой доли
+        cost_provider: источник стоимостей переходов (HaversineProvider,
+            RoadMatrixProvider); по умолчанию — расстояние по прямой
+        strategy: стратегия решения из STRATEGIES (auto — выбор по размеру)
 
-        # Удаляем из оставшихся
-        remaining.pop(idx)
+    Возвращает:
+        упорядоченный список точек (начиная с первой точки из исходного списка)
+    """
+    if len(waypoints) <= 1:
+        return waypoints
 
-    return ordered
\ No newline at end of file
+    return solve_tsp_detailed(
+        waypoints, improve=improve, time_limit=time_limit, target_gap=target_gap,
+        cost_provider=cost_provider, strategy=strategy
+    ).waypoints
@@ -0,0 +1,423 @@
+from dataclasses import dataclass, field
+from typing import List
+
+import numpy as np
+
+from algorithms.budget import SearchBudget
+from algorithms.distance import haversine_matrix, path_length
+from algorithms.local_search import _PathDistance, improve_tour, neighbor_lists
+from utils.metrics import timer
+
+# Ближайших соседей точки, в маршруты которых пробуется её перенос или обмен
+MOVE_NEIGHBORS = 10
+
+# Наибольшее число раундов «перемещения между машинами → улучшение маршрутов»
+IMPROVE_ROUNDS = 5
+
+# Доля оставшегося времени на первое решение маршрутов машин; остальное —
+# на перемещения точек между машинами
+FIRST_SOLVE_SHARE = 0.4
+
+# Как часто (в просмотренных точках) проверяется бюджет времени
+_BUDGET_CHECK_STEPS = 256
+
+# Стоимость перехода из закреплённой точки: с ней копия склада в конце
+# замкнутого маршрута остаётся последней
+_LOCKED_COST = 1e9
+
+# Выигрыш меньше этой величины (км) не считается улучшением
+_EPSILON = 1e-9
+
+
+@dataclass
+class VRPSolution:
+    """Результат планирования маршрутов нескольких машин"""
+    tours: List  # Маршруты машин: индексы точек от склада (и обратно до склада, если closed)
+    loads: List  # Загрузка машин (сумма спроса точек)
+    lengths: List  # Длины маршрутов машин, км
+    initial_length: float  # Суммарная длина после распределения и решения маршрутов, км
+    length: float  # Итоговая суммарная длина, км
+    moves: int = 0  # Число перемещений точек между машинами
+    trace: List = field(default_factory=list)  # Пары (секунды от старта, суммарная длина в км)
+    timed_out: bool = False  # Улучшение остановлено по ограничению времени
+    elapsed: float = 0.0  # Время решения, секунды
+
+    @property
+    def vehicles_used(self):
+        """Число машин, получивших хотя бы одну точку"""
+        return sum(1 for tour in self.tours if (np.asarray(tour) != tour[0]).any())
+
+
+def sweep_assignment(latitudes, longitudes, demands, capacities, depot=0):
+    """
+    Распределение точек по машинам методом заметания: точки сортируются по
+    углу относительно склада (начиная после самого большого пустого сектора)
+    и по очереди достаются машинам
+
+    Сначала загрузка машин выравнивается (каждая берёт примерно поровну
+    оставшегося спроса), а если так точки не помещаются — машины
+    заполняются до вместимости.
+
+    Аргументы:
+        latitudes, longitudes: координаты точек в градусах
+        demands: спрос точек (у склада — 0)
+        capacities: вместимость каждой машины
+        depot: индекс склада
+
+    Возвращает:
+        список массивов индексов точек каждой машины (без склада)
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    stops = np.delete(np.arange(len(latitudes)), depot)
+
+    angles = np.arctan2(
+        latitudes[stops] - latitudes[depot],
+        (longitudes[stops] - longitudes[depot]) * np.cos(np.radians(latitudes[depot]))
+    )
+    by_angle = np.argsort(angles, kind='stable')
+    sorted_angles = angles[by_angle]
+    gaps = np.diff(np.append(sorted_angles, sorted_angles[0] + 2 * np.pi))
+    sequence = np.roll(stops[by_angle], -(int(np.argmax(gaps)) + 1))
+
+    groups = _fill(sequence, demands, capacities, balanced=True)
+    if groups is None:
+        groups = _fill(sequence, demands, capacities, balanced=False)
+    if groups is None:
+        raise ValueError('Точки не помещаются в машины: увеличьте число машин или вместимость')
+    return groups
+
+
+def _fill(sequence, demands, capacities, balanced):
+    """
+    Нарезка последовательности точек на группы по машинам
+
+    Возвращает:
+        список массивов индексов точек или None, если точки не поместились
+    """
+    loads = np.asarray(demands, dtype=np.float64)[sequence].tolist()
+    remaining = float(sum(loads))
+    groups = []
+    position = 0
+    last = len(capacities) - 1
+    for vehicle, capacity in enumerate(capacities):
+        # Выравнивание: машине достаётся её доля оставшегося спроса
+        target = remaining / (last - vehicle + 1) if balanced and vehicle < last else np.inf
+        start = position
+        load = 0.0
+        while position < len(sequence):
+            demand = loads[position]
+            if load + demand > capacity or load >= target:
+                break
+            load += demand
+            position += 1
+        groups.append(sequence[start:position])
+        remaining -= load
+    if position < len(sequence):
+        return None
+    return groups
+
+
+def solve_vehicle(task):
+    """
+    Маршрут одной машины от склада через её точки: решение задачи
+    коммивояжёра (solve_order) или, если задан начальный порядок, его
+    улучшение 2-opt/Or-opt. Для замкнутого маршрута в конец добавляется копия
+    склада, закреплённая последней. Выполняется в рабочем процессе.
+
+    Аргументы:
+        task: словарь с массивами latitudes, longitudes (склад — первая точка),
+            признаком closed, параметрами improve, time_limit и, по желанию,
+            начальным порядком order (индексы точек задачи, склад — первый)
+
+    Возвращает:
+        массив индексов точек задачи в порядке обхода (склад — первый, без
+        копии склада в конце)
+    """
+    from algorithms.tsp_solver import solve_order
+
+    latitudes = task['latitudes']
+    longitudes = task['longitudes']
+    n = len(latitudes)
+    if n <= 2:
+        return np.arange(n)
+
+    cost = None
+    if task['closed']:
+        latitudes = np.append(latitudes, latitudes[0])
+        longitudes = np.append(longitudes, longitudes[0])
+        cost = haversine_matrix(latitudes, longitudes)
+        # Из копии склада выйти нельзя, а со склада сразу в неё — невыгодно
+        cost[-1, :-1] = _LOCKED_COST
+        cost[0, -1] = _LOCKED_COST
+
+    if task.get('order') is None:
+        order = solve_order(
+            latitudes, longitudes, improve=task['improve'], time_limit=task['time_limit'], cost=cost
+        ).order
+    else:
+        order = np.asarray(task['order'], dtype=np.int64)
+        if task['closed']:
+            order = np.append(order, n)
+        order = improve_tour(order, latitudes, longitudes, budget=SearchBudget(task['time_limit']), cost=cost)
+    # Построение может пройти через копию склада раньше конца: без неё
+    # замкнутый маршрут по неравенству треугольника не длиннее
+    return order[order != n]
+
+
+def _solve_tours(tours, latitudes, longitudes, closed, improve, budget, share, executor, workers,
+                 initial=False):
+    """
+    Решение маршрутов машин (параллельно, если задан executor)
+
+    Аргументы:
+        tours: словарь {машина: индексы точек, склад — первый}
+        initial: tours — уже упорядоченные маршруты, их нужно только улучшить
+        share: доля оставшегося времени на все маршруты
+
+    Возвращает:
+        словарь {машина: индексы точек в порядке обхода, склад — первый}
+    """
+    vehicles = [vehicle for vehicle, tour in tours.items() if len(tour) > 2]
+    limit = None
+    remaining = budget.remaining()
+    if remaining is not None:
+        waves = -(-len(vehicles) // workers) if executor is not None else len(vehicles)
+        limit = remaining * share / max(waves, 1)
+
+    tasks = []
+    for vehicle in vehicles:
+        tour = np.asarray(tours[vehicle], dtype=np.int64)
+        tasks.append({
+            'latitudes': latitudes[tour],
+            'longitudes': longitudes[tour],
+            'closed': closed,
+            'improve': improve,
+            'time_limit': limit,
+            'order': np.arange(len(tour)) if initial else None,
+        })
+    if executor is not None:
+        orders = list(executor.map(solve_vehicle, tasks))
+    else:
+        orders = [solve_vehicle(task) for task in tasks]
+
+    solved = dict(tours)
+    for vehicle, order in zip(vehicles, orders):
+        solved[vehicle] = np.asarray(tours[vehicle], dtype=np.int64)[order]
+    return solved
+
+
+def improve_assignment(tours, latitudes, longitudes, demands, capacities, closed=True, budget=None,
+                       neighbors=MOVE_NEIGHBORS, depot=0):
+    """
+    Улучшение распределения точек между машинами: перенос точки в маршрут
+    другой машины (рядом с одной из её ближайших соседей) и обмен двух точек
+    разных машин, если это сокращает суммарную длину и не превышает
+    вместимость. Точки просматриваются, пока находятся улучшения.
+
+    Аргументы:
+        tours: список маршрутов машин (индексы точек, склад — первый, без
+            копии склада в конце)
+        demands: спрос точек
+        capacities: вместимость каждой машины
+        closed: маршруты возвращаются на склад
+
+    Возвращает:
+        (новые маршруты, множество изменённых машин, число перемещений)
+    """
+    budget = budget or SearchBudget()
+    distance = _PathDistance(latitudes, longitudes)
+    demands = np.asarray(demands, dtype=np.float64).tolist()
+    routes = [np.asarray(tour).tolist() + ([depot] if closed else []) for tour in tours]
+    loads = [sum(demands[node] for node in route) for route in routes]
+
+    route_of = [-1] * len(latitudes)
+    position = [0] * len(latitudes)
+
+    def reindex(vehicle, start=1):
+        route = routes[vehicle]
+        for idx in range(start, len(route) - closed):
+            route_of[route[idx]] = vehicle
+            position[route[idx]] = idx
+
+    for vehicle in range(len(routes)):
+        reindex(vehicle)
+    candidates = neighbor_lists(latitudes, longitudes, neighbors).tolist()
+
+    def around(route, idx):
+        return route[idx - 1], route[idx + 1] if idx + 1 < len(route) else None
+
+    changed = set()
+    moves = 0
+    steps = 0
+    improved = True
+    while improved and not budget.timed_out:
+        improved = False
+        for stop in range(len(latitudes)):
+            steps += 1
+            if steps % _BUDGET_CHECK_STEPS == 0 and budget.expired():
+                break
+            if stop == depot:
+                continue
+            a = route_of[stop]
+            route_a = routes[a]
+            i = position[stop]
+            prev_a, next_a = around(route_a, i)
+            removal = distance(prev_a, stop) + distance(stop, next_a) - distance(prev_a, next_a)
+
+            best_gain, best_move = _EPSILON, None
+            for other in candidates[stop]:
+                b = route_of[other]
+                if other == depot or b == a:
+                    continue
+                route_b = routes[b]
+                j = position[other]
+                prev_b, next_b = around(route_b, j)
+
+                # Перенос: точка встаёт перед соседом или после него
+                if loads[b] + demands[stop] <= capacities[b]:
+                    for x, y, at in ((prev_b, other, j), (other, next_b, j + 1)):
+                        gain = removal - (distance(x, stop) + distance(stop, y) - distance(x, y))
+                        if gain > best_gain:
+                            best_gain, best_move = gain, ('move', b, at)
+
+                # Обмен точки с соседом
+                if (loads[a] - demands[stop] + demands[other] <= capacities[a]
+                        and loads[b] - demands[other] + demands[stop] <= capacities[b]):
+                    gain = (
+                        distance(prev_a, stop) + distance(stop, next_a)
+                        + distance(prev_b, other) + distance(other, next_b)
+                        - distance(prev_a, other) - distance(other, next_a)
+                        - distance(prev_b, stop) - distance(stop, next_b)
+                    )
+                    if gain > best_gain:
+                        best_gain, best_move = gain, ('swap', b, other)
+
+            if best_move is None:
+                continue
+            kind, b, target = best_move
+            if kind == 'move':
+                route_a.pop(i)
+                routes[b].insert(target, stop)
+                loads[a] -= demands[stop]
+                loads[b] += demands[stop]
+                reindex(a, i)
+                reindex(b, target)
+            else:
+                j = position[target]
+                route_a[i], routes[b][j] = target, stop
+                loads[a] += demands[target] - demands[stop]
+                loads[b] += demands[stop] - demands[target]
+                reindex(a, i)
+                reindex(b, j)
+            changed.update((a, b))
+            moves += 1
+            improved = True
+
+    tours = [np.array(route[:len(route) - closed], dtype=np.int64) for route in routes]
+    return tours, changed, moves
+
+
+def solve_vrp(latitudes, longitudes, vehicles, demands=None, capacity=None, closed=True, improve=True,
+              time_limit=None, executor=None, workers=1, depot=0):
+    """
+    Маршруты нескольких машин со склада с ограничением вместимости
+
+    Точки распределяются по машинам заметанием (sweep_assignment), маршрут
+    каждой машины решается как задача коммивояжёра (solve_order). С improve
+    затем чередуются перемещения точек между машинами (improve_assignment)
+    и улучшение изменившихся маршрутов 2-opt/Or-opt. Маршруты машин решаются
+    параллельно, если задан executor.
+
+    Аргументы:
+        latitudes, longitudes: координаты точек в градусах
+        vehicles: число машин
+        demands: спрос точек (None — по единице на точку); спрос склада не учитывается
+        capacity: вместимость машины (None — без ограничения)
+        closed: маршруты возвращаются на склад
+        improve: улучшать распределение и маршруты
+        time_limit: ограничение по времени в секундах
+        executor, workers: пул процессов и число его процессов
+        depot: индекс склада
+
+    Возвращает:
+        VRPSolution
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    n = len(latitudes)
+    if vehicles < 1:
+        raise ValueError('Нужна хотя бы одна машина')
+    budget = SearchBudget(time_limit)
+
+    demands = np.ones(n) if demands is None else np.array(demands, dtype=np.float64)
+    demands[depot] = 0.0
+    capacities = [np.inf if capacity is None else float(capacity)] * vehicles
+    if capacity is not None:
+        heaviest = int(np.argmax(demands))
+        if demands[heaviest] > capacity:
+            raise ValueError(f'Спрос точки {heaviest + 1} ({demands[heaviest]:g}) больше вместимости машины')
+        if demands.sum() > capacity * vehicles:
+            raise ValueError(
+                f'Суммарный спрос ({demands.sum():g}) больше вместимости всех машин ({capacity * vehicles:g})'
+            )
+
+    def total(tours):
+        return sum(_tour_length(tour, latitudes, longitudes, closed, depot) for tour in tours)
+
+    with timer('vrp_assign'):
+        groups = sweep_assignment(latitudes, longitudes, demands, capacities, depot)
+    with timer('vrp_solve_tours'):
+        solved = _solve_tours(
+            {vehicle: np.concatenate(([depot], group)) for vehicle, group in enumerate(groups)},
+            latitudes, longitudes, closed, improve, budget, FIRST_SOLVE_SHARE, executor, workers
+        )
+    tours = [solved[vehicle] for vehicle in range(vehicles)]
+    initial_length = total(tours)
+    budget.record(initial_length, force=True)
+
+    moves = 0
+    if improve:
+        for _ in range(IMPROVE_ROUNDS):
+            if budget.expired():
+                break
+            with timer('vrp_moves'):
+                tours, changed, count = improve_assignment(
+                    tours, latitudes, longitudes, demands, capacities, closed, budget, depot=depot
+                )
+            if not changed:
+                break
+            moves += count
+            budget.record(total(tours))
+            with timer('vrp_solve_tours'):
+                solved = _solve_tours(
+                    {vehicle: tours[vehicle] for vehicle in sorted(changed)},
+                    latitudes, longitudes, closed, improve, budget, 0.5, executor, workers, initial=True
+                )
+            for vehicle, tour in solved.items():
+                tours[vehicle] = tour
+            budget.record(total(tours))
+
+    if closed:
+        tours = [np.append(tour, depot) for tour in tours]
+    lengths = [_tour_length(tour, latitudes, longitudes, False, depot) for tour in tours]
+    return VRPSolution(
+        tours=tours,
+        loads=[float(demands[tour].sum()) for tour in tours],
+        lengths=lengths,
+        initial_length=initial_length,
+        length=sum(lengths),
+        moves=moves,
+        trace=budget.trace,
+        timed_out=budget.timed_out,
+        elapsed=budget.elapsed()
+    )
+
+
+def _tour_length(tour, latitudes, longitudes, closed, depot):
+    """Длина маршрута машины (с возвратом на склад, если closed), км"""
+    if len(tour) < 2:
+        return 0.0
+    if closed:
+        tour = np.append(tour, depot)
+    return path_length(latitudes[tour], longitudes[tour])
@@ -1,63 +1,141 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, abort, g, Response
 import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+
+import numpy as np
 from werkzeug.utils import secure_filename
-from models import db, Route, Waypoint
-from utils.csv_parser import parse_csv_file
-from utils.map_generator import create_route_map
-from algorithms.tsp_solver import solve_tsp
-# Добавляем импорт утилиты яндекса
-from utils.yandex_router import get_route_by_roads
+from models import db, init_db, Route, Waypoint, Job, Plan
+from utils.csv_parser import parse_csv_stream, CSVParseError, DEMAND_COLUMN
+from utils.map_cache import map_cache, map_cache_key, geometry_fingerprint
+from utils.job_queue import job_queue, solve_problem
+from utils.metrics import metrics, start_profile, finish_profile, server_timing
+from utils.waypoint_buffer import WaypointBuffer
 from dotenv import load_dotenv
 
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Создание приложения
-app = Flask(__name__)
-
-# Конфигурация
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///routes.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAP_FOLDER'] = 'static/maps'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs(app.config['MAP_FOLDER'], exist_ok=True)
-
-
-# Инициализация базы данных
-# db = SQLAlchemy(app)
-db.init_app(app)
-
-with app.app_context():
-    db.create_all()
-
-# Убеждаемся, что папка uploads существует
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
-# Импорты утилит
-from utils.map_generator import create_route_map
-from utils.yandex_router import get_route_by_roads
-
-@app.route('/result/<int:route_id>/roads')
+# Обработчики приложения; регистрируются в create_app. Карты (folium),
+# маршрутизация по дорогам (requests) и решатель TSP импортируются
+# внутри обработчиков, которым они нужны, — при первом обращении
+bp = Blueprint('main', __name__)
+
+
+def create_app(config=None):
+    """
+    Создание приложения: конфигурация из окружения (.env), расширения
+    и обработчики
+
+    Схема БД здесь не создаётся: это отдельный шаг — команда
+    flask --app app init-db (python app.py выполняет его сам).
+
+    Аргументы:
+        config: словарь настроек поверх значений из окружения
+
+    Возвращает:
+        приложение Flask
+    """
+    # Загрузка переменных окружения
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    # Конфигурация
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///routes.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['MAP_FOLDER'] = 'static/maps'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+    # Сколько ошибочных строк CSV пропускается, прежде чем загрузка отклоняется
+    app.config['CSV_MAX_ERRORS'] = int(os.getenv('CSV_MAX_ERRORS', '100'))
+    # Ограничение времени решения TSP в фоновой задаче (секунды)
+    app.config['TSP_TIME_LIMIT'] = float(os.getenv('TSP_TIME_LIMIT', '10'))
+    # Наибольшее число точек для оптимизации по расстояниям по дорогам
+    # (матрица N×N запрашивается у сервиса маршрутизации)
+    app.config['ROAD_MATRIX_MAX_POINTS'] = int(os.getenv('ROAD_MATRIX_MAX_POINTS', '100'))
+    # Ограничение общего размера кэша карт (мегабайты)
+    app.config['MAP_CACHE_MAX_BYTES'] = int(os.getenv('MAP_CACHE_MAX_MB', '200')) * 1024 * 1024
+    # Наибольшее число задач в одном запросе пакетного API
+    app.config['API_MAX_PROBLEMS'] = int(os.getenv('API_MAX_PROBLEMS', '1000'))
+    # Наибольшее число машин в плане развоза
+    app.config['PLAN_MAX_VEHICLES'] = int(os.getenv('PLAN_MAX_VEHICLES', '100'))
+    # Запрос с этим заголовком получает в ответе Server-Timing с длительностью этапов
+    app.config['PROFILE_HEADER'] = os.getenv('PROFILE_HEADER', 'X-Profile')
+    app.config.update(config or {})
+
+    # Инициализация базы данных
+    db.init_app(app)
+
+    # Очередь фоновых задач расчёта маршрутов
+    job_queue.init_app(app)
+
+    # Кэш сгенерированных карт (создаёт и папку карт)
+    map_cache.init_app(app)
+
+    app.register_blueprint(bp)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Создание схемы БД и добавление новых колонок и индексов"""
+        init_db()
+        print('Схема БД готова')
+
+    return app
+
+
+@bp.before_app_request
+def _start_request_timing():
+    g.request_started = time.perf_counter()
+    if request.headers.get(current_app.config['PROFILE_HEADER']):
+        g.profile_token = start_profile()
+
+
+@bp.after_app_request
+def _record_request_timing(response):
+    """Метрики запроса и, если запрошено профилирование, заголовок Server-Timing"""
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('http_request_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+
+    token = g.pop('profile_token', None)
+    if token is not None:
+        response.headers['Server-Timing'] = server_timing(finish_profile(token), total=elapsed)
+    return response
+
+
+@bp.teardown_app_request
+def _finish_request_profile(exc):
+    # Запрос завершился исключением — after_request не вызывался
+    token = g.pop('profile_token', None)
+    if token is not None:
+        finish_profile(token)
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    """Метрики приложения в текстовом формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.route('/result/<int:route_id>/roads')
 def result_roads(route_id):
     """Версия маршрута с расчётом по дорогам"""
     route = Route.query.get_or_404(route_id)
-    waypoints = Waypoint.query.filter_by(route_id=route_id).order_by(Waypoint.order_index).all()
+    waypoints = Waypoint.for_route(route_id)
 
     # Попытка построить маршрут по дорогам через Яндекс
     use_yandex_roads = request.args.get('roads', '0') == '1'
     yandex_route_data = None
 
     if use_yandex_roads:
+        from utils.yandex_router import get_route_by_roads
+
         waypoints_data = [{
             'latitude': wp.latitude,
             'longitude': wp.longitude,
@@ -66,103 +144,204 @@ def result_roads(route_id):
 
         yandex_route_data = get_route_by_roads(waypoints_data)
 
-        if yandex_route_data:
-            # Обновляем дистанцию в базе
-            route.total_distance = yandex_route_data['distance_km']
-            db.session.commit()
-
     # Передаём yandex_route_data в create_route_map
-    map_obj = create_route_map(
-        waypoints,
-        route.name,
-        yandex_geometry=yandex_route_data['geometry'] if yandex_route_data else None
-    )
-
-    map_html = map_obj._repr_html_()
+    map_url = _route_map_url(route, waypoints, yandex_route_data)
 
     # Передаём данные в шаблон
     return render_template(
         'result.html',
         route=route,
         waypoints=waypoints,
-        map_html=map_html,
+        map_url=map_url,
         yandex_available=yandex_route_data is not None,
         use_yandex_roads=use_yandex_roads
     )
 
-@app.route('/')
+def _route_map_url(route, waypoints, yandex_route_data=None):
+    """
+    Адрес карты маршрута из кэша; карта генерируется, только если
+    изменились точки, геометрия или шаблон
+    """
+    from utils.map_generator import create_route_map, MAP_TEMPLATE_VERSION
+
+    geometry = yandex_route_data['geometry'] if yandex_route_data else None
+    geometry_source = f'yandex:{geometry_fingerprint(geometry)}' if geometry else 'straight'
+    key = map_cache_key(waypoints, route.name, geometry_source, MAP_TEMPLATE_VERSION)
+
+    map_cache.get_or_create(
+        key,
+        lambda: create_route_map(waypoints, route.name, yandex_geometry=geometry)
+    )
+    return url_for('main.cached_map', key=key)
+
+
+@bp.route('/maps/<key>.html')
+def cached_map(key):
+    """Карта из кэша: ключ — хэш содержимого, поэтому он же служит ETag"""
+    if not map_cache.is_key(key) or not map_cache.touch(key):
+        abort(404)
+    return send_from_directory(
+        current_app.config['MAP_FOLDER'],
+        map_cache.filename(key),
+        etag=key,
+        max_age=3600
+    )
+
+
+@bp.route('/')
 def index():
     """Главная страница — форма загрузки CSV"""
     return render_template('index.html')
 
 
-@app.route('/manual')
+@bp.route('/manual')
 def manual_input():
     """Страница ручного ввода точек"""
     return render_template('manual_input.html')
 
 
-@app.route('/upload', methods=['POST'])
+def _improve_requested():
+    """Включено ли улучшение маршрута локальным поиском (поле формы improve)"""
+    return request.form.get('improve', '0') == '1'
+
+
+def _cost_source(count):
+    """
+    Источник стоимостей для решения (поле формы road_costs): по дорогам
+    или по прямой. Для слишком больших маршрутов — всегда по прямой.
+    """
+    if request.form.get('road_costs', '0') != '1':
+        return 'haversine'
+    if count > current_app.config['ROAD_MATRIX_MAX_POINTS']:
+        flash(
+            f'Оптимизация по дорогам доступна до {current_app.config["ROAD_MATRIX_MAX_POINTS"]} точек, '
+            f'маршрут рассчитан по прямой',
+            'warning'
+        )
+        return 'haversine'
+    return 'road'
+
+
+def _plan_options():
+    """
+    Параметры плана развоза из формы: число машин (vehicles), вместимость
+    машины (capacity, пусто — без ограничения), адрес склада (depot, пусто —
+    склад в первой строке CSV) и возврат машин на склад (closed)
+    """
+    try:
+        vehicles = int(request.form.get('vehicles') or 1)
+        capacity = request.form.get('capacity', '').strip()
+        capacity = float(capacity) if capacity else None
+    except ValueError:
+        raise ValueError('Число машин и вместимость должны быть числами')
+    if not 1 <= vehicles <= current_app.config['PLAN_MAX_VEHICLES']:
+        raise ValueError(f'Число машин должно быть от 1 до {current_app.config["PLAN_MAX_VEHICLES"]}')
+    if capacity is not None and not capacity > 0:
+        raise ValueError('Вместимость машины должна быть положительной')
+    return {
+        'vehicles': vehicles,
+        'capacity': capacity,
+        'closed': request.form.get('closed', '0') == '1',
+        'depot': request.form.get('depot', '').strip(),
+    }
+
+
+def _with_depot(buffer, depot):
+    """
+    Точки плана со складом первым: адрес склада из формы (координаты
+    найдёт геокодирование) или, если он не задан, первая точка CSV
+    """
+    if not depot:
+        return buffer
+    demands = buffer.demand_values()
+    points = WaypointBuffer()
+    points.extend([depot], [np.nan], [np.nan], None if demands is None else [0.0])
+    latitudes, longitudes = buffer.coordinates()
+    points.extend(buffer.addresses, latitudes, longitudes, demands)
+    return points
+
+
+def _wants_json():
+    return request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+
+def _job_response(job_id):
+    """Ответ на постановку задачи: id задачи в JSON или переход на страницу ожидания"""
+    if _wants_json():
+        return jsonify({'job_id': job_id, 'status_url': url_for('main.job_status', job_id=job_id)}), 202
+    return redirect(url_for('main.job_status', job_id=job_id))
+
+
+@bp.route('/upload', methods=['POST'])
 def upload_file():
     """Обработка загрузки CSV файла"""
     if 'file' not in request.files:
         flash('Файл не выбран', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     file = request.files['file']
 
     if file.filename == '':
         flash('Файл не выбран', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     if not file.filename.endswith('.csv'):
         flash('Неверный формат файла. Требуется CSV.', 'error')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
 
     try:
-        waypoints_data = parse_csv_file(filepath)
-
-        if len(waypoints_data) < 2:
-            flash('Нужно минимум 2 точки для построения маршрута', 'error')
-            os.remove(filepath)
-            return redirect(url_for('index'))
-
-        ordered_waypoints = solve_tsp(waypoints_data)
-
-        route = Route(name=filename)
-        db.session.add(route)
-        db.session.flush()
-
-        for idx, wp in enumerate(ordered_waypoints):
-            waypoint = Waypoint(
-                route_id=route.id,
-                address=wp['address'],
-                latitude=wp['latitude'],
-                longitude=wp['longitude'],
-                order_index=idx
-            )
-            db.session.add(waypoint)
-
-        db.session.commit()
-
-        os.remove(filepath)
-
-        flash(f'Маршрут успешно рассчитан! Точек: {len(ordered_waypoints)}', 'success')
-        return redirect(url_for('result', route_id=route.id))
+        plan = _plan_options()
+    except ValueError as e:
+        flash(f'Ошибка параметров плана: {str(e)}', 'error')
+        return redirect(url_for('main.index'))
 
-    except Exception as e:
-        db.session.rollback()
+    # Потоковый разбор прямо из тела запроса, без сохранения файла
+    try:
+        buffer, errors = parse_csv_stream(
+            file.stream,
+            max_errors=current_app.config['CSV_MAX_ERRORS'],
+            allow_missing_coordinates=True,
+            demand_column=DEMAND_COLUMN if plan['vehicles'] > 1 else None
+        )
+    except CSVParseError as e:
         flash(f'Ошибка обработки файла: {str(e)}', 'error')
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
+    if len(buffer) < 2:
+        flash('Нужно минимум 2 точки для построения маршрута', 'error')
+        return redirect(url_for('main.index'))
 
-@app.route('/manual/submit', methods=['POST'])
+    if errors:
+        flash(
+            f'Пропущено строк с ошибками: {len(errors)}. ' + '; '.join(errors[:5]),
+            'warning'
+        )
+
+    if plan['vehicles'] > 1:
+        # План развоза несколькими машинами — тоже в фоновой задаче
+        job_id = job_queue.submit('plan', {
+            'name': filename,
+            **_with_depot(buffer, plan.pop('depot')).to_payload(),
+            **plan,
+            'improve': _improve_requested(),
+            'time_limit': current_app.config['TSP_TIME_LIMIT'],
+        })
+        return _job_response(job_id)
+
+    # Расчёт выполняется в фоновой задаче
+    job_id = job_queue.submit('upload', {
+        'name': filename,
+        **buffer.to_payload(),
+        'improve': _improve_requested(),
+        'cost': _cost_source(len(buffer)),
+        'time_limit': current_app.config['TSP_TIME_LIMIT'],
+    })
+    return _job_response(job_id)
+
+
+@bp.route('/manual/submit', methods=['POST'])
 def manual_submit():
     """Обработка ручного ввода точек"""
     try:
@@ -198,46 +377,268 @@ def manual_submit():
 
         if len(waypoints_data) < 2:
             flash('Нужно минимум 2 точки для построения маршрута', 'error')
-            return redirect(url_for('manual_input'))
-
-        # Решение задачи коммивояжёра
-        ordered_waypoints = solve_tsp(waypoints_data)
-
-        # Сохранение маршрута в БД
-        route = Route(name=f'Ручной маршрут {len(ordered_waypoints)} точек')
-        db.session.add(route)
-        db.session.flush()
-
-        for idx, wp in enumerate(ordered_waypoints):
-            waypoint = Waypoint(
-                route_id=route.id,
-                address=wp['address'],
-                latitude=wp['latitude'],
-                longitude=wp['longitude'],
-                order_index=idx
-            )
-            db.session.add(waypoint)
-
-        db.session.commit()
-
-        flash(f'Маршрут успешно рассчитан! Точек: {len(ordered_waypoints)}', 'success')
-        return redirect(url_for('result', route_id=route.id))
+            return redirect(url_for('main.manual_input'))
+
+        # Решение задачи коммивояжёра и сохранение — в фоновой задаче
+        job_id = job_queue.submit('manual', {
+            'name': f'Ручной маршрут {len(waypoints_data)} точек',
+            'waypoints': waypoints_data,
+            'improve': _improve_requested(),
+            'cost': _cost_source(len(waypoints_data)),
+            'time_limit': current_app.config['TSP_TIME_LIMIT'],
+        })
+        return _job_response(job_id)
 
     except ValueError as e:
         db.session.rollback()
         flash(f'Ошибка валидации: {str(e)}', 'error')
-        return redirect(url_for('manual_input'))
+        return redirect(url_for('main.manual_input'))
     except Exception as e:
         db.session.rollback()
         flash(f'Ошибка обработки: {str(e)}', 'error')
-        return redirect(url_for('manual_input'))
+        return redirect(url_for('main.manual_input'))
+
+
+def _parse_problem(problem, defaults):
+    """
+    Проверка задачи пакетного API
+
+    Возвращает:
+        задачу для рабочего процесса: массивы координат и параметры решения
+    """
+    if not isinstance(problem, dict):
+        raise ValueError('Задача должна быть объектом')
 
+    waypoints = problem.get('waypoints')
+    if not isinstance(waypoints, list) or len(waypoints) < 2:
+        raise ValueError('Нужно минимум 2 точки в поле waypoints')
 
-@app.route('/result/<int:route_id>/yandex')
+    try:
+        latitudes = np.array([float(wp['latitude']) for wp in waypoints])
+        longitudes = np.array([float(wp['longitude']) for wp in waypoints])
+    except (TypeError, KeyError, ValueError):
+        raise ValueError('У каждой точки должны быть числовые latitude и longitude')
+
+    # Сравнения с NaN ложны, поэтому NaN тоже не проходит проверку
+    if not np.all(np.abs(latitudes) <= 90):
+        raise ValueError(f'Неверная широта в точке {int(np.argmin(np.abs(latitudes) <= 90)) + 1}')
+    if not np.all(np.abs(longitudes) <= 180):
+        raise ValueError(f'Неверная долгота в точке {int(np.argmin(np.abs(longitudes) <= 180)) + 1}')
+
+    try:
+        time_limit = float(problem.get('time_limit', defaults['time_limit']))
+    except (TypeError, ValueError):
+        raise ValueError('time_limit должен быть числом')
+    if time_limit <= 0:
+        raise ValueError('time_limit должен быть положительным')
+
+    from algorithms.tsp_solver import STRATEGIES
+
+    strategy = problem.get('strategy', defaults['strategy'])
+    if strategy not in STRATEGIES:
+        raise ValueError(f'strategy должен быть одним из: {", ".join(STRATEGIES)}')
+
+    # Только логические значения JSON: строка "false" не должна включать улучшение
+    improve = problem.get('improve', defaults['improve'])
+    if not isinstance(improve, bool):
+        raise ValueError('improve должен быть true или false')
+
+    return {
+        'latitudes': latitudes,
+        'longitudes': longitudes,
+        'improve': improve,
+        'time_limit': min(time_limit, current_app.config['TSP_TIME_LIMIT']),
+        'strategy': strategy,
+    }
+
+
+@bp.route('/api/routes/solve', methods=['POST'])
+def api_solve_routes():
+    """
+    Пакетное решение независимых задач маршрутизации (JSON API)
+
+    Тело запроса — массив задач или объект {"problems": [...], "improve": bool,
+    "time_limit": float, "strategy": str, "persist": bool}; задача — {"name": str,
+    "waypoints": [{"address": str, "latitude": float, "longitude": float}, ...],
+    "improve", "time_limit", "strategy"}. Задачи решаются параллельно в пуле
+    процессов. В ответе по каждой задаче в исходном порядке — порядок обхода
+    (индексы точек), длины отрезков и общая длина в км, применённая стратегия
+    и признак доказанной оптимальности либо ошибка; с persist маршруты
+    сохраняются.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = {'problems': data}
+    if not isinstance(data, dict) or not isinstance(data.get('problems'), list):
+        return jsonify({'error': 'Ожидается JSON-массив задач или объект с полем problems'}), 400
+
+    problems = data['problems']
+    if len(problems) > current_app.config['API_MAX_PROBLEMS']:
+        return jsonify({'error': f'Не больше {current_app.config["API_MAX_PROBLEMS"]} задач в одном запросе'}), 400
+    persist = data.get('persist', False)
+    if not isinstance(persist, bool):
+        return jsonify({'error': 'persist должен быть true или false'}), 400
+
+    defaults = {
+        'improve': data.get('improve', False),
+        'time_limit': data.get('time_limit', current_app.config['TSP_TIME_LIMIT']),
+        'strategy': data.get('strategy', 'auto'),
+    }
+
+    # Ошибки отдельных задач не мешают решить остальные
+    results = [None] * len(problems)
+    tasks, indices = [], []
+    for index, problem in enumerate(problems):
+        try:
+            tasks.append(_parse_problem(problem, defaults))
+            indices.append(index)
+        except ValueError as e:
+            results[index] = {'index': index, 'error': str(e)}
+
+    started = time.perf_counter()
+    try:
+        solutions = job_queue.map(solve_problem, tasks) if tasks else []
+    except BrokenProcessPool:
+        return jsonify({'error': 'Пул процессов недоступен, повторите запрос'}), 503
+
+    for index, solution in zip(indices, solutions):
+        metrics.merge(solution.pop('metrics'))
+        results[index] = {'index': index, **solution}
+
+    if persist:
+        for index, task in zip(indices, tasks):
+            buffer = WaypointBuffer()
+            buffer.extend(
+                [str(wp.get('address') or f'Точка {i + 1}') for i, wp in enumerate(problems[index]['waypoints'])],
+                task['latitudes'],
+                task['longitudes']
+            )
+            ordered = buffer.take(results[index]['order'])
+            name = str(problems[index].get('name') or f'API маршрут {len(ordered)} точек')
+            route = Route.create_with_waypoints(name, ordered)
+            results[index]['route_id'] = route.id
+            results[index]['result_url'] = url_for('main.result', route_id=route.id)
+        db.session.commit()
+
+    return jsonify({
+        'results': results,
+        'solved': len(indices),
+        'failed': len(problems) - len(indices),
+        'elapsed': time.perf_counter() - started,
+    })
+
+
+@bp.route('/api/routes/<int:route_id>/stops', methods=['POST'])
+def api_insert_stop(route_id):
+    """
+    Вставка точки в сохранённый маршрут без полного пересчёта
+    (JSON {"address": str, "latitude": float, "longitude": float}, для
+    маршрута машины плана — ещё необязательный "demand": float)
+    """
+    route = Route.query.get_or_404(route_id)
+    data = request.get_json(silent=True)
+    try:
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Нужны числовые latitude и longitude'}), 400
+    try:
+        demand = float(data['demand']) if data.get('demand') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'demand должен быть числом'}), 400
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return jsonify({'error': f'Неверные координаты: {latitude}, {longitude}'}), 400
+    address = str(data.get('address') or '').strip() or f'{latitude:.6f}, {longitude:.6f}'
+
+    try:
+        result = route.insert_stop(address, latitude, longitude, demand)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify({**result, 'result_url': url_for('main.result', route_id=route.id)}), 201
+
+
+@bp.route('/api/routes/<int:route_id>/stops/<int:waypoint_id>', methods=['DELETE'])
+def api_remove_stop(route_id, waypoint_id):
+    """Удаление точки из сохранённого маршрута без полного пересчёта"""
+    route = Route.query.get_or_404(route_id)
+    if Waypoint.query.filter_by(id=waypoint_id, route_id=route_id).first() is None:
+        return jsonify({'error': f'Точка {waypoint_id} не найдена в маршруте'}), 404
+
+    try:
+        result = route.remove_stop(waypoint_id)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify({**result, 'result_url': url_for('main.result', route_id=route.id)})
+
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Состояние фоновой задачи: JSON для опроса или страница ожидания"""
+    job = Job.query.get_or_404(job_id)
+
+    if _wants_json():
+        data = job.to_dict()
+        if job.status == 'done':
+            data['result_url'] = _job_result_url(job)
+        return jsonify(data)
+
+    if job.status == 'done':
+        flash(job.message, 'success')
+        return redirect(_job_result_url(job))
+
+    if job.status == 'failed':
+        flash(f'Ошибка обработки: {job.message}', 'error')
+        return redirect(url_for('main.manual_input' if job.kind == 'manual' else 'main.index'))
+
+    return render_template('job.html', job=job)
+
+
+def _job_result_url(job):
+    """Страница результата выполненной задачи: план развоза или маршрут"""
+    if job.plan_id is not None:
+        return url_for('main.plan_result', plan_id=job.plan_id)
+    return url_for('main.result', route_id=job.route_id)
+
+
+@bp.route('/plans/<int:plan_id>')
+def plan_result(plan_id):
+    """Страница плана развоза: машины плана и общая карта их маршрутов"""
+    plan = Plan.query.get_or_404(plan_id)
+    tours = [Waypoint.for_route(route.id) for route in plan.routes]
+
+    try:
+        map_url = _plan_map_url(plan, tours)
+    except Exception as e:
+        flash(f'Ошибка генерации карты: {str(e)}', 'warning')
+        map_url = None
+
+    return render_template(
+        'plan.html',
+        plan=plan,
+        vehicles=list(zip(plan.routes, tours)),
+        map_url=map_url
+    )
+
+
+def _plan_map_url(plan, tours):
+    """Адрес общей карты плана из кэша: ключ — точки всех машин по порядку"""
+    from utils.map_generator import create_plan_map, MAP_TEMPLATE_VERSION
+
+    geometry_source = 'plan:' + ','.join(str(len(tour)) for tour in tours)
+    key = map_cache_key(chain.from_iterable(tours), plan.name, geometry_source, MAP_TEMPLATE_VERSION)
+    map_cache.get_or_create(key, lambda: create_plan_map(tours, plan.name))
+    return url_for('main.cached_map', key=key)
+
+
+@bp.route('/result/<int:route_id>/yandex')
 def result_yandex(route_id):
     """Маршрут по дорогам через JavaScript API Яндекс.Карт"""
     route = Route.query.get_or_404(route_id)
-    waypoints = Waypoint.query.filter_by(route_id=route_id).order_by(Waypoint.order_index).all()
+    waypoints = Waypoint.for_route(route_id)
 
     # Получаем JavaScript API ключ из .env
     yandex_api_key_js = os.getenv('YANDEX_API_KEY_JS')
@@ -250,16 +651,18 @@ def result_yandex(route_id):
     )
 
 
-@app.route('/result/<int:route_id>')
+@bp.route('/result/<int:route_id>')
 def result(route_id):
     """Страница с результатом маршрута"""
     route = Route.query.get_or_404(route_id)
-    waypoints = Waypoint.query.filter_by(route_id=route_id).order_by(Waypoint.order_index).all()
+    waypoints = Waypoint.for_route(route_id)
 
     use_yandex_roads = request.args.get('roads', '0') == '1'
     yandex_route_data = None
 
     if use_yandex_roads:
+        from utils.yandex_router import get_route_by_roads
+
         logger.info(f"Запрос маршрута по дорогам для route_id={route_id}")
         waypoints_data = [{
             'latitude': wp.latitude,
@@ -271,25 +674,15 @@ def result(route_id):
 
         if yandex_route_data:
             logger.info(f"Маршрут по дорогам получен: {yandex_route_data['distance_km']} км")
-            route.total_distance = yandex_route_data['distance_km']
-            db.session.commit()
         else:
             logger.warning("Не удалось получить маршрут по дорогам от Яндекс")
 
-    total_distance = route.calculate_total_distance() if not yandex_route_data else yandex_route_data['distance_km']
+    # Длина по прямой сохранена при расчёте маршрута; длина по дорогам
+    # только показывается и в базу не пишется
+    total_distance = route.total_distance if not yandex_route_data else yandex_route_data['distance_km']
 
     try:
-        map_obj = create_route_map(
-            waypoints,
-            route.name,
-            yandex_geometry=yandex_route_data['geometry'] if yandex_route_data else None
-        )
-
-        map_filename = f'route_{route_id}.html'
-        map_path = os.path.join(app.config['MAP_FOLDER'], map_filename)
-        map_obj.save(map_path)
-
-        map_url = url_for('static', filename=f'maps/{map_filename}')
+        map_url = _route_map_url(route, waypoints, yandex_route_data)
     except Exception as e:
         flash(f'Ошибка генерации карты: {str(e)}', 'warning')
         map_url = None
@@ -306,4 +699,8 @@ def result(route_id):
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    with app.app_context():
+        init_db()
     app.run(debug=True, host='127.0.0.1', port=8000)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import csv
+
+import numpy as np
+
+from algorithms.distance import EARTH_RADIUS_KM
+
+# Центр синтетических наборов (Москва) и полуразмеры области, градусы
+CENTER_LAT = 55.7558
+CENTER_LON = 37.6173
+SPAN_LAT = 0.25
+SPAN_LON = 0.4
+
+# Масштаб плотности «города»: медианное удаление точки от центра, км
+CITY_SCALE_KM = 5.0
+
+# Размер одного кластера в наборе clustered (точек) и его разброс, км
+CLUSTER_POINTS = 500
+CLUSTER_SPREAD_KM = 1.5
+
+
+def uniform(n, rng):
+    """Точки, равномерно распределённые по прямоугольной области"""
+    latitudes = CENTER_LAT + rng.uniform(-SPAN_LAT, SPAN_LAT, n)
+    longitudes = CENTER_LON + rng.uniform(-SPAN_LON, SPAN_LON, n)
+    return latitudes, longitudes
+
+
+def clustered(n, rng):
+    """Гауссовы кластеры (районы доставки) по CLUSTER_POINTS точек в среднем"""
+    count = max(3, n // CLUSTER_POINTS)
+    center_lats, center_lons = uniform(count, rng)
+    cluster = rng.integers(0, count, n)
+    lat_offsets, lon_offsets = _km_to_degrees(
+        rng.normal(0, CLUSTER_SPREAD_KM, n), rng.normal(0, CLUSTER_SPREAD_KM, n)
+    )
+    return center_lats[cluster] + lat_offsets, center_lons[cluster] + lon_offsets
+
+
+def city(n, rng):
+    """
+    «Город»: плотность убывает от центра, часть точек лежит на радиальных
+    проспектах и кольцевых дорогах
+    """
+    radius = rng.exponential(CITY_SCALE_KM / np.log(2), n)
+    angle = rng.uniform(0, 2 * np.pi, n)
+
+    # Треть точек — на одном из 12 проспектов, ещё треть — на одном из колец
+    kind = rng.integers(0, 3, n)
+    avenues = kind == 1
+    angle[avenues] = rng.integers(0, 12, avenues.sum()) * (np.pi / 6)
+    rings = kind == 2
+    radius[rings] = rng.integers(1, 5, rings.sum()) * CITY_SCALE_KM * 0.8
+
+    lat_offsets, lon_offsets = _km_to_degrees(radius * np.sin(angle), radius * np.cos(angle))
+    return CENTER_LAT + lat_offsets, CENTER_LON + lon_offsets
+
+
+GENERATORS = {
+    'uniform': uniform,
+    'clustered': clustered,
+    'city': city,
+}
+
+
+def generate(kind, n, seed=0):
+    """
+    Синтетический набор точек
+
+    Аргументы:
+        kind: вид распределения (ключ GENERATORS)
+        n: число точек
+        seed: зерно генератора — один и тот же набор при каждом запуске
+
+    Возвращает:
+        список словарей {'address': str, 'latitude': float, 'longitude': float}
+    """
+    rng = np.random.default_rng(seed)
+    latitudes, longitudes = GENERATORS[kind](n, rng)
+    latitudes = np.round(latitudes, 6).tolist()
+    longitudes = np.round(longitudes, 6).tolist()
+    return [
+        {'address': f'{kind} {i}, д. {i % 97 + 1}', 'latitude': lat, 'longitude': lon}
+        for i, (lat, lon) in enumerate(zip(latitudes, longitudes))
+    ]
+
+
+def write_csv(waypoints, path):
+    """Запись точек в CSV формата загрузки (address,latitude,longitude)"""
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['address', 'latitude', 'longitude'])
+        writer.writerows((wp['address'], wp['latitude'], wp['longitude']) for wp in waypoints)
+
+
+def _km_to_degrees(north_km, east_km):
+    lat = np.degrees(north_km / EARTH_RADIUS_KM)
+    lon = np.degrees(east_km / (EARTH_RADIUS_KM * np.cos(np.radians(CENTER_LAT))))
+    return lat, lon
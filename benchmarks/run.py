@@ -0,0 +1,301 @@
+"""
+Бенчмарки этапов обработки маршрута: разбор CSV, решение TSP, сохранение
+в БД, генерация карты и маршрут по дорогам (через локальную заглушку
+Directions API, без сети)
+
+Запуск из корня проекта:
+    python -m benchmarks.run --sizes 10,1000,10000 --output bench.json
+    python -m benchmarks.run --output new.json --compare bench.json
+
+Результаты пишутся в JSON; с --compare время и длины маршрутов сравниваются
+с прошлым запуском, регрессии выводятся, а код возврата равен 1.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.datasets import GENERATORS, generate, write_csv
+from benchmarks.stub_router import StubDirectionsServer
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+# Регрессия по времени: медиана выросла больше чем на долю threshold
+# и больше чем на MIN_DELTA секунд (короткие замеры слишком шумные)
+DEFAULT_THRESHOLD = 0.25
+MIN_DELTA = 0.005
+
+# Допустимое ухудшение длины маршрута (доля)
+LENGTH_TOLERANCE = 0.001
+
+RESULTS_FORMAT = 1
+
+
+def measure(func, repeat, setup=None):
+    """
+    Замер времени func() в repeat запусках; setup() выполняется перед
+    каждым запуском и в замер не входит
+
+    Возвращает:
+        (список времён в секундах, результат последнего запуска)
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return times, result
+
+
+def record(dataset, size, stage, times, **metrics):
+    return {
+        'dataset': dataset,
+        'size': size,
+        'stage': stage,
+        'runs': len(times),
+        'min': min(times),
+        'median': statistics.median(times),
+        'max': max(times),
+        'metrics': metrics,
+    }
+
+
+def run_dataset(kind, size, args, env):
+    """Замеры всех этапов на одном синтетическом наборе"""
+    from algorithms.tsp_solver import solve_tsp_detailed
+    from models import db, Route, Waypoint
+    from utils.csv_parser import parse_csv_file, parse_csv_stream
+    from utils.map_generator import create_route_map
+    from utils.yandex_router import get_route_by_roads, route_cache
+
+    repeat = args.repeat
+    results = []
+    waypoints = generate(kind, size, seed=args.seed)
+    csv_path = os.path.join(env['tmpdir'], f'{kind}_{size}.csv')
+    write_csv(waypoints, csv_path)
+
+    times, parsed = measure(lambda: parse_csv_file(csv_path), repeat)
+    results.append(record(kind, size, 'parse', times, rows=len(parsed)))
+
+    def parse_stream():
+        with open(csv_path, 'rb') as file:
+            return parse_csv_stream(file)
+
+    times, (buffer, _) = measure(parse_stream, repeat)
+    results.append(record(kind, size, 'parse_stream', times, rows=len(buffer)))
+
+    times, solution = measure(lambda: solve_tsp_detailed(waypoints), repeat)
+    results.append(record(kind, size, 'solve', times, length_km=round(solution.length, 3)))
+
+    times, solution = measure(
+        lambda: solve_tsp_detailed(waypoints, improve=True, time_limit=args.time_limit), repeat
+    )
+    results.append(record(
+        kind, size, 'solve_improved', times,
+        length_km=round(solution.length, 3),
+        improvement_percent=round(solution.improvement_percent, 2),
+        timed_out=solution.timed_out
+    ))
+    ordered = solution.waypoints
+
+    with env['app'].app_context():
+        def persist():
+            route = Route.create_with_waypoints(f'{kind} {size}', ordered)
+            db.session.commit()
+            return route.id
+
+        times, route_id = measure(persist, repeat)
+        results.append(record(kind, size, 'persist', times))
+
+        times, loaded = measure(lambda: Waypoint.for_route(route_id), repeat, setup=db.session.expire_all)
+        results.append(record(kind, size, 'load', times, rows=len(loaded)))
+
+        # Карта строится по точкам из БД, как на странице результата
+        def render():
+            return create_route_map(loaded, f'{kind} {size}').get_root().render()
+
+        times, html = measure(render, repeat)
+        results.append(record(kind, size, 'render', times, bytes=len(html.encode('utf-8'))))
+
+    if size <= args.roads_max_points:
+        stub = env['stub']
+        requests_before = stub.requests
+        # Каждый запуск — с пустым кэшем, иначе замеряется только чтение кэша
+        times, route = measure(lambda: get_route_by_roads(ordered), repeat, setup=route_cache.clear)
+        results.append(record(
+            kind, size, 'roads', times,
+            distance_km=route['distance_km'] if route else None,
+            requests=(stub.requests - requests_before) // repeat
+        ))
+
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Сравнение с результатами прошлого запуска
+
+    Возвращает:
+        список строк с описанием регрессий
+    """
+    previous = {(r['dataset'], r['size'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        key = (result['dataset'], result['size'], result['stage'])
+        old = previous.get(key)
+        if old is None:
+            continue
+        name = f"{key[0]}/{key[1]}/{key[2]}"
+
+        change = result['median'] - old['median']
+        if change > MIN_DELTA and result['median'] > old['median'] * (1 + threshold):
+            regressions.append(
+                f"{name}: время {old['median']:.4f} → {result['median']:.4f} с "
+                f"(+{change / old['median'] * 100:.0f}%)"
+            )
+
+        new_length = result['metrics'].get('length_km')
+        old_length = old['metrics'].get('length_km')
+        if new_length is not None and old_length and new_length > old_length * (1 + LENGTH_TOLERANCE):
+            regressions.append(
+                f"{name}: длина маршрута {old_length:.3f} → {new_length:.3f} км "
+                f"(+{(new_length - old_length) / old_length * 100:.2f}%)"
+            )
+    return regressions
+
+
+def print_table(results, baseline=None):
+    previous = {}
+    if baseline is not None:
+        previous = {(r['dataset'], r['size'], r['stage']): r for r in baseline['results']}
+
+    print(f"{'набор':<10} {'точек':>7} {'этап':<15} {'медиана, с':>11} {'было, с':>9} {'изм.':>7}")
+    for result in results:
+        old = previous.get((result['dataset'], result['size'], result['stage']))
+        line = f"{result['dataset']:<10} {result['size']:>7} {result['stage']:<15} {result['median']:>11.4f}"
+        if old is not None:
+            change = (result['median'] - old['median']) / old['median'] * 100 if old['median'] else 0.0
+            line += f" {old['median']:>9.4f} {change:>+6.0f}%"
+        print(line)
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'format': RESULTS_FORMAT,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'datasets': args.datasets,
+            'sizes': args.sizes,
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'time_limit': args.time_limit,
+            'stub_latency': args.stub_latency,
+        },
+    }
+
+
+def _list(convert):
+    return lambda value: [convert(item) for item in value.split(',') if item]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарки этапов обработки маршрута')
+    parser.add_argument('--datasets', type=_list(str), default=list(GENERATORS),
+                        help=f"наборы через запятую: {', '.join(GENERATORS)}")
+    parser.add_argument('--sizes', type=_list(int), default=list(DEFAULT_SIZES),
+                        help='числа точек через запятую (до 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='запусков каждого замера')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора наборов')
+    parser.add_argument('--time-limit', type=float, default=5.0,
+                        help='ограничение времени улучшения маршрута, с')
+    parser.add_argument('--roads-max-points', type=int, default=2000,
+                        help='наибольшее число точек для замера маршрута по дорогам')
+    parser.add_argument('--stub-latency', type=float, default=0.05,
+                        help='задержка ответа заглушки Directions API, с')
+    parser.add_argument('--output', default='benchmark_results.json', help='файл результатов (JSON)')
+    parser.add_argument('--compare', help='результаты прошлого запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='допустимый рост медианы времени (доля)')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.datasets) - set(GENERATORS)
+    if unknown:
+        parser.error(f"неизвестные наборы: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    with tempfile.TemporaryDirectory(prefix='route_bench_') as tmpdir, \
+            StubDirectionsServer(latency=args.stub_latency) as stub:
+        # Настройки читаются при импорте модулей, поэтому задаются до него
+        os.environ['YANDEX_DIRECTIONS_URL'] = stub.url
+        os.environ['ROUTER_CACHE_PATH'] = os.path.join(tmpdir, 'router_cache.db')
+
+        from flask import Flask
+        from models import db, init_db
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmpdir, 'routes.db')}"
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+        with app.app_context():
+            init_db()
+
+        env = {'tmpdir': tmpdir, 'app': app, 'stub': stub}
+        results = []
+        for kind in args.datasets:
+            for size in args.sizes:
+                started = time.perf_counter()
+                results.extend(run_dataset(kind, size, args, env))
+                print(f"{kind} {size}: {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({'meta': metadata(args), 'results': results}, file, ensure_ascii=False, indent=2)
+
+    print_table(results, baseline)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nРегрессии ({len(regressions)}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Бенчмарк запуска приложения: время импорта app.py, создания приложения
+и первого запроса в свежем интерпретаторе
+
+Каждый замер — отдельный процесс Python, поэтому импорт «холодный» (без
+уже загруженных модулей). Измерить можно и другую копию проекта, например
+прошлую версию, чтобы сравнить:
+    git worktree add /tmp/route_planner_old HEAD~1
+    python -m benchmarks.startup --project /tmp/route_planner_old --output startup_old.json
+    python -m benchmarks.startup --output startup.json --compare startup_old.json
+
+Поддерживаются обе схемы app.py: с фабрикой create_app и с приложением,
+создаваемым при импорте.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.run import DEFAULT_THRESHOLD, compare, print_table, record
+
+RESULTS_FORMAT = 1
+
+# Этапы замера в порядке вывода
+STAGES = ('process', 'import', 'create_app', 'init_db', 'first_request', 'ready')
+
+# Код замера в дочернем процессе: печатает JSON с длительностями этапов
+_CHILD = """
+import importlib, json, sys, time
+started = time.perf_counter()
+module = importlib.import_module('app')
+timings = {'import': time.perf_counter() - started}
+factory = getattr(module, 'create_app', None)
+if factory is not None:
+    created = time.perf_counter()
+    app = factory({'SQLALCHEMY_DATABASE_URI': sys.argv[1]})
+    timings['create_app'] = time.perf_counter() - created
+    from models import init_db
+    schema = time.perf_counter()
+    with app.app_context():
+        init_db()
+    timings['init_db'] = time.perf_counter() - schema
+else:
+    app = module.app
+requested = time.perf_counter()
+status = app.test_client().get('/').status_code
+timings['first_request'] = time.perf_counter() - requested
+# Готовность к работе: от начала импорта до первого ответа без разового
+# создания схемы БД (с фабрикой это отдельный шаг развёртывания)
+timings['ready'] = time.perf_counter() - started - timings.get('init_db', 0.0)
+print(json.dumps({'status': status, 'timings': timings}))
+"""
+
+
+def run_once(project, database):
+    """
+    Один запуск приложения в новом процессе
+
+    Возвращает:
+        словарь {этап: секунды}; process — весь процесс, от запуска
+        интерпретатора до выхода
+    """
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-c', _CHILD, f'sqlite:///{database}'],
+        cwd=project, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f'Запуск приложения завершился с ошибкой:\n{completed.stderr}')
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if result['status'] != 200:
+        raise RuntimeError(f"Первый запрос вернул статус {result['status']}")
+    return {'process': elapsed, **result['timings']}
+
+
+def measure_startup(project, repeat):
+    """
+    Замеры запуска приложения: repeat процессов после одного прогревочного
+    (он заполняет файловый кэш ОС и создаёт схему БД)
+
+    Возвращает:
+        список записей в формате benchmarks.run
+    """
+    samples = {}
+    with tempfile.TemporaryDirectory(prefix='route_startup_') as tmpdir:
+        database = os.path.join(tmpdir, 'routes.db')
+        run_once(project, database)
+        for _ in range(repeat):
+            for stage, seconds in run_once(project, database).items():
+                samples.setdefault(stage, []).append(seconds)
+    return [record('startup', 0, stage, samples[stage]) for stage in STAGES if stage in samples]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк запуска приложения')
+    parser.add_argument('--project', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='каталог проекта с app.py (по умолчанию — этот)')
+    parser.add_argument('--repeat', type=int, default=10, help='число запусков')
+    parser.add_argument('--output', default='startup_results.json', help='файл результатов (JSON)')
+    parser.add_argument('--compare', help='результаты прошлого запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='допустимый рост медианы времени (доля)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    results = measure_startup(args.project, args.repeat)
+    meta = {
+        'format': RESULTS_FORMAT,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'project': os.path.abspath(args.project),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'repeat': args.repeat},
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({'meta': meta, 'results': results}, file, ensure_ascii=False, indent=2)
+
+    print_table(results, baseline)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nРегрессии ({len(regressions)}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
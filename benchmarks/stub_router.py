@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from algorithms.distance import haversine_legs
+
+# Промежуточных вершин геометрии на отрезок между соседними точками
+GEOMETRY_POINTS_PER_LEG = 8
+
+# Отношение «по дорогам / по прямой» и средняя скорость заглушки
+ROAD_FACTOR = 1.3
+SPEED_KMH = 30.0
+
+
+class _DirectionsHandler(BaseHTTPRequestHandler):
+    """Ответ в формате Directions API: геометрия — ломаная через все точки"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+
+        points = body['waypoints']
+        latitudes = np.array([p['lat'] for p in points])
+        longitudes = np.array([p['lon'] for p in points])
+        legs_km = haversine_legs(latitudes, longitudes) * ROAD_FACTOR
+
+        # Геометрия: GEOMETRY_POINTS_PER_LEG вершин на каждом отрезке и последняя точка
+        steps = np.arange(GEOMETRY_POINTS_PER_LEG) / GEOMETRY_POINTS_PER_LEG
+        geometry_lats = (latitudes[:-1, None] + np.diff(latitudes)[:, None] * steps).ravel()
+        geometry_lons = (longitudes[:-1, None] + np.diff(longitudes)[:, None] * steps).ravel()
+        geometry = [
+            {'lat': lat, 'lon': lon}
+            for lat, lon in zip(np.append(geometry_lats, latitudes[-1]).tolist(),
+                                np.append(geometry_lons, longitudes[-1]).tolist())
+        ]
+
+        distance = float(legs_km.sum()) * 1000
+        data = json.dumps({
+            'routes': [{
+                'summary': {'distance': distance, 'duration': distance / 1000 / SPEED_KMH * 3600},
+                'geometry': geometry,
+                'legs': [{'distance': float(km) * 1000} for km in legs_km],
+            }]
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubDirectionsServer:
+    """
+    Локальная заглушка Directions API для замеров get_route_by_roads без сети
+
+    Аргументы:
+        latency: задержка ответа в секундах (имитация сети и сервиса)
+    """
+
+    def __init__(self, latency=0.05):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _DirectionsHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency
+        self._server.requests = 0
+        self._server.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/v2/route'
+
+    @property
+    def requests(self):
+        return self._server.requests
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,10 +1,96 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
 from datetime import datetime
-import math
+from itertools import repeat
+import sqlite3
+
+import numpy as np
+
+from algorithms.distance import haversine, haversine_legs
+from utils.metrics import timed
+from utils.waypoint_buffer import WaypointBuffer
 
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    """
+    Настройка SQLite для параллельного чтения: журнал WAL позволяет читать,
+    пока идёт запись, а synchronous=NORMAL в режиме WAL безопасен и
+    избавляет от fsync на каждой транзакции
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=30000')
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def init_db():
+    """
+    Создание схемы БД (вызывается в контексте приложения).
+    В уже существующие таблицы добавляются недостающие колонки и индексы,
+    для старых маршрутов один раз рассчитываются сохранённые расстояния.
+    """
+    db.create_all()
+    _add_missing_columns()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    _backfill_distances()
+
+
+def _add_missing_columns():
+    """Добавление в существующие таблицы колонок, появившихся в моделях"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                )
+
+
+def _backfill_distances():
+    """Расчёт расстояний для маршрутов, сохранённых до появления колонок"""
+    stale = {
+        route_id
+        for (route_id,) in db.session.query(Waypoint.route_id)
+        .filter(Waypoint.cumulative_distance.is_(None))
+        .distinct()
+    }
+    stale.update(route_id for (route_id,) in db.session.query(Route.id).filter(Route.total_distance.is_(None)))
+    for route_id in sorted(stale):
+        db.session.get(Route, route_id).calculate_total_distance()
+    if stale:
+        db.session.commit()
+
+
+def route_distances(latitudes, longitudes):
+    """
+    Расстояния вдоль маршрута
+
+    Возвращает:
+        (длины отрезков от предыдущей точки, нарастающий итог, общая длина);
+        для первой точки отрезок и итог равны 0
+    """
+    legs = np.concatenate(([0.0], haversine_legs(latitudes, longitudes)))
+    cumulative = np.cumsum(legs)
+    total = float(cumulative[-1]) if len(cumulative) else 0.0
+    return legs, cumulative, total
+
+
 class Route(db.Model):
     """Маршрут"""
     __tablename__ = 'routes'
@@ -13,26 +99,31 @@ class Route(db.Model):
     name = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     total_distance = db.Column(db.Float)  # Общее расстояние в км
+    plan_id = db.Column(db.Integer, db.ForeignKey('plans.id'), index=True)  # План, если маршрут — машина плана
+    vehicle = db.Column(db.Integer)  # Номер машины в плане (с 1)
+    load = db.Column(db.Float)  # Загрузка машины (сумма спроса точек)
+    # Отпечаток набора точек из кэша решений; сбрасывается при изменении точек
+    fingerprint = db.Column(db.String(64), index=True)
 
     # Связь с точками маршрута
     waypoints = db.relationship('Waypoint', backref='route', lazy=True, cascade='all, delete-orphan')
 
     def calculate_total_distance(self):
-        """Расчет общей дистанции маршрута в километрах"""
-        waypoints = Waypoint.query.filter_by(route_id=self.id).order_by(Waypoint.order_index).all()
-
-        if len(waypoints) < 2:
-            return 0.0
+        """
+        Пересчёт сохранённых расстояний маршрута в километрах. Вызывается только
+        при изменении точек маршрута; транзакцию фиксирует вызывающий код.
+        """
+        waypoints = Waypoint.for_route(self.id)
 
-        total = 0.0
-        for i in range(len(waypoints) - 1):
-            wp1 = waypoints[i]
-            wp2 = waypoints[i + 1]
-            distance = self._haversine_distance(wp1.latitude, wp1.longitude, wp2.latitude, wp2.longitude)
-            total += distance
+        legs, cumulative, total = route_distances(
+            [wp.latitude for wp in waypoints],
+            [wp.longitude for wp in waypoints]
+        )
+        for wp, leg, running in zip(waypoints, legs.tolist(), cumulative.tolist()):
+            wp.leg_distance = leg
+            wp.cumulative_distance = running
 
         self.total_distance = round(total, 2)
-        db.session.commit()
         return self.total_distance
 
     @staticmethod
@@ -41,25 +132,255 @@ class Route(db.Model):
         Расчет расстояния между двумя точками по формуле Haversine
         Возвращает расстояние в километрах
         """
-        # Радиус Земли в км
-        R = 6371.0
+        return float(haversine(lat1, lon1, lat2, lon2))
+
+    @classmethod
+    def create_with_waypoints(cls, name, waypoints):
+        """
+        Сохранение маршрута со всеми точками одной пачкой (executemany драйвера).
+        Расстояния по отрезкам и общая длина считаются здесь же, один раз.
+
+        Аргументы:
+            name: название маршрута
+            waypoints: упорядоченные точки — WaypointBuffer или список
+                словарей {'address', 'latitude', 'longitude'}
+
+        Возвращает:
+            созданный Route (транзакцию фиксирует вызывающий код)
+        """
+        if not isinstance(waypoints, WaypointBuffer):
+            waypoints = WaypointBuffer.from_dicts(waypoints)
+        latitudes, longitudes = waypoints.coordinates()
+        legs, cumulative, total = route_distances(latitudes, longitudes)
+
+        route = cls(name=name, total_distance=round(total, 2))
+        db.session.add(route)
+        db.session.flush()
+
+        # Строки собираются прямо из колонок буфера
+        rows = list(zip(
+            repeat(route.id), waypoints.addresses, waypoints.latitudes, waypoints.longitudes,
+            range(len(waypoints)), legs.tolist(), cumulative.tolist(),
+            waypoints.demands if waypoints.demands is not None else repeat(None)
+        ))
+        if rows:
+            # executemany драйвера напрямую: без построения ORM-объектов
+            # и словарей параметров на каждую строку
+            db.session.connection().exec_driver_sql(_WAYPOINT_INSERT, rows)
+        return route
+
+    @classmethod
+    def find_saved(cls, name, fingerprint, waypoints):
+        """
+        Уже сохранённый маршрут с тем же названием, набором точек и порядком
+        обхода — повторная загрузка того же файла не создаёт копию маршрута
 
-        # Преобразование градусов в радианы
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
+        Аргументы:
+            name: название маршрута
+            fingerprint: отпечаток набора точек (utils.solution_cache)
+            waypoints: упорядоченные точки — WaypointBuffer
+
+        Возвращает:
+            Route или None
+        """
+        candidates = (
+            cls.query.filter_by(name=name, fingerprint=fingerprint)
+            .order_by(cls.id.desc())
+            .limit(3)
+        )
+        latitudes, longitudes = waypoints.coordinates()
+        for route in candidates:
+            rows = db.session.connection().exec_driver_sql(
+                'SELECT address, latitude, longitude FROM waypoints WHERE route_id = ? ORDER BY order_index',
+                (route.id,)
+            ).fetchall()
+            if len(rows) != len(waypoints):
+                continue
+            addresses, saved_lats, saved_lons = zip(*rows)
+            if (list(addresses) == list(waypoints.addresses)
+                    and np.array_equal(saved_lats, latitudes) and np.array_equal(saved_lons, longitudes)):
+                return route
+        return None
+
+    @property
+    def fixed_end(self):
+        """Последняя точка закреплена: маршрут машины плана с возвратом на склад"""
+        return self.plan_id is not None and bool(self.plan.closed)
+
+    def insert_stop(self, address, latitude, longitude, demand=None):
+        """
+        Вставка точки в маршрут без полного пересчёта: место выбирается по
+        наименьшему приросту длины, затем участок вокруг него улучшается
+        локально. В базе меняются только точки участка, у точек после
+        участка номер и нарастающий итог сдвигаются одним UPDATE.
 
-        # Разница координат
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
+        В маршруте машины плана склад остаётся первой точкой (а с возвратом
+        на склад — и последней), загрузка машины не превышает вместимость.
+
+        Аргументы:
+            address, latitude, longitude: новая точка
+            demand: спрос точки (для маршрута машины плана)
+
+        Возвращает:
+            словарь с id и позицией новой точки и новой длиной маршрута
+            (транзакцию фиксирует вызывающий код)
+        """
+        from algorithms.insertion import cheapest_insertion
+
+        path = self._load_path()
+        if not len(path['ids']):
+            raise ValueError('Маршрут не содержит точек')
+        if demand is not None and demand < 0:
+            raise ValueError('Спрос точки не может быть отрицательным')
+        if self.plan_id is not None and self.plan.capacity is not None:
+            load = (self.load or 0.0) + (demand or 0.0)
+            if load > self.plan.capacity:
+                raise ValueError(
+                    f'Загрузка машины {load:g} превысит вместимость {self.plan.capacity:g}'
+                )
+
+        position, _ = cheapest_insertion(path['latitudes'], path['longitudes'], latitude, longitude,
+                                         fixed_end=self.fixed_end)
+        values = {'ids': -1, 'latitudes': latitude, 'longitudes': longitude,
+                  'legs': np.nan, 'cumulative': np.nan, 'positions': -1}
+        for column, value in values.items():
+            path[column] = np.insert(path[column], position, value)
+
+        new_id = self._store_local_change(path, center=position, offset=1, address=address, demand=demand)
+        self.fingerprint = None
+        if self.plan_id is not None:
+            self.load = (self.load or 0.0) + (demand or 0.0)
+            self.plan.update_totals()
+        return {
+            'waypoint_id': new_id,
+            'position': int(np.flatnonzero(path['ids'] == new_id)[0]),
+            'total_distance': self.total_distance,
+        }
+
+    def remove_stop(self, waypoint_id):
+        """
+        Удаление точки из маршрута с локальным улучшением участка вокруг неё
+        (как в insert_stop, остальной маршрут не пересчитывается)
+
+        Возвращает:
+            словарь с новой длиной маршрута (транзакцию фиксирует вызывающий код)
+        """
+        path = self._load_path()
+        matches = np.flatnonzero(path['ids'] == waypoint_id)
+        if not len(matches):
+            raise ValueError(f'Точка {waypoint_id} не принадлежит маршруту')
+        position = int(matches[0])
+        if self.plan_id is not None:
+            if position == 0 or (self.fixed_end and position == len(path['ids']) - 1):
+                raise ValueError('Склад нельзя удалить из маршрута машины')
+            if len(path['ids']) <= (3 if self.fixed_end else 2):
+                raise ValueError('В маршруте машины должна остаться минимум одна точка доставки')
+        elif len(path['ids']) <= 2:
+            raise ValueError('В маршруте должно остаться минимум 2 точки')
 
-        # Формула Haversine
-        a = math.sin(dlat / 2) ** 2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2) ** 2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        connection = db.session.connection()
+        demand = connection.exec_driver_sql(
+            'SELECT demand FROM waypoints WHERE id = ?', (waypoint_id,)
+        ).scalar()
+        for column in path:
+            path[column] = np.delete(path[column], position)
+        connection.exec_driver_sql('DELETE FROM waypoints WHERE id = ?', (waypoint_id,))
 
-        distance = R * c
-        return distance
+        self._store_local_change(path, center=max(position - 1, 0), offset=-1)
+        self.fingerprint = None
+        if self.plan_id is not None:
+            self.load = max((self.load or 0.0) - (demand or 0.0), 0.0)
+            self.plan.update_totals()
+        return {'total_distance': self.total_distance}
+
+    def _load_path(self):
+        """Точки маршрута колонками numpy в порядке обхода"""
+        # Курсор драйвера напрямую: строки приходят простыми кортежами,
+        # без объектов Row SQLAlchemy
+        cursor = db.session.connection().connection.cursor()
+        try:
+            rows = cursor.execute(_WAYPOINT_PATH, (self.id,)).fetchall()
+        finally:
+            cursor.close()
+        data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        return {
+            'ids': data[:, 0].astype(np.int64),
+            'latitudes': data[:, 1],
+            'longitudes': data[:, 2],
+            'legs': data[:, 3],
+            'cumulative': data[:, 4],
+            # Прежние позиции точек (order_index идут подряд с нуля)
+            'positions': np.arange(len(data)),
+        }
+
+    def _store_local_change(self, path, center, offset, address=None, demand=None):
+        """
+        Локальное улучшение участка вокруг center и запись изменений
+
+        Аргументы:
+            path: колонки маршрута после вставки или удаления точки; новая
+                точка отмечена id = -1, её отрезки — NaN
+            center: позиция изменения
+            offset: сдвиг номеров точек после участка (+1 или -1)
+            address: адрес новой точки
+            demand: спрос новой точки
+
+        Возвращает:
+            id новой точки (если она есть)
+        """
+        from algorithms.insertion import repair_window
+
+        latitudes, longitudes = path['latitudes'], path['longitudes']
+        n = len(latitudes)
+        start, local = repair_window(latitudes, longitudes, center, fixed_end=self.fixed_end)
+        stop = start + len(local) - 1
+        for column in path:
+            path[column][start:stop + 1] = path[column][start + local]
+
+        # Точки до участка не менялись, поэтому его первая точка сохраняет
+        # свой отрезок и нарастающий итог (если участок не в начале маршрута)
+        legs = np.concatenate(([0.0], haversine_legs(latitudes[start:stop + 1], longitudes[start:stop + 1])))
+        if start > 0:
+            legs[0] = path['legs'][start]
+        cumulative = np.cumsum(legs) + (path['cumulative'][start] - legs[0] if start > 0 else 0.0)
+
+        connection = db.session.connection()
+        if stop < n - 1:
+            # Последняя точка участка закреплена: дальше маршрут тот же,
+            # меняются только номера точек и нарастающий итог
+            shift = float(cumulative[-1] - path['cumulative'][stop])
+            connection.exec_driver_sql(
+                'UPDATE waypoints SET order_index = order_index + ?, '
+                'cumulative_distance = cumulative_distance + ? '
+                'WHERE route_id = ? AND order_index > ?',
+                (offset, shift, self.id, stop - offset)
+            )
+            total = float(path['cumulative'][-1]) + shift
+        else:
+            total = float(cumulative[-1])
+
+        new_id = None
+        updates = []
+        for i, leg, running in zip(range(start, stop + 1), legs.tolist(), cumulative.tolist()):
+            waypoint_id = int(path['ids'][i])
+            if waypoint_id == -1:
+                connection.exec_driver_sql(
+                    _WAYPOINT_INSERT,
+                    (self.id, address, float(latitudes[i]), float(longitudes[i]), i, leg, running, demand)
+                )
+                new_id = connection.exec_driver_sql('SELECT last_insert_rowid()').scalar()
+                path['ids'][i] = new_id
+            elif (path['positions'][i] != i or not np.isclose(path['legs'][i], leg)
+                  or not np.isclose(path['cumulative'][i], running)):
+                updates.append((i, leg, running, waypoint_id))
+        if updates:
+            connection.exec_driver_sql(
+                'UPDATE waypoints SET order_index = ?, leg_distance = ?, cumulative_distance = ? WHERE id = ?',
+                updates
+            )
+
+        self.total_distance = round(total, 2)
+        return new_id
 
     def __repr__(self):
         return f'<Route {self.id}: {self.name}>'
@@ -75,6 +396,129 @@ class Waypoint(db.Model):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     order_index = db.Column(db.Integer, nullable=False)  # Порядок в маршруте
+    leg_distance = db.Column(db.Float)  # Расстояние от предыдущей точки, км
+    cumulative_distance = db.Column(db.Float)  # Расстояние от начала маршрута, км
+    demand = db.Column(db.Float)  # Спрос точки (в маршрутах машин плана)
+
+    # Точки маршрута читаются одним проходом по индексу (route_id, order_index)
+    __table_args__ = (
+        db.Index('ix_waypoints_route_order', 'route_id', 'order_index'),
+    )
+
+    @classmethod
+    @timed('load_route')
+    def for_route(cls, route_id):
+        """Точки маршрута в порядке обхода"""
+        return cls.query.filter_by(route_id=route_id).order_by(cls.order_index).all()
+
+    def __repr__(self):
+        return f'<Waypoint {self.id}: {self.address}>'
+
+_WAYPOINT_PATH = (
+    'SELECT id, latitude, longitude, leg_distance, cumulative_distance '
+    'FROM waypoints WHERE route_id = ? ORDER BY order_index'
+)
+
+_WAYPOINT_INSERT = (
+    'INSERT INTO waypoints '
+    '(route_id, address, latitude, longitude, order_index, leg_distance, cumulative_distance, demand) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+
+class Plan(db.Model):
+    """План развоза: маршруты нескольких машин с одного склада"""
+    __tablename__ = 'plans'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    vehicles = db.Column(db.Integer, nullable=False)  # Число машин
+    capacity = db.Column(db.Float)  # Вместимость машины (None — без ограничения)
+    closed = db.Column(db.Boolean, nullable=False, default=True)  # Машины возвращаются на склад
+    total_distance = db.Column(db.Float)  # Суммарное расстояние всех машин, км
+    total_load = db.Column(db.Float)  # Суммарный спрос точек
+
+    # Маршруты машин плана
+    routes = db.relationship('Route', backref='plan', lazy=True, order_by='Route.vehicle',
+                             cascade='all, delete-orphan')
+
+    @classmethod
+    def create_with_routes(cls, name, tours, loads, vehicles, capacity=None, closed=True):
+        """
+        Сохранение плана: маршрут каждой машины с точками — отдельный Route
+        (Route.create_with_waypoints), связанный с планом. Машины без точек
+        не сохраняются.
+
+        Аргументы:
+            name: название плана
+            tours: упорядоченные точки маршрутов машин (WaypointBuffer)
+            loads: загрузка машин
+            vehicles: число машин
+            capacity: вместимость машины
+            closed: машины возвращаются на склад
+
+        Возвращает:
+            созданный Plan (транзакцию фиксирует вызывающий код)
+        """
+        plan = cls(name=name, vehicles=vehicles, capacity=capacity, closed=closed)
+        db.session.add(plan)
+        db.session.flush()
+
+        total_distance = 0.0
+        for vehicle, (tour, load) in enumerate(zip(tours, loads), start=1):
+            if len(tour) < (3 if closed else 2):
+                # Машина без точек
+                continue
+            route = Route.create_with_waypoints(f'{name} — машина {vehicle}', tour)
+            route.plan_id = plan.id
+            route.vehicle = vehicle
+            route.load = load
+            total_distance += route.total_distance
+        plan.total_distance = round(total_distance, 2)
+        plan.total_load = float(sum(loads))
+        return plan
+
+    def update_totals(self):
+        """
+        Пересчёт суммарных длины и загрузки плана по его маршрутам после
+        изменения точек маршрута машины (транзакцию фиксирует вызывающий код)
+        """
+        self.total_distance = round(sum(route.total_distance or 0.0 for route in self.routes), 2)
+        self.total_load = float(sum(route.load or 0.0 for route in self.routes))
+
+    def __repr__(self):
+        return f'<Plan {self.id}: {self.name}>'
+
+
+class Job(db.Model):
+    """Фоновая задача расчёта маршрута"""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # upload / manual / plan
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued / running / done / failed
+    stage = db.Column(db.String(50))  # Текущий этап расчёта
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0..1
+    payload = db.Column(db.Text, nullable=False)  # Входные данные задачи (JSON)
+    message = db.Column(db.Text)  # Итоговое сообщение или текст ошибки
+    owner = db.Column(db.String(100))  # Процесс, отвечающий за задачу (host:pid)
+    route_id = db.Column(db.Integer, db.ForeignKey('routes.id'))
+    plan_id = db.Column(db.Integer, db.ForeignKey('plans.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress or 0.0, 3),
+            'message': self.message,
+            'route_id': self.route_id,
+            'plan_id': self.plan_id,
+        }
 
     def __repr__(self):
-        return f'<Waypoint {self.id}: {self.address}>'
\ No newline at end of file
+        return f'<Job {self.id}: {self.status}>'
@@ -0,0 +1,33 @@
+"""
+Общие фикстуры тестов: приложение Flask с отдельной SQLite-базой во
+временном каталоге
+
+Запуск из корня проекта:
+    python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, init_db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Минимальное приложение только с БД: без очереди задач и кэша карт"""
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'routes.db'}",
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        TESTING=True,
+    )
+    db.init_app(app)
+    with app.app_context():
+        init_db()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,48 @@
+"""Проверка параметров пакетного JSON API (POST /api/routes/solve)"""
+import pytest
+
+from app import create_app
+from models import db, init_db
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'routes.db'}",
+        'MAP_FOLDER': str(tmp_path / 'maps'),
+        'TESTING': True,
+    })
+    with app.app_context():
+        init_db()
+    yield app.test_client()
+    with app.app_context():
+        db.engine.dispose()
+
+
+def _problem(**options):
+    return {
+        'waypoints': [
+            {'address': 'A', 'latitude': 55.75, 'longitude': 37.62},
+            {'address': 'B', 'latitude': 55.76, 'longitude': 37.60},
+        ],
+        **options,
+    }
+
+
+@pytest.mark.parametrize('value', ['false', 'true', 0, 1, None])
+def test_improve_must_be_boolean(client, value):
+    response = client.post('/api/routes/solve', json=[_problem(improve=value)])
+    assert response.status_code == 200
+    assert 'improve' in response.get_json()['results'][0]['error']
+
+
+def test_default_improve_must_be_boolean(client):
+    response = client.post('/api/routes/solve', json={'improve': 'false', 'problems': [_problem()]})
+    assert 'improve' in response.get_json()['results'][0]['error']
+
+
+@pytest.mark.parametrize('value', ['false', 1, None])
+def test_persist_must_be_boolean(client, value):
+    response = client.post('/api/routes/solve', json={'persist': value, 'problems': [_problem()]})
+    assert response.status_code == 400
+    assert 'persist' in response.get_json()['error']
@@ -0,0 +1,27 @@
+"""Разбиение на кластеры (algorithms.decomposition.solve_decomposed)"""
+import numpy as np
+
+from algorithms.decomposition import solve_decomposed
+
+
+def test_coincident_points_visited_once():
+    # Последний кластер целиком из совпадающих точек: выход не должен
+    # совпасть со входом, иначе точка попадёт в маршрут дважды
+    latitudes = np.concatenate(([55.70, 55.75, 55.80], np.full(300, 55.90)))
+    longitudes = np.concatenate(([37.50, 37.60, 37.70], np.full(300, 37.90)))
+
+    order, _ = solve_decomposed(latitudes, longitudes, cluster_size=100)
+
+    assert order[0] == 0
+    assert sorted(order.tolist()) == list(range(len(latitudes)))
+
+
+def test_random_points_form_permutation():
+    rng = np.random.default_rng(7)
+    latitudes = 55.75 + rng.uniform(-0.3, 0.3, 2000)
+    longitudes = 37.62 + rng.uniform(-0.5, 0.5, 2000)
+
+    order, _ = solve_decomposed(latitudes, longitudes, improve=True, cluster_size=300)
+
+    assert order[0] == 0
+    assert sorted(order.tolist()) == list(range(len(latitudes)))
@@ -0,0 +1,93 @@
+"""Пулы процессов решателя в рабочих процессах задач (utils.job_queue)"""
+import numpy as np
+import pytest
+
+from utils import job_queue
+
+
+@pytest.fixture
+def solver_workers(monkeypatch):
+    monkeypatch.setattr(job_queue, 'SOLVER_WORKERS', 8)
+    monkeypatch.setattr(job_queue, '_solver_share', 8)
+
+
+def test_solver_pool_shared_between_job_workers(solver_workers):
+    job_queue._init_job_worker(4)
+    executor, workers = job_queue._solver_pool(job_queue.SOLVER_WORKERS)
+    try:
+        assert workers == 2
+        assert executor is not None
+    finally:
+        executor.shutdown()
+
+
+def test_no_solver_pool_when_share_is_one(solver_workers):
+    job_queue._init_job_worker(16)
+    assert job_queue._solver_pool(job_queue.SOLVER_WORKERS) == (None, 1)
+
+
+@pytest.fixture
+def stages(monkeypatch, tmp_path):
+    """Этапы задачи, сообщённые compute_route (кэш решений — во временном файле)"""
+    from utils.solution_cache import solution_cache
+
+    monkeypatch.setattr(solution_cache, 'path', str(tmp_path / 'solution_cache.db'))
+    monkeypatch.setattr(solution_cache, '_initialized', False)
+    reported = []
+    monkeypatch.setattr(job_queue, '_report_stage', lambda db_path, job_id, stage: reported.append(stage))
+    return reported
+
+
+def _waypoints(count):
+    return [
+        {'address': f'Точка {i}', 'latitude': 55.7 + 0.01 * i, 'longitude': 37.6 + 0.013 * (i % 3)}
+        for i in range(count)
+    ]
+
+
+def test_compute_route_reports_solving(stages):
+    result = job_queue.compute_route(None, 'job', {'waypoints': _waypoints(8)})
+    assert stages == ['parsing', 'solving']
+    assert result['cache'] == 'miss'
+
+    # Точное совпадение берётся из кэша без решения
+    stages.clear()
+    result = job_queue.compute_route(None, 'job', {'waypoints': _waypoints(8)})
+    assert stages == ['parsing']
+    assert result['strategy'] == 'cache'
+    # Доказанная оптимальность сохраняется вместе с маршрутом
+    assert result['optimal']
+
+
+def test_small_route_not_patched_from_near_match(stages):
+    job_queue.compute_route(None, 'job', {'waypoints': _waypoints(12)})
+
+    # Одна точка изменилась — похожий набор, но маршрут решается точно
+    changed = _waypoints(12)
+    changed[5]['latitude'] += 0.003
+    result = job_queue.compute_route(None, 'job', {'waypoints': changed})
+    assert result['cache'] == 'miss'
+    assert result['strategy'] == 'exact'
+    assert result['optimal']
+
+
+def test_timed_out_solution_is_not_an_exact_hit(stages):
+    from utils.solution_cache import solution_cache
+
+    waypoints = _waypoints(40)
+    latitudes = np.array([wp['latitude'] for wp in waypoints])
+    longitudes = np.array([wp['longitude'] for wp in waypoints])
+    options = {'improve': False, 'strategy': 'auto', 'cost': 'haversine'}
+    # Маршрут, остановленный по ограничению времени: точки в исходном порядке
+    lookup = solution_cache.lookup(latitudes, longitudes, options)
+    solution_cache.store(lookup, np.arange(40), 1000.0, final=False)
+    assert solution_cache.lookup(latitudes, longitudes, options, near=False).kind == 'miss'
+
+    result = job_queue.compute_route(None, 'job', {'waypoints': waypoints})
+    assert result['cache'] == 'near'
+    assert result['strategy'] == 'warm_start'
+    assert result['length'] < 1000.0
+
+    # Доведённое до конца решение возвращается из кэша
+    result = job_queue.compute_route(None, 'job', {'waypoints': waypoints})
+    assert result['strategy'] == 'cache'
@@ -0,0 +1,140 @@
+"""
+Согласованность маршрута после локальных правок (Route.insert_stop и
+Route.remove_stop): после каждой вставки или удаления order_index идут
+подряд с нуля, а сохранённые отрезки, нарастающий итог и общая длина
+совпадают с полным пересчётом
+"""
+import numpy as np
+import pytest
+
+from models import Plan, Route, Waypoint, db, route_distances
+from utils.waypoint_buffer import WaypointBuffer
+
+
+def _random_route(rng, size):
+    latitudes = 55.75 + rng.uniform(-0.3, 0.3, size)
+    longitudes = 37.62 + rng.uniform(-0.5, 0.5, size)
+    waypoints = [
+        {'address': f'Точка {i}', 'latitude': float(lat), 'longitude': float(lon)}
+        for i, (lat, lon) in enumerate(zip(latitudes, longitudes))
+    ]
+    route = Route.create_with_waypoints(f'Маршрут {size}', waypoints)
+    db.session.commit()
+    return route
+
+
+def assert_consistent(route):
+    """Сохранённые данные маршрута совпадают с полным пересчётом"""
+    db.session.expire_all()
+    waypoints = Waypoint.for_route(route.id)
+    assert [wp.order_index for wp in waypoints] == list(range(len(waypoints)))
+
+    legs, cumulative, total = route_distances(
+        [wp.latitude for wp in waypoints], [wp.longitude for wp in waypoints]
+    )
+    np.testing.assert_allclose([wp.leg_distance for wp in waypoints], legs, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose([wp.cumulative_distance for wp in waypoints], cumulative,
+                               rtol=1e-9, atol=1e-6)
+    assert db.session.get(Route, route.id).total_distance == pytest.approx(round(total, 2), abs=0.01)
+
+
+@pytest.mark.parametrize('size, edits', [(2, 30), (3, 30), (10, 40), (200, 40), (10_000, 20)])
+def test_random_edits_keep_route_consistent(app, size, edits):
+    rng = np.random.default_rng(size)
+    route = _random_route(rng, size)
+    count = size
+
+    for step in range(edits):
+        if count <= 2 or rng.random() < 0.5:
+            latitude = 55.75 + rng.uniform(-0.35, 0.35)
+            longitude = 37.62 + rng.uniform(-0.55, 0.55)
+            result = route.insert_stop(f'Новая {step}', latitude, longitude)
+            db.session.commit()
+            count += 1
+            inserted = db.session.get(Waypoint, result['waypoint_id'])
+            assert inserted.order_index == result['position']
+            assert (inserted.latitude, inserted.longitude) == (latitude, longitude)
+        else:
+            ids = [wp.id for wp in Waypoint.for_route(route.id)]
+            removed = int(rng.choice(ids))
+            route.remove_stop(removed)
+            db.session.commit()
+            count -= 1
+            assert db.session.get(Waypoint, removed) is None
+
+        assert Waypoint.query.filter_by(route_id=route.id).count() == count
+        assert_consistent(route)
+
+
+def test_remove_keeps_two_points(app):
+    route = _random_route(np.random.default_rng(0), 2)
+    first = Waypoint.for_route(route.id)[0]
+    with pytest.raises(ValueError):
+        route.remove_stop(first.id)
+
+
+def test_remove_foreign_waypoint(app):
+    rng = np.random.default_rng(1)
+    route = _random_route(rng, 5)
+    other = _random_route(rng, 5)
+    with pytest.raises(ValueError):
+        route.remove_stop(Waypoint.for_route(other.id)[0].id)
+
+
+def _closed_plan(capacity=None):
+    rng = np.random.default_rng(3)
+    size = 40
+    tour = WaypointBuffer()
+    tour.extend(
+        ['Склад'] + [f'Точка {i}' for i in range(1, size)] + ['Склад'],
+        np.concatenate(([55.75], 55.75 + rng.uniform(-0.3, 0.3, size - 1), [55.75])),
+        np.concatenate(([37.62], 37.62 + rng.uniform(-0.5, 0.5, size - 1), [37.62])),
+        np.concatenate(([0.0], np.ones(size - 1), [0.0]))
+    )
+    plan = Plan.create_with_routes('План', [tour], [size - 1.0], 1, capacity=capacity, closed=True)
+    db.session.commit()
+    return plan, plan.routes[0]
+
+
+def test_closed_plan_route_keeps_depot_at_both_ends(app):
+    plan, route = _closed_plan()
+    depot_ids = [Waypoint.for_route(route.id)[i].id for i in (0, -1)]
+    rng = np.random.default_rng(4)
+
+    for step in range(40):
+        if step % 3 == 2:
+            stops = [wp.id for wp in Waypoint.for_route(route.id)[1:-1]]
+            route.remove_stop(int(rng.choice(stops)))
+        else:
+            # Точки рядом со складом: без закреплённого конца их выгоднее
+            # всего поставить после последней точки маршрута
+            route.insert_stop(f'Новая {step}', 55.75 + rng.uniform(-0.01, 0.01),
+                              37.62 + rng.uniform(-0.01, 0.01), demand=2.0)
+        db.session.commit()
+
+        waypoints = Waypoint.for_route(route.id)
+        assert [waypoints[0].id, waypoints[-1].id] == depot_ids
+        assert_consistent(route)
+
+    db.session.expire_all()
+    stops = Waypoint.for_route(route.id)[1:-1]
+    assert route.load == pytest.approx(sum(wp.demand for wp in stops))
+    assert plan.total_load == pytest.approx(route.load)
+    assert plan.total_distance == pytest.approx(route.total_distance)
+
+    for depot_id in depot_ids:
+        with pytest.raises(ValueError):
+            route.remove_stop(depot_id)
+
+
+def test_plan_route_insert_respects_capacity(app):
+    plan, route = _closed_plan(capacity=40)
+    count = Waypoint.query.filter_by(route_id=route.id).count()
+
+    with pytest.raises(ValueError):
+        route.insert_stop('Тяжёлая', 55.76, 37.63, demand=2.0)
+    route.insert_stop('Лёгкая', 55.76, 37.63, demand=1.0)
+    db.session.commit()
+
+    assert Waypoint.query.filter_by(route_id=route.id).count() == count + 1
+    assert route.load == pytest.approx(40.0)
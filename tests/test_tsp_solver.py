@@ -0,0 +1,88 @@
+"""
+Решатель задачи коммивояжёра (algorithms.tsp_solver) и точные методы
+(algorithms.exact): на маленьких случайных наборах точные методы сверяются
+с полным перебором
+"""
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+from algorithms.distance import haversine_matrix
+from algorithms.exact import branch_and_bound_order, held_karp_order
+from algorithms.tsp_solver import (
+    BRANCH_AND_BOUND_LIMIT, HELD_KARP_LIMIT, choose_strategy, solve_order, solve_tsp_detailed
+)
+from utils.waypoint_buffer import WaypointBuffer
+
+
+def _points(rng, n):
+    return 55.75 + rng.uniform(-0.2, 0.2, n), 37.62 + rng.uniform(-0.3, 0.3, n)
+
+
+def test_explicit_exact_capped_for_large_routes():
+    latitudes, longitudes = _points(np.random.default_rng(0), BRANCH_AND_BOUND_LIMIT + 1)
+
+    solution = solve_order(latitudes, longitudes, strategy='exact')
+
+    # Применённая стратегия — эвристика с локальным поиском
+    assert solution.strategy == 'heuristic'
+    assert solution.improved
+    assert not solution.optimal
+    assert sorted(solution.order.tolist()) == list(range(len(latitudes)))
+
+
+def _brute_force(cost, start=0):
+    """Стоимость оптимального незамкнутого маршрута с началом start полным перебором"""
+    others = [idx for idx in range(len(cost)) if idx != start]
+    return min(
+        sum(cost[a, b] for a, b in zip((start,) + rest, rest))
+        for rest in permutations(others)
+    )
+
+
+def _path_cost(cost, order):
+    return float(sum(cost[a, b] for a, b in zip(order[:-1], order[1:])))
+
+
+@pytest.mark.parametrize('n', range(2, 10))
+def test_exact_engines_match_brute_force(n):
+    rng = np.random.default_rng(n)
+    for trial in range(3):
+        latitudes, longitudes = _points(rng, n)
+        symmetric = haversine_matrix(latitudes, longitudes)
+        # Несимметричная матрица — как у расстояний по дорогам
+        asymmetric = symmetric * rng.uniform(1.0, 1.5, (n, n))
+        for cost in (symmetric, asymmetric):
+            best = _brute_force(cost)
+
+            order, length = held_karp_order(cost)
+            assert order[0] == 0 and sorted(order.tolist()) == list(range(n))
+            assert length == pytest.approx(best)
+            assert _path_cost(cost, order) == pytest.approx(best)
+
+            order, length, proven = branch_and_bound_order(cost)
+            assert proven
+            assert order[0] == 0 and sorted(order.tolist()) == list(range(n))
+            assert length == pytest.approx(best)
+            assert _path_cost(cost, order) == pytest.approx(best)
+
+
+def test_choose_strategy():
+    assert choose_strategy(HELD_KARP_LIMIT) == 'exact'
+    assert choose_strategy(HELD_KARP_LIMIT + 1) == 'heuristic'
+    assert choose_strategy(BRANCH_AND_BOUND_LIMIT, improve=True) == 'exact'
+    assert choose_strategy(BRANCH_AND_BOUND_LIMIT + 1, improve=True) == 'heuristic'
+
+
+@pytest.mark.parametrize('n', [3, 6, 9])
+def test_auto_solves_small_routes_exactly(n):
+    latitudes, longitudes = _points(np.random.default_rng(100 + n), n)
+    buffer = WaypointBuffer()
+    buffer.extend([f'Точка {i}' for i in range(n)], latitudes, longitudes)
+
+    solution = solve_tsp_detailed(buffer, strategy='auto')
+
+    assert solution.strategy == 'exact'
+    assert solution.optimal
+    assert solution.length == pytest.approx(_brute_force(haversine_matrix(latitudes, longitudes)))
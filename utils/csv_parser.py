@@ -1,5 +1,35 @@
 import csv
+import io
 import os
+from itertools import islice
+
+import numpy as np
+
+from utils.metrics import metrics, timed
+from utils.waypoint_buffer import WaypointBuffer
+
+# Размер пачки строк, проверяемых за один проход
+CHUNK_SIZE = 5000
+
+# Сколько ошибочных строк собирается, прежде чем разбор прерывается
+DEFAULT_MAX_ERRORS = 100
+
+REQUIRED_COLUMNS = ('address', 'latitude', 'longitude')
+
+# Без координат (с включённым геокодированием) обязателен только адрес
+ADDRESS_ONLY_COLUMNS = ('address',)
+
+# Необязательная колонка спроса точек (объём заказа) для плана развоза
+# несколькими машинами
+DEMAND_COLUMN = 'demand'
+
+
+class CSVParseError(ValueError):
+    """Ошибка разбора CSV со списком ошибок по строкам"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
 
 
 def parse_csv_file(filepath):
@@ -14,44 +44,284 @@ def parse_csv_file(filepath):
     Возвращает:
         список словарей {'address': str, 'latitude': float, 'longitude': float}
     """
-    waypoints = []
-
     if not os.path.exists(filepath):
         raise FileNotFoundError(f'Файл не найден: {filepath}')
 
-    with open(filepath, 'r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
+    with open(filepath, 'r', encoding='utf-8', newline='') as file:
+        return parse_csv(file)
+
+
+def parse_csv(file):
+    """
+    Парсинг CSV из открытого текстового файла или любого итератора строк
+    (формат — как у parse_csv_file). Первая же ошибочная строка прерывает разбор.
+
+    Возвращает:
+        список словарей {'address': str, 'latitude': float, 'longitude': float}
+    """
+    buffer, _ = parse_csv_stream(file, max_errors=0)
+    return buffer.to_dicts()
+
+
+@timed('parse_csv')
+def parse_csv_stream(stream, max_errors=DEFAULT_MAX_ERRORS, chunk_size=CHUNK_SIZE,
+                     allow_missing_coordinates=False, demand_column=None):
+    """
+    Потоковый разбор CSV прямо из файлового потока (например, FileStorage.stream)
+
+    Строки читаются и проверяются пачками по chunk_size, координаты сразу
+    складываются в компактный WaypointBuffer — файл целиком в память не
+    читается и на диск не сохраняется. Ошибочные строки пропускаются
+    и собираются в список; разбор прерывается, только если их больше max_errors.
+
+    С allow_missing_coordinates колонки latitude/longitude необязательны:
+    строки с адресом, но без координат, попадают в буфер с координатами NaN
+    (их определяет этап геокодирования).
+
+    Если задан demand_column и такая колонка есть в заголовке, её значения
+    (спрос точек, например объём заказа) сохраняются в колонку demands
+    буфера; пустое значение — нулевой спрос.
+
+    Аргументы:
+        stream: бинарный или текстовый поток с CSV в UTF-8
+        max_errors: допустимое число ошибочных строк
+        chunk_size: размер пачки строк
+        allow_missing_coordinates: принимать строки только с адресом
+        demand_column: название необязательной колонки спроса
+
+    Возвращает:
+        (WaypointBuffer, список сообщений об ошибках в строках)
+    """
+    text = _text_stream(stream)
+    buffer = WaypointBuffer()
+    errors = []
+
+    try:
+        rows = csv.reader(text)
+        columns = _column_indexes(next(rows, None), allow_missing_coordinates, demand_column)
+
+        row_num = 2  # 1 строка — заголовок
+        for chunk in iter_chunks(rows, chunk_size):
+            _validate_chunk(chunk, row_num, columns, buffer, errors, allow_missing_coordinates)
+            row_num += len(chunk)
+
+            if len(errors) > max_errors:
+                raise CSVParseError(_errors_message(errors, max_errors), errors)
+
+    except UnicodeDecodeError:
+        raise CSVParseError('Файл должен быть в кодировке UTF-8', errors)
+    finally:
+        if text is not stream:
+            # Отсоединяем обёртку, чтобы не закрыть исходный поток
+            text.detach()
+
+    if not len(buffer):
+        raise CSVParseError('CSV файл не содержит данных', errors)
+
+    metrics.inc('csv_rows_total', len(buffer), result='valid')
+    metrics.inc('csv_rows_total', len(errors), result='invalid')
+    return buffer, errors
+
+
+def iter_chunks(rows, chunk_size=CHUNK_SIZE):
+    """Генератор пачек строк по chunk_size"""
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
-        # Проверка наличия необходимых колонок
-        required_columns = {'address', 'latitude', 'longitude'}
-        if not required_columns.issubset(set(reader.fieldnames)):
-            raise ValueError(
-                f'CSV файл должен содержать колонки: {", ".join(required_columns)}. '
-                f'Найдены: {", ".join(reader.fieldnames)}'
-            )
 
-        for row_num, row in enumerate(reader, start=2):  # start=2 т.к. 1 строка — заголовок
+def _text_stream(stream):
+    """Бинарный поток оборачивается в текстовый UTF-8, остальное — как есть"""
+    if isinstance(stream, (io.RawIOBase, io.BufferedIOBase)) or 'b' in str(getattr(stream, 'mode', '')):
+        return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return stream
+
+
+def _column_indexes(header, allow_missing_coordinates=False, demand_column=None):
+    """
+    Позиции колонок address, latitude, longitude и колонки спроса в заголовке;
+    при allow_missing_coordinates отсутствующие колонки координат — None,
+    отсутствующая колонка спроса — всегда None
+    """
+    fieldnames = [name.strip() for name in header or []]
+    required = ADDRESS_ONLY_COLUMNS if allow_missing_coordinates else REQUIRED_COLUMNS
+    if not set(required).issubset(fieldnames):
+        raise CSVParseError(
+            f'CSV файл должен содержать колонки: {", ".join(required)}. '
+            f'Найдены: {", ".join(fieldnames)}'
+        )
+    demand = fieldnames.index(demand_column) if demand_column in fieldnames else None
+    if allow_missing_coordinates and not {'latitude', 'longitude'}.issubset(fieldnames):
+        return fieldnames.index('address'), None, None, demand
+    return tuple(fieldnames.index(name) for name in REQUIRED_COLUMNS) + (demand,)
+
+
+def _validate_chunk(chunk, first_row_num, columns, buffer, errors, allow_missing_coordinates=False):
+    """
+    Проверка пачки строк: координаты разбираются и проверяются векторно,
+    построчный разбор нужен только для поиска ошибочных строк
+    """
+    address_col = columns[0]
+    width = max(col for col in columns if col is not None) + 1
+    chunk_errors = []
+
+    # Пустые строки в csv.reader возвращаются как [] — пропускаем их, как DictReader
+    numbered = [(first_row_num + i, row) for i, row in enumerate(chunk) if row]
+    if allow_missing_coordinates:
+        # Недостающие в конце строки поля считаются пустыми
+        numbered = [
+            (num, row + [''] * (width - len(row)) if address_col < len(row) < width else row)
+            for num, row in numbered
+        ]
+    short = [(num, row) for num, row in numbered if len(row) < width]
+    for num, _ in short:
+        chunk_errors.append((num, f'Строка {num}: недостаточно колонок'))
+    if short:
+        numbered = [(num, row) for num, row in numbered if len(row) >= width]
+
+    if numbered:
+        _collect_valid(numbered, columns, buffer, chunk_errors, allow_missing_coordinates)
+
+    errors.extend(message for _, message in sorted(chunk_errors))
+
+
+def _collect_valid(numbered, columns, buffer, errors, allow_missing_coordinates=False):
+    """
+    Векторный разбор и проверка координат пачки; верные строки — в buffer.
+    Строки без координат (если разрешены) попадают в buffer с NaN.
+    """
+    address_col, lat_col, lon_col, demand_col = columns
+
+    pending = None
+    if allow_missing_coordinates:
+        numbered, pending = _split_pending(numbered, columns, errors)
+        if not numbered:
+            return
+
+    demands = None
+    if demand_col is not None:
+        numbered, demands, pending = _parse_demands(numbered, demand_col, pending, errors)
+        if not numbered:
+            return
+
+    addresses = [row[address_col].strip() for _, row in numbered]
+    if pending is not None and pending.all():
+        buffer.extend(addresses, np.full(len(numbered), np.nan), np.full(len(numbered), np.nan), demands)
+        return
+
+    try:
+        lats = np.array([row[lat_col] for _, row in numbered], dtype=np.float64)
+        lons = np.array([row[lon_col] for _, row in numbered], dtype=np.float64)
+        failed = None
+    except ValueError:
+        lats, lons, failed = _parse_floats(numbered, lat_col, lon_col, errors)
+
+    # Сравнение с NaN ложно, поэтому NaN тоже попадает в неверные координаты
+    valid = (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+    if pending is not None:
+        valid |= pending
+    if not valid.all():
+        for idx in np.flatnonzero(~valid):
+            if failed is not None and failed[idx]:
+                continue  # Ошибка разбора уже записана
+            num = numbered[idx][0]
+            if not abs(lats[idx]) <= 90:
+                errors.append((num, f'Строка {num}: неверная широта {lats[idx]}'))
+            else:
+                errors.append((num, f'Строка {num}: неверная долгота {lons[idx]}'))
+
+        keep = np.flatnonzero(valid)
+        addresses = [addresses[idx] for idx in keep]
+        lats, lons = lats[keep], lons[keep]
+        if demands is not None:
+            demands = demands[keep]
+
+    buffer.extend(addresses, lats, lons, demands)
+
+
+def _split_pending(numbered, columns, errors):
+    """
+    Отметка строк без координат: в них пустые координаты заменяются на NaN.
+    Строки без адреса и без координат считаются ошибочными.
+
+    Возвращает:
+        (оставшиеся строки, массив признаков «координаты не заданы»)
+    """
+    address_col, lat_col, lon_col, _ = columns
+
+    kept = []
+    pending = []
+    for num, row in numbered:
+        blank = lat_col is None or (not row[lat_col].strip() and not row[lon_col].strip())
+        if not blank:
+            kept.append((num, row))
+            pending.append(False)
+        elif row[address_col].strip():
+            if lat_col is not None:
+                row = list(row)
+                row[lat_col] = row[lon_col] = 'nan'
+            kept.append((num, row))
+            pending.append(True)
+        else:
+            errors.append((num, f'Строка {num}: нет ни адреса, ни координат'))
+
+    return kept, np.array(pending, dtype=bool)
+
+
+def _parse_demands(numbered, demand_col, pending, errors):
+    """
+    Разбор колонки спроса пачки (векторно, построчно — только при ошибке);
+    строки с нечисловым или отрицательным спросом считаются ошибочными
+
+    Возвращает:
+        (верные строки, их спрос, их признаки «координаты не заданы» или None)
+    """
+    values = [row[demand_col].strip() or '0' for _, row in numbered]
+    try:
+        demands = np.array(values, dtype=np.float64)
+    except ValueError:
+        # Нечисловой спрос — NaN, он не пройдёт проверку ниже
+        demands = np.empty(len(numbered))
+        for idx, value in enumerate(values):
             try:
-                address = row['address'].strip()
-                latitude = float(row['latitude'].strip())
-                longitude = float(row['longitude'].strip())
+                demands[idx] = float(value)
+            except ValueError:
+                demands[idx] = np.nan
 
-                # Валидация координат
-                if not (-90 <= latitude <= 90):
-                    raise ValueError(f'Неверная широта в строке {row_num}: {latitude}')
-                if not (-180 <= longitude <= 180):
-                    raise ValueError(f'Неверная долгота в строке {row_num}: {longitude}')
+    valid = np.isfinite(demands) & (demands >= 0)
+    if valid.all():
+        return numbered, demands, pending
+    for idx in np.flatnonzero(~valid):
+        num = numbered[idx][0]
+        errors.append((num, f'Строка {num}: неверный спрос {values[idx]!r}'))
+    keep = np.flatnonzero(valid)
+    return (
+        [numbered[idx] for idx in keep],
+        demands[keep],
+        pending[keep] if pending is not None else None
+    )
 
-                waypoints.append({
-                    'address': address,
-                    'latitude': latitude,
-                    'longitude': longitude
-                })
 
-            except (ValueError, KeyError) as e:
-                raise ValueError(f'Ошибка в строке {row_num}: {str(e)}')
+def _parse_floats(numbered, lat_col, lon_col, errors):
+    """Построчный разбор координат с записью ошибок; ошибочные строки — NaN"""
+    lats = np.empty(len(numbered))
+    lons = np.empty(len(numbered))
+    failed = np.zeros(len(numbered), dtype=bool)
+    for idx, (num, row) in enumerate(numbered):
+        try:
+            lats[idx] = float(row[lat_col])
+            lons[idx] = float(row[lon_col])
+        except ValueError as e:
+            errors.append((num, f'Строка {num}: {e}'))
+            lats[idx] = lons[idx] = np.nan
+            failed[idx] = True
+    return lats, lons, failed
 
-    if not waypoints:
-        raise ValueError('CSV файл не содержит данных')
 
-    return waypoints
\ No newline at end of file
+def _errors_message(errors, max_errors):
+    shown = '; '.join(errors[:5])
+    if max_errors == 0:
+        return f'Ошибка в CSV файле. {shown}'
+    return f'Слишком много ошибочных строк (больше {max_errors}). {shown}'
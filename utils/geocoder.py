@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import requests
+
+from utils.metrics import timed
+from utils.response_cache import PersistentCache
+from utils.yandex_router import GEOCODER_URL, YANDEX_API_KEY, route_cache, router_client
+
+logger = logging.getLogger(__name__)
+
+# Адрес геокодера можно переопределить, например, для проверки на локальной заглушке
+GEOCODER_URL = os.getenv('YANDEX_GEOCODER_URL', GEOCODER_URL)
+GEOCODER_API_KEY = os.getenv('YANDEX_GEOCODER_API_KEY', YANDEX_API_KEY)
+
+# Параллельные запросы к геокодеру и ограничение частоты (запросов в секунду)
+GEOCODER_WORKERS = int(os.getenv('GEOCODER_WORKERS', router_client.workers))
+GEOCODER_RATE_LIMIT = float(os.getenv('GEOCODER_RATE_LIMIT', 10))
+
+# Постоянный кэш «нормализованный адрес → координаты»; адреса, которые
+# геокодер не нашёл, тоже кэшируются (значение null)
+geocode_cache = PersistentCache(
+    route_cache.path,
+    table='geocode',
+    ttl=float(os.getenv('GEOCODER_CACHE_TTL', 30 * 24 * 3600)),
+    stale_ttl=0,
+    max_bytes=route_cache.max_bytes
+)
+
+
+def normalize_address(address: str) -> str:
+    """
+    Нормализация адреса для ключа кэша и удаления дублей: регистр, «ё»,
+    пробелы вокруг знаков препинания и повторные пробелы
+    """
+    address = address.casefold().replace('ё', 'е')
+    address = re.sub(r'\s*([,.;])\s*', r'\1 ', address)
+    return re.sub(r'\s+', ' ', address).strip(' ,;')
+
+
+class RateLimiter:
+    """Ограничение частоты запросов для нескольких потоков (равные интервалы)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def geocode(address: str) -> Optional[Tuple[float, float]]:
+    """
+    Координаты адреса через Яндекс Геокодер (без кэша)
+
+    Returns:
+        (широта, долгота) или None, если адрес не найден
+
+    Raises:
+        requests.RequestException при ошибке запроса
+    """
+    params = {
+        "apikey": GEOCODER_API_KEY,
+        "geocode": address,
+        "format": "json",
+        "results": 1
+    }
+    data = router_client.get(GEOCODER_URL, params, service='geocoder').json()
+
+    members = data["response"]["GeoObjectCollection"]["featureMember"]
+    if not members:
+        return None
+    # Геокодер возвращает «долгота широта»
+    lon, lat = map(float, members[0]["GeoObject"]["Point"]["pos"].split())
+    return lat, lon
+
+
+@timed('geocode')
+def geocode_batch(addresses: Iterable[str], workers: int = GEOCODER_WORKERS,
+                  rate_limit: float = GEOCODER_RATE_LIMIT) -> Dict[str, Optional[Tuple[float, float]]]:
+    """
+    Пакетное геокодирование: адреса нормализуются и дедуплицируются, ищутся
+    в постоянном кэше, промахи запрашиваются параллельно (не больше workers
+    одновременно и не чаще rate_limit в секунду)
+
+    Args:
+        addresses: адреса
+        workers: число параллельных запросов
+        rate_limit: наибольшая частота запросов в секунду (0 — без ограничения)
+    Returns:
+        Словарь {исходный адрес: (широта, долгота) или None}
+    """
+    by_key = {}
+    for address in addresses:
+        by_key.setdefault(normalize_address(address), []).append(address)
+
+    resolved = geocode_cache.get_many(by_key)
+    misses = [key for key in by_key if key not in resolved]
+    logger.info(f"Геокодирование: адресов {len(by_key)}, из кэша {len(resolved)}, запросов {len(misses)}")
+
+    if misses:
+        limiter = RateLimiter(rate_limit)
+        failed = set()
+
+        def lookup(key):
+            limiter.acquire()
+            try:
+                return geocode(by_key[key][0])
+            except (requests.RequestException, KeyError, ValueError) as e:
+                logger.warning(f"Не удалось геокодировать адрес «{by_key[key][0]}»: {e}")
+                failed.add(key)
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            found = dict(zip(misses, executor.map(lookup, misses)))
+
+        # Ошибки запроса не кэшируются — адрес будет запрошен снова
+        geocode_cache.set_many({
+            key: list(point) if point else None for key, point in found.items() if key not in failed
+        })
+        resolved.update(found)
+
+    return {
+        address: tuple(resolved[key]) if resolved.get(key) else None
+        for key, originals in by_key.items()
+        for address in originals
+    }
@@ -0,0 +1,612 @@
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from models import db, Route, Plan, Job, route_distances
+from utils.metrics import metrics, timer, start_profile, finish_profile
+
+logger = logging.getLogger(__name__)
+
+# Этапы расчёта и соответствующий им прогресс
+STAGES = {
+    'queued': 0.0,
+    'parsing': 0.1,
+    'geocoding': 0.2,
+    'solving': 0.3,
+    'saving': 0.9,
+    'done': 1.0,
+}
+
+UNFINISHED_STATUSES = ('queued', 'running')
+
+# Число процессов, решающих кластеры очень больших маршрутов (стратегия
+# decomposition), запуски портфеля (portfolio) и маршруты машин плана
+# развоза; пул создаётся рабочим процессом задачи только на время решения.
+# Это общий предел на все задачи: каждому из JOB_WORKERS рабочих процессов
+# достаётся своя доля, чтобы параллельные задачи не заняли больше ядер
+SOLVER_WORKERS = int(os.getenv('SOLVER_WORKERS', os.cpu_count() or 1))
+
+# С какого числа точек маршруты машин плана решаются в пуле процессов:
+# на меньших планах запуск пула (~0.7 с) дольше самого решения
+PLAN_POOL_MIN_STOPS = 2000
+
+# Доля SOLVER_WORKERS на текущий рабочий процесс задачи
+# (задаётся _init_job_worker при запуске процесса)
+_solver_share = SOLVER_WORKERS
+
+
+def _init_job_worker(job_workers):
+    """Инициализация рабочего процесса задач: доля пула решателя"""
+    global _solver_share
+    _solver_share = max(1, SOLVER_WORKERS // max(1, job_workers))
+
+
+def _solver_pool(workers):
+    """
+    Пул процессов решателя или None, если хватает одного процесса
+
+    Возвращает:
+        (executor или None, число процессов)
+    """
+    workers = max(1, min(workers, _solver_share))
+    if workers == 1:
+        return None, 1
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return executor, workers
+
+
+def _process_id():
+    """Идентификатор текущего процесса: host:pid"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_alive(owner):
+    """Жив ли процесс-владелец задачи (только для процессов этой машины)"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        # Процессы других машин проверить нельзя — считаем живыми
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _report_stage(db_path, job_id, stage):
+    """Запись этапа задачи из рабочего процесса напрямую в SQLite"""
+    with sqlite3.connect(db_path, timeout=30) as connection:
+        connection.execute(
+            "UPDATE jobs SET status = 'running', stage = ?, progress = ?, updated_at = ? WHERE id = ?",
+            (stage, STAGES[stage], datetime.utcnow(), job_id)
+        )
+
+
+def compute_route(db_path, job_id, payload):
+    """
+    Расчёт маршрута в рабочем процессе: разбор входных данных и решение TSP.
+    Сохранение в БД выполняет родительский процесс.
+
+    Возвращает:
+        словарь с упорядоченными точками (WaypointBuffer), статистикой
+        решения, длительностью этапов и метриками рабочего процесса
+    """
+    # Импорты внутри функции: рабочему процессу не нужен Flask
+    from algorithms.tsp_solver import TSPSolution, resolve_strategy
+    from utils.solution_cache import solution_cache
+    from utils.waypoint_buffer import WaypointBuffer
+
+    profile = start_profile()
+    _report_stage(db_path, job_id, 'parsing')
+    not_found = []
+    if 'waypoints' in payload:
+        buffer = WaypointBuffer.from_dicts(payload['waypoints'])
+    else:
+        buffer = WaypointBuffer.from_payload(payload)
+        if len(buffer.missing_coordinates()):
+            _report_stage(db_path, job_id, 'geocoding')
+            not_found = geocode_buffer(buffer)
+
+    if len(buffer) < 2:
+        raise ValueError('Нужно минимум 2 точки для построения маршрута')
+
+    improve = payload.get('improve', False)
+    strategy = payload.get('strategy', 'auto')
+    cost_source = payload.get('cost', 'haversine')
+
+    lookup = None
+    if solution_cache.enabled:
+        # Повторная загрузка того же набора точек не решается заново, а
+        # похожий набор достраивается из прежнего маршрута. Матрица по
+        # дорогам для похожего набора всё равно нужна, поэтому по дорогам
+        # используется только точное совпадение. Маршрут, который решается
+        # точно, из похожего тоже не достраивается: он был бы хуже оптимума
+        exact = resolve_strategy(strategy, len(buffer), improve) == 'exact'
+        latitudes, longitudes = buffer.coordinates()
+        with timer('solution_cache'):
+            lookup = solution_cache.lookup(
+                latitudes, longitudes,
+                {'improve': improve, 'strategy': strategy, 'cost': cost_source},
+                near=cost_source != 'road' and not exact
+            )
+
+    if lookup is not None and lookup.kind == 'exact':
+        solution = TSPSolution(
+            order=lookup.order,
+            initial_length=lookup.length,
+            length=lookup.length,
+            waypoints=buffer.take(lookup.order),
+            cost_source=cost_source,
+            strategy='cache',
+            optimal=lookup.optimal
+        )
+    else:
+        _report_stage(db_path, job_id, 'solving')
+        solution = _solve_route(buffer, payload, improve, strategy, cost_source,
+                                lookup.order if lookup is not None and lookup.kind == 'near' else None)
+        if lookup is not None:
+            # Решение, остановленное по времени, сохраняется незавершённым:
+            # повторная загрузка продолжит его улучшать, а не вернёт как есть
+            solution_cache.store(lookup, solution.order, solution.length,
+                                 final=not solution.timed_out, optimal=solution.optimal)
+
+    return {
+        # Буфер в порядке обхода: передаётся родительскому процессу колонками,
+        # без списка словарей
+        'waypoints': solution.waypoints,
+        'initial_length': solution.initial_length,
+        'length': solution.length,
+        'improved': solution.improved,
+        'improvement_percent': solution.improvement_percent,
+        'elapsed': solution.elapsed,
+        'timed_out': solution.timed_out,
+        'trace': solution.trace,
+        'cost_source': solution.cost_source,
+        'strategy': solution.strategy,
+        'optimal': solution.optimal,
+        'runs': solution.runs,
+        'cache': lookup.kind if lookup is not None else None,
+        'changed': lookup.changed if lookup is not None else 0,
+        'fingerprint': lookup.fingerprint if lookup is not None else None,
+        'not_found': not_found,
+        'profile': finish_profile(profile),
+        # Метрики рабочего процесса добавляются в реестр веб-процесса
+        'metrics': metrics.drain(),
+    }
+
+
+def _solve_route(buffer, payload, improve, strategy, cost_source, initial_order=None):
+    """Решение TSP для точек буфера (с пулом процессов, если он нужен стратегии)"""
+    from algorithms.tsp_solver import resolve_strategy, solve_tsp_detailed
+
+    cost_provider = None
+    if cost_source == 'road':
+        from utils.yandex_router import road_matrix_provider
+        cost_provider = road_matrix_provider()
+
+    resolved = resolve_strategy(strategy, len(buffer), improve)
+    executor, workers = None, 1
+    if initial_order is None and (
+            resolved == 'portfolio' or (resolved == 'decomposition' and cost_provider is None)):
+        executor, workers = _solver_pool(SOLVER_WORKERS)
+
+    try:
+        return solve_tsp_detailed(
+            buffer,
+            improve=improve,
+            time_limit=payload.get('time_limit'),
+            cost_provider=cost_provider,
+            strategy=strategy,
+            executor=executor,
+            workers=workers,
+            initial_order=initial_order
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def compute_plan(db_path, job_id, payload):
+    """
+    Расчёт плана развоза несколькими машинами в рабочем процессе: разбор
+    и геокодирование точек, распределение по машинам и решение их маршрутов.
+    Склад — первая точка. Сохранение в БД выполняет родительский процесс.
+
+    Возвращает:
+        словарь с маршрутами машин (WaypointBuffer на машину), их загрузкой,
+        статистикой решения, длительностью этапов и метриками рабочего процесса
+    """
+    from algorithms.vrp import solve_vrp
+    from utils.waypoint_buffer import WaypointBuffer
+
+    profile = start_profile()
+    _report_stage(db_path, job_id, 'parsing')
+    buffer = WaypointBuffer.from_payload(payload)
+    depot = buffer.addresses[0]
+    not_found = []
+    if len(buffer.missing_coordinates()):
+        _report_stage(db_path, job_id, 'geocoding')
+        depot_missing = 0 in buffer.missing_coordinates()
+        not_found = geocode_buffer(buffer)
+        if depot_missing and depot in not_found:
+            raise ValueError(f'Не найден адрес склада: {depot}')
+
+    if len(buffer) < 2:
+        raise ValueError('Нужны склад и минимум одна точка доставки')
+
+    improve = payload.get('improve', False)
+    executor, workers = None, 1
+    if len(buffer) > PLAN_POOL_MIN_STOPS and payload['vehicles'] > 1:
+        # Больше процессов, чем машин, не нужно: маршрут машины решает один процесс
+        executor, workers = _solver_pool(min(SOLVER_WORKERS, payload['vehicles']))
+
+    _report_stage(db_path, job_id, 'solving')
+    latitudes, longitudes = buffer.coordinates()
+    try:
+        solution = solve_vrp(
+            latitudes,
+            longitudes,
+            payload['vehicles'],
+            demands=buffer.demand_values(),
+            capacity=payload.get('capacity'),
+            closed=payload.get('closed', True),
+            improve=improve,
+            time_limit=payload.get('time_limit'),
+            executor=executor,
+            workers=workers
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    improvement = 0.0
+    if solution.initial_length:
+        improvement = (solution.initial_length - solution.length) / solution.initial_length * 100
+    return {
+        'tours': [buffer.take(tour) for tour in solution.tours],
+        'loads': solution.loads,
+        'lengths': solution.lengths,
+        'stops': len(buffer) - 1,
+        'vehicles_used': solution.vehicles_used,
+        'initial_length': solution.initial_length,
+        'length': solution.length,
+        'improved': improve,
+        'improvement_percent': improvement,
+        'moves': solution.moves,
+        'elapsed': solution.elapsed,
+        'timed_out': solution.timed_out,
+        'trace': solution.trace,
+        'not_found': not_found,
+        'profile': finish_profile(profile),
+        'metrics': metrics.drain(),
+    }
+
+
+def solve_problem(problem):
+    """
+    Решение одной задачи пакетного API в рабочем процессе
+
+    Аргументы:
+        problem: словарь с массивами latitudes, longitudes и параметрами
+            improve, time_limit, strategy
+
+    Возвращает:
+        словарь с порядком обхода (индексы исходных точек), длинами отрезков
+        между соседними точками в порядке обхода и общей длиной, км
+    """
+    from algorithms.tsp_solver import solve_order
+
+    latitudes = problem['latitudes']
+    longitudes = problem['longitudes']
+    solution = solve_order(
+        latitudes,
+        longitudes,
+        improve=problem.get('improve', False),
+        time_limit=problem.get('time_limit'),
+        strategy=problem.get('strategy', 'auto')
+    )
+    legs, _, total = route_distances(latitudes[solution.order], longitudes[solution.order])
+
+    return {
+        'order': solution.order.tolist(),
+        'legs': legs[1:].tolist(),
+        'total_distance': total,
+        'initial_length': solution.initial_length,
+        'improved': solution.improved,
+        'improvement_percent': solution.improvement_percent,
+        'elapsed': solution.elapsed,
+        'timed_out': solution.timed_out,
+        'strategy': solution.strategy,
+        'optimal': solution.optimal,
+        'runs': solution.runs,
+        'metrics': metrics.drain(),
+    }
+
+
+def geocode_buffer(buffer):
+    """
+    Определение координат точек буфера, у которых их нет. Ненайденные
+    адреса удаляются из буфера.
+
+    Возвращает:
+        список ненайденных адресов
+    """
+    from utils.geocoder import geocode_batch
+
+    missing = buffer.missing_coordinates()
+    addresses = [buffer.addresses[idx] for idx in missing.tolist()]
+    points = geocode_batch(addresses)
+
+    found = [(idx, points[address]) for idx, address in zip(missing.tolist(), addresses) if points[address]]
+    if found:
+        indices, coordinates = zip(*found)
+        buffer.set_coordinates(list(indices), [lat for lat, _ in coordinates], [lon for _, lon in coordinates])
+
+    not_found = [address for address in addresses if not points[address]]
+    buffer.remove(buffer.missing_coordinates())
+    return not_found
+
+
+def solution_message(result):
+    """Сообщение о результате расчёта с длиной маршрута до и после улучшения"""
+    message = f'Маршрут успешно рассчитан! Точек: {len(result["waypoints"])}'
+    if result['improved']:
+        message += (
+            f'. Длина: {result["initial_length"]:.2f} км → {result["length"]:.2f} км '
+            f'(−{result["improvement_percent"]:.1f}%)'
+        )
+    else:
+        message += f'. Длина: {result["length"]:.2f} км'
+    if result.get('cost_source') == 'road':
+        message += ' (по дорогам)'
+    if result.get('optimal'):
+        message += '. Маршрут оптимален'
+    if result.get('cache') == 'exact':
+        message += '. Решение взято из кэша'
+    elif result.get('cache') == 'near':
+        message += f'. Достроен прежний маршрут (изменено точек: {result["changed"]})'
+    if result.get('reused_route'):
+        message += '. Такой маршрут уже сохранён'
+    if result.get('not_found'):
+        message += (
+            f'. Не найдены адреса ({len(result["not_found"])}): '
+            + '; '.join(result['not_found'][:5])
+        )
+    return message
+
+
+def plan_message(result):
+    """Сообщение о результате расчёта плана развоза"""
+    message = (
+        f'План развоза рассчитан! Точек: {result["stops"]}, '
+        f'машин: {result["vehicles_used"]} из {len(result["tours"])}'
+    )
+    if result['improved']:
+        message += (
+            f'. Общая длина: {result["initial_length"]:.2f} км → {result["length"]:.2f} км '
+            f'(−{result["improvement_percent"]:.1f}%)'
+        )
+    else:
+        message += f'. Общая длина: {result["length"]:.2f} км'
+    if result.get('not_found'):
+        message += (
+            f'. Не найдены адреса ({len(result["not_found"])}): '
+            + '; '.join(result['not_found'][:5])
+        )
+    return message
+
+
+class JobQueue:
+    """
+    Локальная очередь фоновых задач расчёта маршрутов
+
+    Задачи хранятся в таблице jobs той же базы SQLite и выполняются в пуле
+    процессов. Рабочие процессы только считают маршрут и отмечают этапы
+    в таблице; результат сохраняет родительский процесс. Незавершённые задачи
+    процессов, которые больше не работают, подхватываются заново при первом
+    запросе после перезапуска. Внешний брокер не нужен.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._resumed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', os.cpu_count() or 1)
+        self.app = app
+        app.extensions['job_queue'] = self
+
+        # Перезапуск задач откладывается до первого запроса, чтобы их не
+        # подхватил, например, процесс-наблюдатель отладочного перезагрузчика
+        app.before_request(self.resume_pending)
+
+    @property
+    def db_path(self):
+        return db.engine.url.database
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['JOB_WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_job_worker,
+                    initargs=(self.app.config['JOB_WORKERS'],)
+                )
+            return self._executor
+
+    def submit(self, kind, payload):
+        """
+        Постановка задачи в очередь
+
+        Возвращает:
+            идентификатор задачи
+        """
+        job = Job(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            status='queued',
+            stage='queued',
+            progress=0.0,
+            payload=json.dumps(payload, ensure_ascii=False),
+            owner=_process_id()
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self._dispatch(job.id, kind, payload)
+        return job.id
+
+    def map(self, func, items, chunksize=None):
+        """
+        Синхронное выполнение func для всех items в пуле процессов задач
+        с сохранением порядка. Элементы передаются рабочим процессам
+        пачками по chunksize (по умолчанию — примерно по четыре пачки на процесс).
+        """
+        if chunksize is None:
+            chunksize = max(1, len(items) // (self.app.config['JOB_WORKERS'] * 4))
+        try:
+            return list(self._get_executor().map(func, items, chunksize=chunksize))
+        except BrokenProcessPool:
+            # Пул пересоздаётся при следующем обращении
+            logger.warning("Пул процессов повреждён, создаётся новый")
+            with self._lock:
+                self._executor = None
+            raise
+
+    def _dispatch(self, job_id, kind, payload):
+        compute = compute_plan if kind == 'plan' else compute_route
+        try:
+            future = self._get_executor().submit(compute, self.db_path, job_id, payload)
+        except BrokenProcessPool:
+            # Рабочий процесс аварийно завершился — пул пересоздаётся
+            logger.warning("Пул процессов повреждён, создаётся новый")
+            with self._lock:
+                self._executor = None
+            future = self._get_executor().submit(compute, self.db_path, job_id, payload)
+        future.add_done_callback(lambda f: self._finish(job_id, payload, f))
+
+    def _finish(self, job_id, payload, future):
+        """Сохранение результата задачи (выполняется в родительском процессе)"""
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            if job is None:
+                return
+
+            try:
+                result = future.result()
+                metrics.merge(result['metrics'])
+
+                job.stage = 'saving'
+                job.progress = STAGES['saving']
+
+                if job.kind == 'plan':
+                    with timer('save_plan'):
+                        plan = Plan.create_with_routes(
+                            payload['name'], result['tours'], result['loads'], payload['vehicles'],
+                            capacity=payload.get('capacity'), closed=payload.get('closed', True)
+                        )
+                        job.plan_id = plan.id
+                        job.message = plan_message(result)
+                else:
+                    with timer('save_route'):
+                        route = None
+                        if result['fingerprint'] is not None:
+                            route = Route.find_saved(payload['name'], result['fingerprint'], result['waypoints'])
+                        if route is None:
+                            route = Route.create_with_waypoints(payload['name'], result['waypoints'])
+                            route.fingerprint = result['fingerprint']
+                        else:
+                            result['reused_route'] = True
+                        job.route_id = route.id
+                        job.message = solution_message(result)
+
+                # Результат и статус задачи фиксируются одной транзакцией
+                job.status = 'done'
+                job.stage = 'done'
+                job.progress = STAGES['done']
+                db.session.commit()
+                metrics.inc('jobs_total', kind=job.kind, status='done')
+
+                stages = ', '.join(f'{stage}={seconds:.3f}' for stage, seconds in result['profile'])
+                if job.kind == 'plan':
+                    logger.info(
+                        f"Задача {job_id}: план, точек={result['stops']}, "
+                        f"машин={result['vehicles_used']} из {len(result['tours'])}, "
+                        f"перемещений={result['moves']}, время={result['elapsed']:.2f} с, "
+                        f"прервано={result['timed_out']}, этапы (с): {stages}, трасса={result['trace']}"
+                    )
+                    return
+                for run in result['runs']:
+                    logger.info(
+                        f"Задача {job_id}: запуск портфеля {run['construction']} (зерно {run['seed']}, "
+                        f"процесс {run['worker']}): {run['initial_length']:.2f} → {run['length']:.2f} км "
+                        f"за {run['elapsed']:.2f} с{', лучший' if run['best'] else ''}"
+                    )
+                logger.info(
+                    f"Задача {job_id}: точек={len(result['waypoints'])}, "
+                    f"стратегия={result['strategy']}, оптимален={result['optimal']}, "
+                    f"кэш решений={result['cache']}, "
+                    f"время={result['elapsed']:.2f} с, прервано={result['timed_out']}, "
+                    f"этапы (с): {stages}, трасса={result['trace']}"
+                )
+
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.message = str(e)
+                db.session.commit()
+                metrics.inc('jobs_total', kind=job.kind, status='failed')
+                logger.warning(f"Задача {job_id} завершилась с ошибкой: {e}")
+
+    def resume_pending(self):
+        """
+        Повторный запуск незавершённых задач, владельцы которых не работают.
+        Выполняется один раз за время жизни процесса.
+        """
+        if self._resumed:
+            return
+        with self._lock:
+            if self._resumed:
+                return
+            self._resumed = True
+
+        me = _process_id()
+        pending = Job.query.filter(Job.status.in_(UNFINISHED_STATUSES)).all()
+        for job in pending:
+            if job.owner == me or _process_alive(job.owner):
+                continue
+
+            # Захват задачи условным UPDATE: при нескольких веб-процессах
+            # задачу подхватит только один из них
+            claimed = Job.query.filter_by(id=job.id, owner=job.owner).update(
+                {'owner': me, 'status': 'queued', 'stage': 'queued', 'progress': 0.0},
+                synchronize_session=False
+            )
+            db.session.commit()
+            if claimed:
+                logger.info(f"Перезапуск задачи {job.id}")
+                self._dispatch(job.id, job.kind, json.loads(job.payload))
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+job_queue = JobQueue()
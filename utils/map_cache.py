@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from utils.metrics import metrics, timer
+
+logger = logging.getLogger(__name__)
+
+# Ограничение общего размера закэшированных карт по умолчанию (байты)
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+CACHE_PREFIX = 'map_'
+CACHE_SUFFIX = '.html'
+
+_KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def map_cache_key(waypoints, route_name, geometry_source, template_version):
+    """
+    Ключ карты: хэш упорядоченных точек, названия маршрута, источника
+    геометрии и версии шаблона карты
+
+    Аргументы:
+        waypoints: точки маршрута в порядке обхода (объекты с address, latitude,
+            longitude или WaypointBuffer)
+        route_name: название маршрута (выводится в заголовке карты)
+        geometry_source: строка, однозначно описывающая геометрию линии
+        template_version: версия оформления карты
+
+    Возвращает:
+        шестнадцатеричная строка SHA-256
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{template_version}\x1e{route_name}\x1e{geometry_source}\x1e'.encode('utf-8'))
+    for wp in waypoints:
+        digest.update(f'{wp.address}\x1f{wp.latitude!r}\x1f{wp.longitude!r}\x1e'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def geometry_fingerprint(geometry):
+    """Короткий хэш геометрии маршрута по дорогам"""
+    return hashlib.sha256(repr(geometry).encode('utf-8')).hexdigest()[:16]
+
+
+class MapCache:
+    """
+    Кэш сгенерированных карт folium в папке карт
+
+    Файл карты называется по хэшу её входных данных, поэтому карта
+    генерируется заново, только когда меняются точки, геометрия или шаблон.
+    Запись атомарна (временный файл + os.replace) — читатель никогда не
+    получит недописанный файл. Время доступа файла отмечает последнее
+    использование: при превышении max_bytes удаляются давно не
+    использовавшиеся карты.
+    """
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.max_bytes = DEFAULT_MAX_BYTES
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAP_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+        self.folder = app.config['MAP_FOLDER']
+        self.max_bytes = app.config['MAP_CACHE_MAX_BYTES']
+        os.makedirs(self.folder, exist_ok=True)
+        app.extensions['map_cache'] = self
+
+    @staticmethod
+    def is_key(key):
+        """Похожа ли строка на ключ кэша (защита от произвольных имён файлов)"""
+        return _KEY_PATTERN.fullmatch(key) is not None
+
+    @staticmethod
+    def filename(key):
+        return f'{CACHE_PREFIX}{key}{CACHE_SUFFIX}'
+
+    def path(self, key):
+        return os.path.join(self.folder, self.filename(key))
+
+    def get_or_create(self, key, render):
+        """
+        Имя файла карты с ключом key; при отсутствии карта создаётся вызовом
+        render(), который возвращает объект карты folium
+
+        Возвращает:
+            имя файла в папке карт
+        """
+        path = self.path(key)
+        if self.touch(key):
+            metrics.inc('cache_requests_total', cache='maps', result='hit')
+            return self.filename(key)
+        metrics.inc('cache_requests_total', cache='maps', result='miss')
+
+        # Одну и ту же карту в процессе генерирует только один поток
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if not os.path.exists(path):
+                map_obj = render()
+                # HTML карты folium формирует при сохранении
+                with timer('map_render'):
+                    self._write(path, map_obj)
+                self._evict()
+        with self._lock:
+            self._key_locks.pop(key, None)
+
+        return self.filename(key)
+
+    def touch(self, key):
+        """Отметка использования карты; False, если карты нет в кэше"""
+        path = self.path(key)
+        try:
+            # Время изменения сохраняется: это момент создания карты (Last-Modified)
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _write(self, path, map_obj):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.tmp_', suffix=CACHE_SUFFIX)
+        os.close(fd)
+        try:
+            map_obj.save(tmp_path)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self):
+        """Удаление давно не использовавшихся карт сверх max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not (entry.name.startswith(CACHE_PREFIX) and entry.name.endswith(CACHE_SUFFIX)):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        # Самая свежая карта (только что созданная) не удаляется
+        for _, size, path in entries[:-1]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug(f"Карта удалена из кэша: {path}")
+            if total <= self.max_bytes:
+                break
+
+
+map_cache = MapCache()
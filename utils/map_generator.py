@@ -1,16 +1,72 @@
 import folium
-from folium.plugins import AntPath
-from typing import List, Optional
+from folium.plugins import AntPath, FastMarkerCluster
+from html import escape
+from itertools import islice
+from typing import Iterable, List, Optional, Tuple
 import logging
 
+import numpy as np
+
+from algorithms.simplify import simplify_path
+from utils.metrics import timed
+
 logger = logging.getLogger(__name__)
 
+# Версия оформления карты: увеличивается при любом изменении отрисовки,
+# чтобы закэшированные карты построились заново
+MAP_TEMPLATE_VERSION = 2
+
+# С этого числа точек карта строится в облегчённом режиме
+LARGE_ROUTE_THRESHOLD = 200
+
+# Допустимое отклонение упрощённой линии маршрута (км)
+SIMPLIFY_TOLERANCE_KM = 0.005
+
+# Знаков после запятой в координатах облегчённой карты (~0,1 м)
+COORD_PRECISION = 6
+
+# Сглаживание линии в Leaflet: на каждом масштабе линия дополнительно
+# упрощается в браузере (в пикселях)
+LINE_SMOOTH_FACTOR = 1.5
+
+# Отрисовка точки в облегчённом режиме (кружок на canvas с подсказкой)
+_CLUSTER_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 5, color: 'blue', fillOpacity: 0.8, weight: 1
+    });
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
+
+# Цвета маршрутов машин на карте плана (по кругу)
+PLAN_COLORS = (
+    'blue', 'red', 'green', 'purple', 'orange', 'darkred', 'cadetblue',
+    'darkgreen', 'darkblue', 'black', 'deeppink', 'saddlebrown',
+)
+
+# Точка плана: кружок цвета своей машины с подсказкой
+_PLAN_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 5, color: row[3], fillOpacity: 0.8, weight: 1
+    });
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
 
+
+@timed('map_build')
 def create_route_map(waypoints: List, route_name: str, yandex_geometry: Optional[List] = None):
     """Создание интерактивной карты маршрута
 
+    Маршруты длиннее LARGE_ROUTE_THRESHOLD точек строятся облегчённой
+    картой (create_large_route_map).
+
     Args:
-        waypoints: список точек маршрута
+        waypoints: точки маршрута (объекты Waypoint или WaypointBuffer)
         route_name: название маршрута
         yandex_geometry: геометрия маршрута от Яндекс API (если есть)
 
@@ -20,6 +76,9 @@ def create_route_map(waypoints: List, route_name: str, yandex_geometry: Optional
     if not waypoints:
         raise ValueError("Список точек не может быть пустым")
 
+    if len(waypoints) > LARGE_ROUTE_THRESHOLD:
+        return create_large_route_map(waypoints, route_name, yandex_geometry)
+
     # Центрируем карту на первой точке
     start_lat = waypoints[0].latitude
     start_lon = waypoints[0].longitude
@@ -35,13 +94,9 @@ def create_route_map(waypoints: List, route_name: str, yandex_geometry: Optional
     if yandex_geometry:
         logger.debug(f"Отрисовка маршрута по дорогам, {len(yandex_geometry)} точек")
 
-        # Преобразуем геометрию в формат [широта, долгота]
-        # Яндекс возвращает массив точек в формате {"lat": ..., "lon": ...}
-        if isinstance(yandex_geometry[0], dict):
-            route_coords = [[point["lat"], point["lon"]] for point in yandex_geometry]
-        else:
-            # Если уже в правильном формате
-            route_coords = yandex_geometry
+        route_coords = _geometry_coords(yandex_geometry)
+        if len(route_coords) > LARGE_ROUTE_THRESHOLD:
+            route_coords = _simplify_coords(route_coords)
 
         # Рисуем линию маршрута по дорогам (синяя)
         folium.PolyLine(
@@ -115,6 +170,190 @@ def create_route_map(waypoints: List, route_name: str, yandex_geometry: Optional
                 pulse_color='darkorange'
             ).add_to(m)
 
+    _add_title_and_legend(m, route_name, yandex_geometry)
+
+    return m
+
+
+def create_large_route_map(waypoints: List, route_name: str, yandex_geometry: Optional[List] = None):
+    """Облегчённая карта для маршрутов из тысяч точек
+
+    Промежуточные точки рисуются кружками на canvas и группируются в кластеры
+    (данные передаются в браузер компактным массивом, без HTML на каждую
+    точку), маршрут — одной линией, упрощённой алгоритмом Дугласа — Пекера;
+    при смене масштаба Leaflet дополнительно упрощает её сам.
+
+    Args:
+        waypoints: точки маршрута (объекты Waypoint или WaypointBuffer)
+        route_name: название маршрута
+        yandex_geometry: геометрия маршрута от Яндекс API (если есть)
+
+    Returns:
+        Объект карты folium
+    """
+    logger.debug(f"Облегчённая отрисовка маршрута из {len(waypoints)} точек")
+
+    m = folium.Map(tiles='OpenStreetMap', prefer_canvas=True)
+
+    latitudes, longitudes, addresses = _columns(waypoints)
+
+    if yandex_geometry:
+        route_coords = _simplify_coords(_geometry_coords(yandex_geometry))
+        color, dash_array, tooltip = 'blue', None, '🛣️ Маршрут по дорогам'
+    else:
+        route_coords = _simplify_coords(np.column_stack((latitudes, longitudes)))
+        color, dash_array, tooltip = 'orange', '5, 5', '📏 Птичий полёт'
+
+    folium.PolyLine(
+        locations=route_coords,
+        color=color,
+        weight=3,
+        opacity=0.8,
+        dash_array=dash_array,
+        smooth_factor=LINE_SMOOTH_FACTOR,
+        tooltip=tooltip
+    ).add_to(m)
+
+    # Промежуточные точки — кластером; подсказка: номер и адрес
+    last = len(waypoints) - 1
+    FastMarkerCluster(
+        data=[
+            [round(lat, COORD_PRECISION), round(lon, COORD_PRECISION), f'{idx + 1}: {escape(address)}']
+            for idx, (lat, lon, address) in enumerate(
+                zip(latitudes[1:last].tolist(), longitudes[1:last].tolist(), islice(addresses, 1, last)),
+                start=1
+            )
+        ],
+        callback=_CLUSTER_MARKER_CALLBACK,
+        name='Точки маршрута'
+    ).add_to(m)
+
+    # Старт и финиш — обычными маркерами
+    for idx, color, icon, label in ((0, 'green', 'play', 'Старт'), (last, 'red', 'flag', 'Финиш')):
+        wp = waypoints[idx]
+        folium.Marker(
+            location=[wp.latitude, wp.longitude],
+            popup=folium.Popup(f'<b>{label}</b><br>Точка {idx + 1}<br>Адрес: {escape(wp.address)}', max_width=300),
+            tooltip=f'{label}: {escape(wp.address)}',
+            icon=folium.Icon(color=color, icon=icon, prefix='glyphicon')
+        ).add_to(m)
+
+    m.fit_bounds([
+        [float(latitudes.min()), float(longitudes.min())],
+        [float(latitudes.max()), float(longitudes.max())]
+    ])
+
+    _add_title_and_legend(m, route_name, yandex_geometry)
+
+    return m
+
+
+@timed('map_build')
+def create_plan_map(tours: List, plan_name: str):
+    """Общая карта плана развоза: маршруты всех машин своими цветами
+
+    Маршрут каждой машины — упрощённой линией, точки — кружками на canvas,
+    сгруппированными в кластеры (как в create_large_route_map), склад —
+    обычным маркером.
+
+    Args:
+        tours: точки маршрутов машин (списки объектов Waypoint или
+            WaypointBuffer), у каждого склад — первая точка
+        plan_name: название плана
+
+    Returns:
+        Объект карты folium
+    """
+    tours = [tour for tour in tours if len(tour)]
+    if not tours:
+        raise ValueError("В плане нет маршрутов")
+
+    m = folium.Map(tiles='OpenStreetMap', prefer_canvas=True)
+
+    points = []
+    bounds = []
+    for vehicle, tour in enumerate(tours):
+        color = PLAN_COLORS[vehicle % len(PLAN_COLORS)]
+        latitudes, longitudes, addresses = _columns(tour)
+        if len(tour) > 1:
+            folium.PolyLine(
+                locations=_simplify_coords(np.column_stack((latitudes, longitudes))),
+                color=color,
+                weight=3,
+                opacity=0.8,
+                smooth_factor=LINE_SMOOTH_FACTOR,
+                tooltip=f'Машина {vehicle + 1}'
+            ).add_to(m)
+
+        # Склад рисуется отдельно, на маршруте — только точки доставки
+        for idx, (lat, lon, address) in enumerate(
+            zip(latitudes.tolist(), longitudes.tolist(), addresses)
+        ):
+            if idx == 0 or (idx == len(tour) - 1 and lat == latitudes[0] and lon == longitudes[0]):
+                continue
+            points.append([
+                round(lat, COORD_PRECISION), round(lon, COORD_PRECISION),
+                f'Машина {vehicle + 1}, точка {idx + 1}: {escape(address)}', color
+            ])
+        bounds.append((latitudes.min(), longitudes.min(), latitudes.max(), longitudes.max()))
+
+    FastMarkerCluster(data=points, callback=_PLAN_MARKER_CALLBACK, name='Точки доставки').add_to(m)
+
+    depot = tours[0][0]
+    folium.Marker(
+        location=[depot.latitude, depot.longitude],
+        popup=folium.Popup(f'<b>Склад</b><br>Адрес: {escape(depot.address)}', max_width=300),
+        tooltip=f'Склад: {escape(depot.address)}',
+        icon=folium.Icon(color='green', icon='home', prefix='glyphicon')
+    ).add_to(m)
+
+    bounds = np.array(bounds, dtype=np.float64)
+    m.fit_bounds([
+        [float(bounds[:, 0].min()), float(bounds[:, 1].min())],
+        [float(bounds[:, 2].max()), float(bounds[:, 3].max())]
+    ])
+
+    title_html = f'''
+        <h3 align="center" style="font-size:20px">
+            <b>{escape(plan_name)}</b> 🚚 Машин: {len(tours)}
+        </h3>
+    '''
+    m.get_root().html.add_child(folium.Element(title_html))
+
+    return m
+
+
+def _columns(waypoints) -> Tuple[np.ndarray, np.ndarray, Iterable[str]]:
+    """Широты, долготы и адреса точек; у WaypointBuffer — его колонки без копирования"""
+    if hasattr(waypoints, 'coordinates'):
+        latitudes, longitudes = waypoints.coordinates()
+        return latitudes, longitudes, waypoints.addresses
+    return (
+        np.fromiter((wp.latitude for wp in waypoints), dtype=np.float64, count=len(waypoints)),
+        np.fromiter((wp.longitude for wp in waypoints), dtype=np.float64, count=len(waypoints)),
+        [wp.address for wp in waypoints]
+    )
+
+
+def _geometry_coords(yandex_geometry: List) -> List:
+    """Геометрия маршрута в формате [широта, долгота]"""
+    # Яндекс возвращает массив точек в формате {"lat": ..., "lon": ...}
+    if isinstance(yandex_geometry[0], dict):
+        return [[point["lat"], point["lon"]] for point in yandex_geometry]
+    # Если уже в правильном формате
+    return yandex_geometry
+
+
+def _simplify_coords(route_coords: List) -> List:
+    """Упрощение линии маршрута алгоритмом Дугласа — Пекера"""
+    coords = np.asarray(route_coords, dtype=np.float64)
+    keep = simplify_path(coords[:, 0], coords[:, 1], SIMPLIFY_TOLERANCE_KM)
+    logger.debug(f"Линия маршрута упрощена: {len(coords)} → {len(keep)} вершин")
+    return np.round(coords[keep], COORD_PRECISION).tolist()
+
+
+def _add_title_and_legend(m, route_name: str, yandex_geometry: Optional[List]):
+    """Заголовок и легенда карты"""
     # Добавляем заголовок карты
     title_html = f'''
         <h3 align="center" style="font-size:20px">
@@ -140,6 +379,4 @@ def create_route_map(waypoints: List, route_name: str, yandex_geometry: Optional
     <p><span style="color:orange">- - -</span> Маршрут по прямой</p>
     </div>
     '''
-    m.get_root().html.add_child(folium.Element(legend_html))
-
-    return m
\ No newline at end of file
+    m.get_root().html.add_child(folium.Element(legend_html))
\ No newline at end of file
@@ -0,0 +1,232 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Префикс имён метрик в формате Prometheus
+METRIC_PREFIX = 'route_planner_'
+
+# Границы корзин гистограмм длительности, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Описания метрик для /metrics
+METRIC_HELP = {
+    'stage_seconds': 'Длительность этапов обработки маршрута, секунды',
+    'http_request_seconds': 'Длительность обработки HTTP-запросов, секунды',
+    'http_requests_total': 'Число HTTP-запросов по обработчику и статусу',
+    'external_request_seconds': 'Длительность запросов к внешним API (с повторами), секунды',
+    'external_requests_total': 'Число запросов к внешним API по результату',
+    'external_retries_total': 'Число повторов запросов к внешним API',
+    'external_error_ratio': 'Доля неудачных запросов к внешним API',
+    'cache_requests_total': 'Число обращений к кэшам по результату (hit, stale, near, miss)',
+    'cache_hit_ratio': 'Доля обращений к кэшу, обслуженных из кэша (hit и stale)',
+    'csv_rows_total': 'Число строк CSV по результату проверки',
+    'jobs_total': 'Число завершённых фоновых задач по виду и статусу',
+    'portfolio_runs_total': 'Число запусков портфеля по построению и результату (win — лучший маршрут)',
+}
+
+# Этапы текущего запроса (если включено профилирование): список (этап, секунды)
+_profile = ContextVar('metrics_profile', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Счётчики и гистограммы процесса с выводом в текстовом формате Prometheus
+
+    Метрики рабочих процессов очереди задач забираются drain() в конце
+    задачи и добавляются в реестр веб-процесса merge().
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """Увеличение счётчика name с метками labels"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Наблюдение value в гистограмме name с метками labels"""
+        key = (name, _label_key(labels))
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Число наблюдений по корзинам (последняя — +Inf), сумма, количество
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def drain(self):
+        """Снимок всех метрик (для передачи между процессами) с обнулением реестра"""
+        with self._lock:
+            data = {
+                'counters': list(self._counters.items()),
+                'histograms': list(self._histograms.items()),
+            }
+            self._counters = {}
+            self._histograms = {}
+        return data
+
+    def merge(self, data):
+        """Добавление снимка drain() другого процесса"""
+        with self._lock:
+            for key, value in data['counters']:
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (counts, total, count) in data['histograms']:
+                histogram = self._histograms.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+                histogram[2] += count
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus (версия 0.0.4)"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f'# HELP {METRIC_PREFIX}{name} {METRIC_HELP[name]}')
+                lines.append(f'# TYPE {METRIC_PREFIX}{name} {kind}')
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f'{METRIC_PREFIX}{name}{_format_labels(labels)} {_format_number(value)}')
+
+        for (name, labels), (counts, total, count) in histograms:
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else _format_number(bound)
+                lines.append(
+                    f'{METRIC_PREFIX}{name}_bucket{_format_labels(labels, [("le", le)])} {cumulative}'
+                )
+            lines.append(f'{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {total!r}')
+            lines.append(f'{METRIC_PREFIX}{name}_count{_format_labels(labels)} {count}')
+
+        for name, values in self._ratios(counters):
+            if values:
+                declare(name, 'gauge')
+            for labels, value in values:
+                lines.append(f'{METRIC_PREFIX}{name}{_format_labels(labels)} {value!r}')
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _ratios(counters):
+        """Производные доли: попадания в кэши и ошибки внешних API"""
+        def ratio(counter, group_label, result_label, good):
+            totals, hits = {}, {}
+            for (name, labels), value in counters:
+                if name != counter:
+                    continue
+                labels = dict(labels)
+                group = ((group_label, labels.get(group_label, '')),)
+                totals[group] = totals.get(group, 0) + value
+                if labels.get(result_label) in good:
+                    hits[group] = hits.get(group, 0) + value
+            return [(group, hits.get(group, 0) / total) for group, total in sorted(totals.items()) if total]
+
+        return [
+            ('cache_hit_ratio', ratio('cache_requests_total', 'cache', 'result', ('hit', 'stale'))),
+            ('external_error_ratio', ratio('external_requests_total', 'service', 'outcome', ('error',))),
+        ]
+
+
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def timer(stage):
+    """Замер этапа: гистограмма stage_seconds и профиль текущего запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('stage_seconds', elapsed, stage=stage)
+        profile = _profile.get()
+        if profile is not None:
+            profile.append((stage, elapsed))
+
+
+def timed(stage):
+    """Декоратор: замер каждого вызова функции как этапа stage"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_profile():
+    """
+    Включение сбора этапов в текущем контексте (запрос, задача)
+
+    Возвращает:
+        токен для finish_profile
+    """
+    return _profile.set([])
+
+
+def finish_profile(token):
+    """
+    Завершение сбора этапов
+
+    Возвращает:
+        список (этап, секунды) в порядке завершения этапов
+    """
+    profile = _profile.get()
+    _profile.reset(token)
+    return profile or []
+
+
+def server_timing(profile, total=None):
+    """
+    Значение заголовка Server-Timing: суммарная длительность каждого этапа
+    в миллисекундах (повторяющиеся этапы складываются)
+    """
+    durations = {}
+    for stage, seconds in profile:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in durations.items()]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
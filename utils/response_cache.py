@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию: срок свежести, окно выдачи устаревших данных
+# (stale-while-revalidate) и ограничение размера кэша
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_STALE_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+# Число ключей в одном запросе get_many (ограничение параметров SQLite)
+_BATCH_SIZE = 500
+
+
+def cache_key(*parts):
+    """Ключ кэша: SHA-256 от JSON-представления частей ключа"""
+    raw = json.dumps(parts, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    """Выполняющийся запрос, результата которого ждут остальные потоки"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class PersistentCache:
+    """
+    Постоянный кэш ответов внешних сервисов в отдельном файле SQLite
+
+    Значения хранятся в JSON. Запись свежая ttl секунд, после этого ещё
+    stale_ttl секунд она отдаётся сразу, а обновляется в фоне
+    (stale-while-revalidate). Одинаковые одновременные запросы в процессе
+    выполняются один раз (single-flight). При превышении max_bytes удаляются
+    давно не использовавшиеся записи. Если обновить запись не удалось,
+    отдаётся последнее известное значение, даже устаревшее.
+    """
+
+    def __init__(self, path, table='cache', ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._initialized = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL)'
+            )
+            connection.execute(
+                f'CREATE INDEX IF NOT EXISTS ix_{self.table}_accessed ON {self.table} (accessed_at)'
+            )
+            connection.commit()
+            self._initialized = True
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def get(self, key):
+        """
+        Значение из кэша
+
+        Возвращает:
+            (значение, возраст записи в секундах) или None, если записи нет
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                f'SELECT value, created_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+            connection.commit()
+        finally:
+            connection.close()
+        return json.loads(row[0]), now - row[1]
+
+    def set(self, key, value):
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, raw, now, now, len(raw))
+            )
+            self._evict(connection)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def get_many(self, keys, max_age=None):
+        """
+        Несколько значений одним проходом
+
+        Аргументы:
+            keys: ключи
+            max_age: наибольший возраст записи в секундах (по умолчанию — ttl)
+
+        Возвращает:
+            словарь {ключ: значение} для найденных достаточно свежих записей
+        """
+        max_age = self.ttl if max_age is None else max_age
+        now = time.time()
+        found = {}
+        keys = list(keys)
+        connection = self._connect()
+        try:
+            for start in range(0, len(keys), _BATCH_SIZE):
+                batch = keys[start:start + _BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = connection.execute(
+                    f'SELECT key, value FROM {self.table} '
+                    f'WHERE key IN ({placeholders}) AND created_at >= ?',
+                    (*batch, now - max_age)
+                ).fetchall()
+                if rows:
+                    connection.executemany(
+                        f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?',
+                        [(now, key) for key, _ in rows]
+                    )
+                found.update((key, json.loads(value)) for key, value in rows)
+            connection.commit()
+        finally:
+            connection.close()
+        metrics.inc('cache_requests_total', len(found), cache=self.table, result='hit')
+        metrics.inc('cache_requests_total', len(keys) - len(found), cache=self.table, result='miss')
+        return found
+
+    def set_many(self, items):
+        """Сохранение словаря {ключ: значение} одной транзакцией"""
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            raw = json.dumps(value, ensure_ascii=False)
+            rows.append((key, raw, now, now, len(raw)))
+        if not rows:
+            return
+        connection = self._connect()
+        try:
+            connection.executemany(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at, size) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            self._evict(connection)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def clear(self):
+        """Удаление всех записей"""
+        connection = self._connect()
+        try:
+            connection.execute(f'DELETE FROM {self.table}')
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _evict(self, connection):
+        """Удаление давно не использовавшихся записей сверх max_bytes"""
+        total = connection.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table}').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        removed = 0
+        rows = connection.execute(
+            f'SELECT key, size FROM {self.table} ORDER BY accessed_at'
+        ).fetchall()
+        # Самая свежая запись (только что добавленная) не удаляется
+        for key, size in rows[:-1]:
+            connection.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+            total -= size
+            removed += 1
+            if total <= self.max_bytes:
+                break
+        logger.debug(f"Из кэша {self.table} удалено записей: {removed}")
+
+    def get_or_compute(self, key, compute):
+        """
+        Значение из кэша или результат compute(), который сохраняется в кэш.
+        Результат None (ошибка) не кэшируется.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            value, age = cached
+            if age <= self.ttl:
+                metrics.inc('cache_requests_total', cache=self.table, result='hit')
+                return value
+            if age <= self.ttl + self.stale_ttl:
+                # Устаревшее значение отдаётся сразу, обновление — в фоне
+                metrics.inc('cache_requests_total', cache=self.table, result='stale')
+                self._start_flight(key, compute, background=True)
+                return value
+
+        metrics.inc('cache_requests_total', cache=self.table, result='miss')
+        result = self._start_flight(key, compute)
+        if result is None and cached is not None:
+            logger.warning("Не удалось обновить запись кэша, используется устаревшее значение")
+            return cached[0]
+        return result
+
+    def _start_flight(self, key, compute, background=False):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if background:
+                return None
+            flight.done.wait()
+            return flight.value
+
+        if background:
+            threading.Thread(target=self._run_flight, args=(key, compute, flight), daemon=True).start()
+            return None
+        return self._run_flight(key, compute, flight)
+
+    def _run_flight(self, key, compute, flight):
+        try:
+            flight.value = compute()
+            if flight.value is not None:
+                self.set(key, flight.value)
+        except Exception as e:
+            logger.error(f"Ошибка обновления записи кэша: {e}")
+            flight.value = None
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.value
@@ -0,0 +1,347 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from utils.metrics import metrics
+from utils.response_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+# Координаты округляются до 5 знаков (около метра): точки, различающиеся
+# меньше, считаются одной и той же точкой
+COORDINATE_DECIMALS = 5
+
+# Размер эскиза набора точек: столько наименьших хэшей точек индексируется
+# для поиска похожих наборов
+SKETCH_SIZE = 32
+
+# Наибольшая доля изменённых точек (удалённых и новых), при которой прежнее
+# решение достраивается, а не решается заново
+NEAR_MATCH_SHARE = 0.2
+
+# Сколько наборов с самыми похожими эскизами сравнивается точно
+NEAR_CANDIDATES = 3
+
+# Ограничение размера кэша по умолчанию
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+# Примерный размер строки эскиза в базе (хэш, отпечаток, индексы), байт
+_SKETCH_ROW_BYTES = 160
+
+# Колонки таблицы solutions, добавленные после её появления: в уже
+# существующий файл кэша они добавляются при первом подключении
+_ADDED_COLUMNS = {
+    # Решение завершено, а не остановлено по ограничению времени; у записей
+    # старого формата это неизвестно, поэтому они считаются незавершёнными
+    'final': 'INTEGER NOT NULL DEFAULT 0',
+    # Оптимальность маршрута доказана (стратегия exact)
+    'optimal': 'INTEGER NOT NULL DEFAULT 0',
+}
+
+
+def point_keys(latitudes, longitudes):
+    """
+    Ключи точек: округлённые до COORDINATE_DECIMALS знаков координаты,
+    упакованные в одно целое число
+
+    Возвращает:
+        массив int64 длины len(latitudes)
+    """
+    scale = 10 ** COORDINATE_DECIMALS
+    lat = np.rint((np.asarray(latitudes, dtype=np.float64) + 90) * scale).astype(np.int64)
+    lon = np.rint((np.asarray(longitudes, dtype=np.float64) + 180) * scale).astype(np.int64)
+    return lat * (360 * scale + 1) + lon
+
+
+def _sketch(keys):
+    """
+    Эскиз набора точек: SKETCH_SIZE наименьших хэшей ключей (bottom-k).
+    Хэш (splitmix64) перемешивает биты, чтобы наименьшие значения не
+    зависели от расположения точек.
+    """
+    x = np.unique(keys).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x = x ^ (x >> np.uint64(31))
+    # В SQLite целые знаковые — хэши хранятся как int64
+    return np.sort(x)[:SKETCH_SIZE].view(np.int64)
+
+
+def _occurrences(keys):
+    """Номер каждого ключа среди равных ему (точки с одинаковыми координатами)"""
+    order = np.argsort(keys, kind='stable')
+    ordered = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+    counts = np.diff(np.append(starts, len(keys)))
+    occurrences = np.empty(len(keys), dtype=np.int64)
+    occurrences[order] = np.arange(len(keys)) - np.repeat(starts, counts)
+    return occurrences
+
+
+def _match_tour(tour, keys):
+    """
+    Сопоставление сохранённого маршрута (ключи точек в порядке обхода)
+    с новым набором точек
+
+    Точки с одинаковыми координатами сопоставляются по порядку появления,
+    поэтому начало маршрута (первая точка обоих наборов, ключи совпадают)
+    становится точкой 0.
+
+    Возвращает:
+        (порядок обхода — индексы точек keys, -1 на месте точек, которых в
+        новом наборе нет; число удалённых и новых точек)
+    """
+    m = len(tour)
+    pairs = np.column_stack((
+        np.concatenate((tour, keys)),
+        np.concatenate((_occurrences(tour), _occurrences(keys))),
+    ))
+    _, inverse = np.unique(pairs, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    index = np.full(int(inverse.max()) + 1, -1, dtype=np.int64)
+    index[inverse[m:]] = np.arange(len(keys))
+    order = index[inverse[:m]]
+    matched = int(np.count_nonzero(order >= 0))
+    return order, (m - matched) + (len(keys) - matched)
+
+
+@dataclass
+class SolutionLookup:
+    """Результат поиска набора точек в кэше решений"""
+    fingerprint: str  # Отпечаток набора точек и параметров решения
+    scope: str  # Параметры решения и начальная точка: похожие наборы ищутся с теми же
+    keys: np.ndarray  # Ключи точек в исходном порядке
+    kind: str = 'miss'  # exact — тот же набор, near — похожий, miss — не найден
+    order: Optional[np.ndarray] = None  # Порядок обхода; для near — -1 на месте удалённых точек
+    length: Optional[float] = None  # Длина сохранённого маршрута (для exact)
+    changed: int = 0  # Число удалённых и новых точек (для near)
+    optimal: bool = False  # Оптимальность сохранённого маршрута доказана (для exact)
+
+
+class SolutionCache:
+    """
+    Кэш решений задачи коммивояжёра в отдельном файле SQLite
+
+    Ключ — отпечаток набора точек: округлённые координаты без учёта порядка
+    строк и адресов, начальная точка и параметры решения. Для поиска похожих
+    наборов (те же точки с небольшими изменениями) хранится эскиз — наименьшие
+    хэши точек: у наборов, различающихся немногими точками, эскизы почти
+    совпадают. При превышении max_bytes удаляются давно не использовавшиеся
+    решения, а освободившиеся страницы файла возвращаются системе.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, near_share=NEAR_MATCH_SHARE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.near_share = near_share
+        self._initialized = False
+
+    @property
+    def enabled(self):
+        """Кэш выключен нулевым ограничением размера"""
+        return self.max_bytes > 0
+
+    def _connect(self):
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            # auto_vacuum действует, только если задан до создания таблиц
+            connection.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS solutions ('
+                'fingerprint TEXT PRIMARY KEY, scope TEXT NOT NULL, size INTEGER NOT NULL, '
+                'tour BLOB NOT NULL, length REAL NOT NULL, created_at REAL NOT NULL, '
+                'accessed_at REAL NOT NULL, bytes INTEGER NOT NULL)'
+            )
+            existing = {row[1] for row in connection.execute('PRAGMA table_info(solutions)')}
+            for column, definition in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE solutions ADD COLUMN {column} {definition}')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_solutions_accessed ON solutions (accessed_at)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS solution_sketches (hash INTEGER NOT NULL, fingerprint TEXT NOT NULL)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS ix_solution_sketches_hash ON solution_sketches (hash)'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS ix_solution_sketches_fingerprint ON solution_sketches (fingerprint)'
+            )
+            connection.commit()
+            self._initialized = True
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def lookup(self, latitudes, longitudes, options, near=True):
+        """
+        Поиск решения для набора точек
+
+        Решение, остановленное по ограничению времени, точным совпадением
+        не считается: с near оно возвращается как похожий набор без изменений
+        (маршрут улучшается дальше), без near — не возвращается.
+
+        Аргументы:
+            latitudes, longitudes: координаты точек; первая — начало маршрута
+            options: параметры решения (словарь), влияющие на маршрут
+            near: искать ли похожий набор, если точного совпадения нет
+
+        Возвращает:
+            SolutionLookup; его же передают в store после решения
+        """
+        keys = point_keys(latitudes, longitudes)
+        scope = cache_key(options, int(keys[0]))
+        fingerprint = cache_key(scope, hashlib.sha256(np.sort(keys).tobytes()).hexdigest())
+        result = SolutionLookup(fingerprint=fingerprint, scope=scope, keys=keys)
+
+        now = time.time()
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT tour, length, final, optimal FROM solutions WHERE fingerprint = ?', (fingerprint,)
+            ).fetchone()
+            if row is not None and (row[2] or near):
+                result.kind = 'exact' if row[2] else 'near'
+                result.order, _ = _match_tour(np.frombuffer(row[0], dtype=np.int64), keys)
+                result.length = row[1]
+                result.optimal = bool(row[2] and row[3])
+                touched = fingerprint
+            elif near:
+                touched = self._find_near(connection, result)
+            else:
+                touched = None
+
+            if touched is not None:
+                connection.execute(
+                    'UPDATE solutions SET accessed_at = ? WHERE fingerprint = ?', (now, touched)
+                )
+                connection.commit()
+        finally:
+            connection.close()
+
+        metrics.inc('cache_requests_total', cache='solutions',
+                    result={'exact': 'hit', 'near': 'near', 'miss': 'miss'}[result.kind])
+        return result
+
+    def _find_near(self, connection, result):
+        """
+        Похожий набор точек: кандидаты — наборы с наибольшим числом общих
+        значений эскиза, из них выбирается набор с наименьшим числом изменений
+
+        Возвращает:
+            отпечаток найденного набора или None
+        """
+        n = len(result.keys)
+        allowed = int(self.near_share * n)
+        if not allowed:
+            return None
+        sketch = _sketch(result.keys).tolist()
+        placeholders = ','.join('?' * len(sketch))
+        rows = connection.execute(
+            'SELECT s.fingerprint, t.tour FROM solution_sketches s '
+            'JOIN solutions t ON t.fingerprint = s.fingerprint '
+            f'WHERE s.hash IN ({placeholders}) AND t.scope = ? AND t.size BETWEEN ? AND ? '
+            'GROUP BY s.fingerprint ORDER BY COUNT(*) DESC LIMIT ?',
+            (*sketch, result.scope, n - allowed, n + allowed, NEAR_CANDIDATES)
+        ).fetchall()
+
+        best = None
+        for fingerprint, tour in rows:
+            order, changed = _match_tour(np.frombuffer(tour, dtype=np.int64), result.keys)
+            if changed <= allowed and (best is None or changed < best[2]):
+                best = (fingerprint, order, changed)
+        if best is None:
+            return None
+
+        result.kind = 'near'
+        _, result.order, result.changed = best
+        return best[0]
+
+    def store(self, lookup, order, length, final=True, optimal=False):
+        """
+        Сохранение решения набора точек
+
+        Аргументы:
+            lookup: результат lookup для этого набора
+            order: порядок обхода (индексы точек)
+            length: длина маршрута
+            final: решение завершено (не остановлено по ограничению времени)
+            optimal: оптимальность маршрута доказана
+        """
+        tour = lookup.keys[np.asarray(order, dtype=np.int64)].tobytes()
+        sketch = _sketch(lookup.keys).tolist()
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO solutions '
+                '(fingerprint, scope, size, tour, length, created_at, accessed_at, bytes, final, optimal) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (lookup.fingerprint, lookup.scope, len(lookup.keys), tour, float(length), now, now,
+                 len(tour) + len(sketch) * _SKETCH_ROW_BYTES, int(final), int(optimal))
+            )
+            connection.execute('DELETE FROM solution_sketches WHERE fingerprint = ?', (lookup.fingerprint,))
+            connection.executemany(
+                'INSERT INTO solution_sketches (hash, fingerprint) VALUES (?, ?)',
+                [(value, lookup.fingerprint) for value in sketch]
+            )
+            removed = self._evict(connection)
+            connection.commit()
+            if removed:
+                connection.execute('PRAGMA incremental_vacuum')
+        finally:
+            connection.close()
+
+    def clear(self):
+        """Удаление всех решений"""
+        connection = self._connect()
+        try:
+            connection.execute('DELETE FROM solution_sketches')
+            connection.execute('DELETE FROM solutions')
+            connection.commit()
+            connection.execute('PRAGMA incremental_vacuum')
+        finally:
+            connection.close()
+
+    def _evict(self, connection):
+        """
+        Удаление давно не использовавшихся решений сверх max_bytes
+
+        Возвращает:
+            число удалённых решений
+        """
+        total = connection.execute('SELECT COALESCE(SUM(bytes), 0) FROM solutions').fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        rows = connection.execute('SELECT fingerprint, bytes FROM solutions ORDER BY accessed_at').fetchall()
+        # Самое свежее решение (только что добавленное) не удаляется
+        for fingerprint, size in rows[:-1]:
+            connection.execute('DELETE FROM solution_sketches WHERE fingerprint = ?', (fingerprint,))
+            connection.execute('DELETE FROM solutions WHERE fingerprint = ?', (fingerprint,))
+            total -= size
+            removed += 1
+            if total <= self.max_bytes:
+                break
+        logger.debug(f"Из кэша решений удалено записей: {removed}")
+        return removed
+
+
+# Общий кэш решений: используется рабочими процессами очереди задач
+solution_cache = SolutionCache(
+    os.getenv('SOLUTION_CACHE_PATH', os.path.join('instance', 'solution_cache.db')),
+    max_bytes=int(os.getenv('SOLUTION_CACHE_MAX_MB', 100)) * 1024 * 1024
+)
@@ -0,0 +1,231 @@
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+# Точка буфера при поэлементном обходе: те же поля, что у модели Waypoint,
+# поэтому буфер можно передавать в код, работающий с точками из БД (карта,
+# ключ кэша карты)
+WaypointRecord = namedtuple('WaypointRecord', ['address', 'latitude', 'longitude'])
+
+
+class PackedStrings:
+    """
+    Упакованный столбец строк: все строки в одном буфере UTF-8 и массив
+    смещений их концов
+
+    На строку тратится её длина в UTF-8 и 8 байт смещения — без отдельного
+    объекта str (около 50–80 байт заголовка) и указателя в списке. Строки
+    создаются заново только при чтении.
+    """
+
+    def __init__(self, strings=()):
+        self._data = bytearray()
+        self._ends = array('q')
+        self.extend(strings)
+
+    def __len__(self):
+        return len(self._ends)
+
+    def _bounds(self, idx):
+        start = self._ends[idx - 1] if idx > 0 else 0
+        return start, self._ends[idx]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Индекс строки вне диапазона')
+        start, end = self._bounds(idx)
+        return self._data[start:end].decode('utf-8')
+
+    def __iter__(self):
+        data = self._data
+        start = 0
+        for end in self._ends:
+            yield data[start:end].decode('utf-8')
+            start = end
+
+    def append(self, value):
+        self._data += value.encode('utf-8')
+        self._ends.append(len(self._data))
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def take(self, indices):
+        """Новый столбец из строк с индексами indices (в их порядке)"""
+        result = PackedStrings()
+        data, ends = self._data, self._ends
+        for idx in np.asarray(indices, dtype=np.int64).tolist():
+            start = ends[idx - 1] if idx > 0 else 0
+            result._data += data[start:ends[idx]]
+            result._ends.append(len(result._data))
+        return result
+
+    def tolist(self):
+        return list(self)
+
+    @property
+    def nbytes(self):
+        """Размер данных столбца в байтах"""
+        return len(self._data) + self._ends.itemsize * len(self._ends)
+
+
+class WaypointBuffer:
+    """
+    Компактное колоночное хранилище точек маршрута
+
+    Координаты хранятся в непрерывных массивах float64 (array('d')), адреса —
+    упакованным столбцом UTF-8 (PackedStrings), необязательный спрос точек
+    (объём заказа для планирования нескольких машин) — тоже array('d'). Вместо словаря на каждую
+    точку — три колонки, что заметно экономит память на больших загрузках.
+    Порядок обхода применяется к буферу целиком (take) по перестановке
+    индексов, без промежуточных списков точек. Буфер сериализуется pickle
+    без разбора на отдельные объекты, поэтому дёшево передаётся между
+    процессами.
+    """
+
+    def __init__(self):
+        self.addresses = PackedStrings()
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.demands = None  # Колонка спроса, если задана
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    def __getitem__(self, idx):
+        return WaypointRecord(self.addresses[idx], self.latitudes[idx], self.longitudes[idx])
+
+    def __iter__(self):
+        return map(WaypointRecord, self.addresses, self.latitudes, self.longitudes)
+
+    def append(self, address, latitude, longitude):
+        self.addresses.append(address)
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+
+    def extend(self, addresses, latitudes, longitudes, demands=None):
+        """
+        Добавление пачки точек (координаты и спрос — массивы numpy или
+        последовательности float). Колонка спроса появляется при первой
+        пачке со спросом; у точек без спроса он нулевой.
+        """
+        count = len(self)
+        self.addresses.extend(addresses)
+        columns = [(self.latitudes, latitudes), (self.longitudes, longitudes)]
+        if demands is not None:
+            if self.demands is None:
+                self.demands = array('d', bytes(8 * count))
+            columns.append((self.demands, demands))
+        for column, values in columns:
+            if isinstance(values, np.ndarray):
+                column.frombytes(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+            else:
+                column.extend(values)
+        if self.demands is not None and len(self.demands) < len(self):
+            self.demands.frombytes(bytes(8 * (len(self) - len(self.demands))))
+
+    def coordinates(self):
+        """Массивы numpy широт и долгот без копирования данных"""
+        return (
+            np.frombuffer(self.latitudes, dtype=np.float64),
+            np.frombuffer(self.longitudes, dtype=np.float64)
+        )
+
+    def demand_values(self):
+        """Массив numpy спроса точек без копирования (None, если колонки нет)"""
+        if self.demands is None:
+            return None
+        return np.frombuffer(self.demands, dtype=np.float64)
+
+    def missing_coordinates(self):
+        """Индексы точек без координат (NaN) — их предстоит геокодировать"""
+        lats, lons = self.coordinates()
+        return np.flatnonzero(np.isnan(lats) | np.isnan(lons))
+
+    def set_coordinates(self, indices, latitudes, longitudes):
+        """Запись координат точек с индексами indices"""
+        lats, lons = self.coordinates()
+        lats[indices] = latitudes
+        lons[indices] = longitudes
+
+    def take(self, order):
+        """
+        Новый буфер из точек с индексами order в их порядке (например,
+        в порядке обхода маршрута)
+        """
+        order = np.asarray(order, dtype=np.int64)
+        lats, lons = self.coordinates()
+        buffer = WaypointBuffer()
+        buffer.addresses = self.addresses.take(order)
+        buffer.latitudes = array('d', lats[order].tobytes())
+        buffer.longitudes = array('d', lons[order].tobytes())
+        if self.demands is not None:
+            buffer.demands = array('d', self.demand_values()[order].tobytes())
+        return buffer
+
+    def remove(self, indices):
+        """Удаление точек с индексами indices (порядок остальных сохраняется)"""
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(indices, dtype=np.int64)] = False
+        if keep.all():
+            return
+        kept = self.take(np.flatnonzero(keep))
+        self.addresses, self.latitudes, self.longitudes = kept.addresses, kept.latitudes, kept.longitudes
+        self.demands = kept.demands
+
+    @property
+    def nbytes(self):
+        """Размер данных буфера в байтах"""
+        columns = len(self.latitudes) + len(self.longitudes) + len(self.demands or ())
+        return self.addresses.nbytes + self.latitudes.itemsize * columns
+
+    def to_dicts(self):
+        """Список словарей {'address', 'latitude', 'longitude'}"""
+        return [
+            {'address': address, 'latitude': lat, 'longitude': lon}
+            for address, lat, lon in zip(self.addresses, self.latitudes, self.longitudes)
+        ]
+
+    def to_payload(self):
+        """
+        Представление для сохранения в JSON (например, во входных данных задачи);
+        отсутствующие координаты — null
+        """
+        payload = {
+            'addresses': self.addresses.tolist(),
+            'latitudes': self.latitudes.tolist(),
+            'longitudes': self.longitudes.tolist(),
+        }
+        for idx in self.missing_coordinates().tolist():
+            payload['latitudes'][idx] = payload['longitudes'][idx] = None
+        if self.demands is not None:
+            payload['demands'] = self.demands.tolist()
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload):
+        buffer = cls()
+        # null превращается в NaN
+        demands = payload.get('demands')
+        buffer.extend(
+            payload['addresses'],
+            np.asarray(payload['latitudes'], dtype=np.float64),
+            np.asarray(payload['longitudes'], dtype=np.float64),
+            np.asarray(demands, dtype=np.float64) if demands is not None else None
+        )
+        return buffer
+
+    @classmethod
+    def from_dicts(cls, waypoints):
+        """Буфер из списка словарей {'address', 'latitude', 'longitude'}"""
+        buffer = cls()
+        buffer.extend(
+            [wp['address'] for wp in waypoints],
+            np.fromiter((wp['latitude'] for wp in waypoints), dtype=np.float64, count=len(waypoints)),
+            np.fromiter((wp['longitude'] for wp in waypoints), dtype=np.float64, count=len(waypoints))
+        )
+        return buffer
@@ -1,61 +1,319 @@
 import requests
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+import numpy as np
+
+from algorithms.cost_matrix import RoadMatrixProvider, DEFAULT_MAX_ROAD_KM
+from utils.metrics import metrics, timed
+from utils.response_cache import PersistentCache, cache_key
 
 load_dotenv()  # Загрузка переменных из .env
 
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 YANDEX_API_KEY = os.getenv('YANDEX_API_KEY')
 GEOCODER_URL = "https://geocode-maps.yandex.ru/1.x/"
-DIRECTIONS_URL = "https://api.routing.yandex.net/v2/route"
+# Адрес можно переопределить, например, для проверки на локальной заглушке
+DIRECTIONS_URL = os.getenv('YANDEX_DIRECTIONS_URL', "https://api.routing.yandex.net/v2/route")
+DISTANCE_MATRIX_URL = os.getenv('YANDEX_MATRIX_URL', "https://api.routing.yandex.net/v2/distancematrix")
 
+# Знаков после запятой в координатах ключа кэша (~0,1 м)
+CACHE_COORD_PRECISION = 6
 
-def get_route_by_roads(waypoints: List[Dict]) -> Optional[Dict]:
-    logger.debug(f"Запрос маршрута по дорогам для {len(waypoints)} точек")
-    logger.debug(f"Точки: {waypoints}")
+# Версия формата записей кэша (сырые метры и секунды по участку)
+CACHE_FORMAT = 2
+
+# Наибольшее число точек в одном запросе; длинные маршруты делятся на
+# участки, соседние участки имеют общую точку
+MAX_WAYPOINTS_PER_REQUEST = int(os.getenv('ROUTER_MAX_WAYPOINTS', 50))
+
+# Параллельные запросы участков и размер пула соединений
+ROUTER_WORKERS = int(os.getenv('ROUTER_WORKERS', 4))
+
+# Повторы при сетевых ошибках, 429 и 5xx: число повторов и экспоненциальная
+# задержка со случайным разбросом (секунды)
+MAX_RETRIES = int(os.getenv('ROUTER_MAX_RETRIES', 3))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+
+REQUEST_TIMEOUT = 10
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Постоянный кэш ответов: повторные просмотры маршрута не обращаются к API
+route_cache = PersistentCache(
+    os.getenv('ROUTER_CACHE_PATH', os.path.join('instance', 'router_cache.db')),
+    table='directions',
+    ttl=float(os.getenv('ROUTER_CACHE_TTL', 7 * 24 * 3600)),
+    stale_ttl=float(os.getenv('ROUTER_CACHE_STALE_TTL', 24 * 3600)),
+    max_bytes=int(os.getenv('ROUTER_CACHE_MAX_MB', 100)) * 1024 * 1024
+)
+
+# Кэш расстояний по дорогам между парами точек (для матрицы стоимостей)
+pair_cache = PersistentCache(
+    route_cache.path,
+    table='road_pairs',
+    ttl=route_cache.ttl,
+    stale_ttl=0,
+    max_bytes=route_cache.max_bytes
+)
+
+# Пары дальше этого расстояния по прямой (км) в матрице оцениваются, а не запрашиваются
+ROAD_MATRIX_MAX_KM = float(os.getenv('ROAD_MATRIX_MAX_KM', DEFAULT_MAX_ROAD_KM))
+
+
+class RouterStats:
+    """Счётчики обращений к API маршрутизации"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency, ok, retries):
+        with self._lock:
+            self.requests += 1
+            self.retries += retries
+            if not ok:
+                self.errors += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "avg_latency": self.total_latency / self.requests if self.requests else 0.0,
+                "max_latency": self.max_latency,
+            }
+
+
+class RouterClient:
+    """
+    Клиент API маршрутизации Яндекса: пул соединений с keep-alive, ограниченные повторы
+    с экспоненциальной задержкой и случайным разбросом, параллельный запрос
+    участков длинного маршрута
+    """
+
+    def __init__(self, workers: int = ROUTER_WORKERS, max_retries: int = MAX_RETRIES):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.stats = RouterStats()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='router')
+
+    def post(self, url: str, payload: Dict, service: str = 'directions') -> requests.Response:
+        """POST с JSON и повторами; исключение — если все попытки неудачны"""
+        return self.request('POST', url, service=service, json=payload)
+
+    def get(self, url: str, params: Dict, service: str = 'directions') -> requests.Response:
+        """GET с повторами; исключение — если все попытки неудачны"""
+        return self.request('GET', url, service=service, params=params)
+
+    def request(self, method: str, url: str, service: str = 'directions', **kwargs) -> requests.Response:
+        """Запрос с повторами; service — имя API в метриках"""
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+                if response.status_code not in _RETRY_STATUSES or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    self._record(service, started, True, attempt)
+                    return response
+                delay = self._retry_after(response)
+                logger.warning(f"Яндекс API ответил {response.status_code}, повтор {attempt + 1}")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    self._record(service, started, False, attempt)
+                    raise
+                delay = None
+                logger.warning(f"Ошибка соединения с Яндекс API ({e}), повтор {attempt + 1}")
+            except requests.RequestException:
+                self._record(service, started, False, attempt)
+                raise
+
+            time.sleep(delay if delay is not None else self._backoff(attempt))
+            attempt += 1
+
+    def _record(self, service, started, ok, retries):
+        latency = time.perf_counter() - started
+        self.stats.record(latency, ok, retries)
+        metrics.observe('external_request_seconds', latency, service=service)
+        metrics.inc('external_requests_total', service=service, outcome='ok' if ok else 'error')
+        if retries:
+            metrics.inc('external_retries_total', retries, service=service)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Задержка перед повтором: полный случайный разброс до экспоненты"""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> Optional[float]:
+        try:
+            return min(BACKOFF_MAX, float(response.headers['Retry-After']))
+        except (KeyError, ValueError):
+            return None
+
+    def map(self, func, items: List) -> List:
+        """Параллельное выполнение func для всех items с сохранением порядка"""
+        if len(items) == 1:
+            return [func(items[0])]
+        return list(self._executor.map(func, items))
+
+
+router_client = RouterClient()
+
+
+def router_stats() -> Dict:
+    """Счётчики запросов к API маршрутизации: число, ошибки, повторы, задержки"""
+    return router_client.stats.snapshot()
+
+
+def get_distance_matrix(origins: List, destinations: List, mode: str = "driving") -> np.ndarray:
+    """
+    Расстояния по дорогам между точками через Яндекс Distance Matrix API
+
+    Args:
+        origins, destinations: списки пар [широта, долгота]
+        mode: режим передвижения
+    Returns:
+        Массив (len(origins), len(destinations)) в км; NaN — пара не найдена
+    """
+    params = {
+        "apikey": YANDEX_API_KEY,
+        "origins": "|".join(f"{lat},{lon}" for lat, lon in origins),
+        "destinations": "|".join(f"{lat},{lon}" for lat, lon in destinations),
+        "mode": mode
+    }
+    data = router_client.get(DISTANCE_MATRIX_URL, params, service='distance_matrix').json()
+
+    result = np.full((len(origins), len(destinations)), np.nan)
+    for i, row in enumerate(data["rows"]):
+        for j, element in enumerate(row["elements"]):
+            if element.get("status") == "OK":
+                result[i, j] = element["distance"]["value"] / 1000
+    return result
+
+
+def road_matrix_provider(mode: str = "driving") -> RoadMatrixProvider:
+    """Источник стоимостей «расстояние по дорогам» с постоянным кэшем пар"""
+    return RoadMatrixProvider(
+        lambda origins, destinations: get_distance_matrix(origins, destinations, mode),
+        pair_cache=pair_cache,
+        mode=mode,
+        max_road_km=ROAD_MATRIX_MAX_KM,
+        workers=router_client.workers
+    )
+
+
+def split_segments(points: List, max_points: int = MAX_WAYPOINTS_PER_REQUEST) -> List[List]:
+    """Деление точек на участки не длиннее max_points с общими концами"""
+    step = max_points - 1
+    return [points[start:start + max_points] for start in range(0, len(points) - 1, step)]
+
+
+@timed('road_route')
+def get_route_by_roads(waypoints: List[Dict], mode: str = "driving") -> Optional[Dict]:
     """
     Построение маршрута по дорогам через Яндекс Directions API
+
+    Маршрут длиннее MAX_WAYPOINTS_PER_REQUEST точек запрашивается участками
+    параллельно и собирается обратно. Ответы по участкам кэшируются по
+    нормализованной последовательности точек и режиму.
+
     Args:
         waypoints: список {'latitude': float, 'longitude': float, 'address': str}
+        mode: режим передвижения (driving, walking, cycling)
     Returns:
         Словарь с данными маршрута или None при ошибке
     """
+    logger.debug(f"Запрос маршрута по дорогам для {len(waypoints)} точек")
     if len(waypoints) < 2:
         return None
 
     # Формируем точки маршрута в формате Яндекса
-    points = [{"lat": wp["latitude"], "lon": wp["longitude"]} for wp in waypoints]
+    points = [
+        {
+            "lat": round(float(wp["latitude"]), CACHE_COORD_PRECISION),
+            "lon": round(float(wp["longitude"]), CACHE_COORD_PRECISION)
+        }
+        for wp in waypoints
+    ]
+
+    segments = split_segments(points)
+    results = router_client.map(lambda segment: _cached_segment(segment, mode), segments)
+    if any(result is None for result in results):
+        return None
+
+    route = _stitch(results)
+    return {
+        "distance_km": round(route["distance"] / 1000, 2),
+        "duration_min": round(route["duration"] / 60, 1),
+        "geometry": route["geometry"],  # Массив координат для линии
+        "legs": route["legs"]  # Отрезки между точками
+    }
+
+
+def _cached_segment(points: List[Dict], mode: str) -> Optional[Dict]:
+    key = cache_key(CACHE_FORMAT, DIRECTIONS_URL, mode, [[p["lat"], p["lon"]] for p in points])
+    return route_cache.get_or_compute(key, lambda: _request_route(points, mode))
+
 
+def _stitch(results: List[Dict]) -> Dict:
+    """Склейка участков: общая точка на стыке геометрии не дублируется"""
+    route = {"distance": 0.0, "duration": 0.0, "geometry": [], "legs": []}
+    for result in results:
+        geometry = result["geometry"]
+        if route["geometry"] and geometry and geometry[0] == route["geometry"][-1]:
+            geometry = geometry[1:]
+        route["geometry"].extend(geometry)
+        route["legs"].extend(result["legs"])
+        route["distance"] += result["distance"]
+        route["duration"] += result["duration"]
+    return route
+
+
+def _request_route(points: List[Dict], mode: str) -> Optional[Dict]:
+    """Запрос участка маршрута к Directions API (без кэша)"""
     params = {
         "apikey": YANDEX_API_KEY,
         "waypoints": points,
-        "mode": "driving"  # driving, walking, cycling
+        "mode": mode
     }
 
     try:
-        response = requests.post(DIRECTIONS_URL, json=params, timeout=10)
+        response = router_client.post(DIRECTIONS_URL, params)
         logger.debug(f"Статус ответа Яндекс: {response.status_code}")
-        logger.debug(f"Ответ: {response.text[:500]}")  # Первые 500 символов
-        response.raise_for_status()
         data = response.json()
 
         # Извлекаем данные маршрута
         route = data["routes"][0]
-        distance_km = route["summary"]["distance"] / 1000
-        duration_min = route["summary"]["duration"] / 60
-
-        # Координаты для отрисовки линии маршрута
-        geometry = route["geometry"]
 
         return {
-            "distance_km": round(distance_km, 2),
-            "duration_min": round(duration_min, 1),
-            "geometry": geometry,  # Массив координат для линии
+            "distance": route["summary"]["distance"],  # Метры
+            "duration": route["summary"]["duration"],  # Секунды
+            "geometry": route["geometry"],  # Массив координат для линии
             "legs": route["legs"]  # Отрезки между точками
         }
 
@@ -63,4 +321,4 @@ def get_route_by_roads(waypoints: List[Dict]) -> Optional[Dict]:
         logger.error(f"Ошибка запроса к Яндекс API: {e}")
         logger.error(f"URL: {DIRECTIONS_URL}")
         logger.error(f"API Key present: {bool(YANDEX_API_KEY)}")
-        return None
\ No newline at end of file
+        return None